@@ -1,6 +1,12 @@
 # --- agent_logic.py ---
 
 import os
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -8,7 +14,11 @@ from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
 from langchain.tools.retriever import create_retriever_tool
 from langchain.agents import create_tool_calling_agent, AgentExecutor
-from langchain_core.messages import SystemMessage
+from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from pydantic import PrivateAttr
 
 # Check if the API key is set
 if not os.environ.get("GROQ_API_KEY"):
@@ -29,20 +39,119 @@ DUMMY_MEDICAL_KNOWLEDGE = """
   - For Diabetes: A1C test, Fasting blood sugar test.
 """
 
+# Persisted FAISS index (rebuilt only when the knowledge base text changes)
+INDEX_DIR = ".faiss_medical"
+INDEX_HASH_FILE = os.path.join(INDEX_DIR, "knowledge.sha256")
+
+# INT8-quantized ONNX export of MiniLM; set EMBEDDINGS_BACKEND=torch for the FP32 PyTorch model
+EMBEDDINGS_BACKEND = os.environ.get("EMBEDDINGS_BACKEND", "onnx")
+ONNX_MODEL_FILE = os.environ.get("ONNX_MODEL_FILE", "onnx/model_qint8_avx2.onnx")
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """Loads the MiniLM embedding model once per process (ONNX Runtime INT8 when available)."""
+    if EMBEDDINGS_BACKEND == "onnx":
+        try:
+            return HuggingFaceEmbeddings(
+                model_name="all-MiniLM-L6-v2",
+                model_kwargs={"device": "cpu", "backend": "onnx", "model_kwargs": {"file_name": ONNX_MODEL_FILE}}
+            )
+        except Exception as e:
+            print(f"WARNING: Could not load ONNX embeddings ({e}). Falling back to PyTorch.")
+    return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+
+def _knowledge_hash():
+    # Include the embedding backend so switching models rebuilds the index
+    key = f"{EMBEDDINGS_BACKEND}:{ONNX_MODEL_FILE}\0{DUMMY_MEDICAL_KNOWLEDGE}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
 def setup_medical_retriever():
     """
     Creates a RAG retriever from the medical knowledge base.
     This represents the "Medical Database Query".
+    The FAISS index is saved to INDEX_DIR and reloaded on later starts,
+    so the knowledge base is only re-embedded when its text changes.
     """
+    embeddings = get_embeddings()
+    knowledge_hash = _knowledge_hash()
+
+    if os.path.isdir(INDEX_DIR) and os.path.exists(INDEX_HASH_FILE):
+        with open(INDEX_HASH_FILE, "r", encoding="utf-8") as f:
+            stored_hash = f.read().strip()
+        if stored_hash == knowledge_hash:
+            try:
+                vector_store = FAISS.load_local(INDEX_DIR, embeddings, allow_dangerous_deserialization=True)
+                print(f"Loaded persisted medical index from {INDEX_DIR}.")
+                return vector_store.as_retriever()
+            except Exception as e:
+                print(f"WARNING: Could not load persisted index ({e}). Rebuilding.")
+
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
     docs = text_splitter.create_documents([DUMMY_MEDICAL_KNOWLEDGE])
     
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    
     vector_store = FAISS.from_documents(docs, embeddings)
+    vector_store.save_local(INDEX_DIR)
+    with open(INDEX_HASH_FILE, "w", encoding="utf-8") as f:
+        f.write(knowledge_hash)
+    print(f"Built and saved medical index to {INDEX_DIR}.")
     
     return vector_store.as_retriever()
 
+class CachedRetriever(BaseRetriever):
+    """
+    Wraps a retriever with an LRU cache keyed by the normalized query, so
+    repeated tool calls ("Flu symptoms", "flu symptoms ") skip re-embedding.
+    """
+    retriever: BaseRetriever
+    maxsize: int = 512
+    _cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    # Async tool calls run this retriever in executor threads
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        key = " ".join(query.lower().split())
+        with self._lock:
+            docs = self._cache.get(key)
+            if docs is not None:
+                self._cache.move_to_end(key)
+                return list(docs)
+        docs = self.retriever.invoke(key) # Outside the lock: a miss doesn't stall other lookups
+        with self._lock:
+            self._cache[key] = docs
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return list(docs)
+
+
+class FastPromptTemplate(ChatPromptTemplate):
+    """
+    ChatPromptTemplate for a single static human-message template. The literal
+    segments around the variables are split out once, so each format is a
+    plain join instead of a pass through the f-string parser.
+    """
+    _segments: list = PrivateAttr(default=None)
+
+    def _get_segments(self):
+        if self._segments is None:
+            template = self.messages[0].prompt.template
+            parts = re.split(r"\{(\w+)\}", template)
+            # Literal text sits at even indices, variable names at odd ones
+            literals = [p.replace("{{", "{").replace("}}", "}") for p in parts[0::2]]
+            self._segments = (literals, parts[1::2])
+        return self._segments
+
+    def format_messages(self, **kwargs):
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        literals, names = self._get_segments()
+        out = [literals[0]]
+        for name, literal in zip(names, literals[1:]):
+            out.append(str(kwargs[name]))
+            out.append(literal)
+        return [HumanMessage(content="".join(out))]
+
+    async def aformat_messages(self, **kwargs):
+        return self.format_messages(**kwargs)
+
 
 # --- 2. Agentic Nurse Setup ---
 #
@@ -111,7 +220,7 @@ def create_agentic_nurse(retriever):
     {agent_scratchpad}
     """
     
-    prompt = ChatPromptTemplate.from_template(prompt_template)
+    prompt = FastPromptTemplate.from_template(prompt_template)
     
     agent = create_tool_calling_agent(llm, tools, prompt)
     
@@ -120,8 +229,30 @@ def create_agentic_nurse(retriever):
     return agent_executor
 
 # --- Main setup logic ---
-print("Setting up medical knowledge base...")
-medical_retriever = setup_medical_retriever()
-print("Creating Agentic AI Nurse (using Groq)...")
-agent_nurse_executor = create_agentic_nurse(medical_retriever)
-print("Agent is ready.")
\ No newline at end of file
+# Built lazily (once per process) so importing this module stays instant;
+# main.py triggers it from a startup hook.
+_agent_nurse_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Returns the shared AgentExecutor, building the retriever and agent on first use."""
+    global _agent_nurse_executor
+    if _agent_nurse_executor is not None:
+        return _agent_nurse_executor
+    with _executor_lock:
+        if _agent_nurse_executor is None:
+            print("Setting up medical knowledge base...")
+            medical_retriever = CachedRetriever(retriever=setup_medical_retriever())
+            print("Creating Agentic AI Nurse (using Groq)...")
+            executor = create_agentic_nurse(medical_retriever)
+
+            # Run one dummy query through the embedder and retriever so the first real
+            # request doesn't pay the lazy tokenizer/model load.
+            try:
+                medical_retriever.invoke("warmup")
+                print("Retriever warmup complete.")
+            except Exception as e:
+                print(f"WARNING: Retriever warmup failed ({e}).")
+            _agent_nurse_executor = executor
+            print("Agent is ready.")
+    return _agent_nurse_executor
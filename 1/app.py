@@ -25,6 +25,11 @@ if "messages" not in st.session_state:
 # API endpoint
 FASTAPI_ENDPOINT = "http://127.0.0.1:8000/chat"
 
+@st.cache_resource
+def get_http_session():
+    """One keep-alive session to the API, shared across reruns"""
+    return requests.Session()
+
 # --- Chat Interface ---
 
 # Display past messages
@@ -41,18 +46,21 @@ if prompt := st.chat_input("Describe your symptoms..."):
 
     # --- Call Backend API ---
     try:
-        response = requests.post(
+        response = get_http_session().post(
             FASTAPI_ENDPOINT,
-            json={"user_id": st.session_state.user_id, "message": prompt}
+            json={"user_id": st.session_state.user_id, "message": prompt, "stream": True},
+            stream=True
         )
         response.raise_for_status()  # Raise an exception for bad status codes
-        
-        ai_response = response.json().get("response", "No response from server.")
+
+        # Render tokens as they arrive; write_stream returns the full text
+        with st.chat_message("assistant"):
+            ai_response = st.write_stream(response.iter_content(chunk_size=None, decode_unicode=True))
+        if not ai_response:
+            ai_response = "No response from server."
 
         # Add AI response to chat history
         st.session_state.messages.append({"role": "assistant", "content": ai_response})
-        with st.chat_message("assistant"):
-            st.markdown(ai_response)
             
     except requests.exceptions.RequestException as e:
         st.error(f"Could not connect to the AI Nurse API. Is it running? \n\nError: {e}")
\ No newline at end of file
@@ -1,21 +1,97 @@
 # --- main.py ---
 
+import asyncio
+import json
+import os
+import time
+from collections import deque
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from agent_logic import agent_nurse_executor  # Import the agent
+from agent_logic import get_executor  # Lazily builds the shared agent
 from langchain_core.messages import HumanMessage, AIMessage
 
 # Initialize the FastAPI app
 app = FastAPI()
 
-# In-memory store for chat histories (for demo purposes)
-# A real app would use MongoDB or another DB
+MAX_HISTORY_MESSAGES = 10
+SESSION_IDLE_TIMEOUT_SECONDS = 60 * 60
+SESSION_SWEEP_INTERVAL_SECONDS = 5 * 60
+
+# Chat histories live in Redis when REDIS_URL is set, so several uvicorn
+# workers can share sessions and idle keys expire via TTL.
+REDIS_URL = os.environ.get("REDIS_URL")
+redis_client = None
+if REDIS_URL:
+    try:
+        import redis.asyncio as aioredis
+        redis_client = aioredis.from_url(REDIS_URL)
+        print(f"Using Redis chat history store at {REDIS_URL}.")
+    except ImportError:
+        print("WARNING: REDIS_URL is set but the 'redis' package is not installed. Using in-memory chat history.")
+
+# Fallback in-memory store for chat histories (single worker / local demo)
+# user_id -> (last 10 messages, last-seen timestamp)
+# Messages are kept as plain {"role": "human"|"ai", "content": str} dicts and
+# only turned into LangChain message objects when handed to the agent.
 chat_histories = {}
 
+def to_messages(history: deque) -> list:
+    """Builds LangChain messages from the stored role/content dicts."""
+    return [
+        HumanMessage(content=m["content"]) if m["role"] == "human" else AIMessage(content=m["content"])
+        for m in history
+    ]
+
+async def load_history(user_id: str) -> deque:
+    """Returns the user's recent messages (empty for a new user)."""
+    if redis_client is not None:
+        raw = await redis_client.get(f"chat:{user_id}")
+        messages = json.loads(raw) if raw else []
+        # Skip entries written in the old LangChain message-dict format
+        messages = [m for m in messages if "role" in m]
+        return deque(messages, maxlen=MAX_HISTORY_MESSAGES)
+    if user_id in chat_histories:
+        return chat_histories[user_id][0]
+    # Bounded deque: old messages are evicted automatically (last 10 messages)
+    return deque(maxlen=MAX_HISTORY_MESSAGES)
+
+async def save_history(user_id: str, history: deque):
+    """Stores the user's history and refreshes its idle timeout."""
+    if redis_client is not None:
+        payload = json.dumps(list(history))
+        await redis_client.set(f"chat:{user_id}", payload, ex=SESSION_IDLE_TIMEOUT_SECONDS)
+    else:
+        chat_histories[user_id] = (history, time.monotonic())
+
+async def sweep_idle_sessions():
+    """Periodically drops in-memory histories of users who have been idle too long."""
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL_SECONDS)
+        cutoff = time.monotonic() - SESSION_IDLE_TIMEOUT_SECONDS
+        idle_users = [uid for uid, (_, last_seen) in chat_histories.items() if last_seen < cutoff]
+        for uid in idle_users:
+            del chat_histories[uid]
+        if idle_users:
+            print(f"Evicted {len(idle_users)} idle chat session(s).")
+
+# At most MAX_CONCURRENT_AGENT_CALLS agent runs at once, to avoid Groq TPM spikes
+MAX_CONCURRENT_AGENT_CALLS = 8
+agent_slots = asyncio.Semaphore(MAX_CONCURRENT_AGENT_CALLS)
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # Build the agent once per worker, off the event loop
+    await asyncio.to_thread(get_executor)
+    # Redis expires keys itself; only the in-memory store needs sweeping
+    if redis_client is None:
+        asyncio.create_task(sweep_idle_sessions())
+
 class ChatRequest(BaseModel):
     """Pydantic model for incoming chat requests"""
     user_id: str
     message: str
+    stream: bool = False  # stream tokens back as plain text instead of one JSON reply
 
 @app.post("/chat")
 async def chat(request: ChatRequest):
@@ -26,31 +102,68 @@ async def chat(request: ChatRequest):
     user_message = request.message
     
     # Get or create the chat history for the user
-    if user_id not in chat_histories:
-        chat_histories[user_id] = []
-    
-    chat_history = chat_histories[user_id]
+    chat_history = await load_history(user_id)
+
+    if request.stream:
+        return StreamingResponse(
+            stream_chat(user_id, user_message, chat_history),
+            media_type="text/plain"
+        )
     
     # Invoke the agent
-    response = await agent_nurse_executor.ainvoke({
-        "input": user_message,
-        "chat_history": chat_history
-    })
+    async with agent_slots:
+        response = await get_executor().ainvoke({
+            "input": user_message,
+            "chat_history": to_messages(chat_history)
+        })
     
     ai_response = response.get("output", "I am sorry, I had an error.")
     
     # Update the chat history
-    chat_history.append(HumanMessage(content=user_message))
-    chat_history.append(AIMessage(content=ai_response))
-    
-    # Limit history size (e.g., last 10 messages)
-    chat_histories[user_id] = chat_history[-10:]
+    chat_history.append({"role": "human", "content": user_message})
+    chat_history.append({"role": "ai", "content": ai_response})
+    await save_history(user_id, chat_history)
     
     return {"response": ai_response}
 
+async def stream_chat(user_id: str, user_message: str, chat_history: deque):
+    """
+    Yields the agent's LLM tokens as they arrive, then saves the turn once the
+    final answer is known.
+    """
+    tokens = []
+    ai_response = None
+    try:
+        async with agent_slots:
+            async for event in get_executor().astream_events(
+                {"input": user_message, "chat_history": to_messages(chat_history)},
+                version="v2"
+            ):
+                kind = event["event"]
+                if kind == "on_chat_model_stream":
+                    content = event["data"]["chunk"].content
+                    if content:
+                        tokens.append(content)
+                        yield content
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    # Top-level AgentExecutor run finished
+                    ai_response = event["data"]["output"].get("output")
+    except Exception as e:
+        print(f"Error while streaming agent response: {e}")
+        if not tokens:
+            yield "I am sorry, I had an error."
+        return
+
+    ai_response = ai_response or "".join(tokens) or "I am sorry, I had an error."
+    chat_history.append({"role": "human", "content": user_message})
+    chat_history.append({"role": "ai", "content": ai_response})
+    await save_history(user_id, chat_history)
+
 @app.get("/")
 def root():
     return {"status": "Agentic AI Nurse API is running"}
 
 # To run this file:
-# python -m uvicorn main:app --reload
\ No newline at end of file
+# python -m uvicorn main:app --reload
+# With REDIS_URL set, several workers can share chat state:
+# REDIS_URL=redis://localhost:6379 python -m uvicorn main:app --workers 4
\ No newline at end of file
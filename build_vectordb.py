@@ -1,6 +1,7 @@
 import os
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from sentence_transformers import SentenceTransformer
+import emb_cache
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 # --- THIS IS THE FIX ---
 from langchain_community.document_loaders import DirectoryLoader # Use DirectoryLoader for text files
@@ -9,6 +10,38 @@ from langchain_community.document_loaders import DirectoryLoader # Use Directory
 # Define paths
 KB_PATH = "knowledge_base"
 DB_PATH = "chroma_db"
+MODEL_NAME = "all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = 64
+# INT8-quantized ONNX export of MiniLM (published in the model repo); set
+# EMBEDDINGS_BACKEND=torch to use the original FP32 PyTorch weights instead.
+EMBEDDINGS_BACKEND = os.environ.get("EMBEDDINGS_BACKEND", "onnx")
+ONNX_MODEL_FILE = os.environ.get("ONNX_MODEL_FILE", "onnx/model_qint8_avx2.onnx")
+# Backend the index was built with ("torch" or "onnx/<file>"); main.py embeds queries the same way
+BACKEND_FILE = os.path.join(DB_PATH, "embeddings_backend.txt")
+
+# Approximate (HNSW) index settings for the Chroma collection.
+# Cosine space matches the normalized MiniLM sentence embeddings.
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 128,
+    "hnsw:search_ef": 64,
+    "hnsw:M": 16,
+}
+
+def load_embedding_model():
+    """
+    Loads MiniLM on CPU through ONNX Runtime (INT8) when available,
+    falling back to the PyTorch model. Returns (model, backend_key).
+    """
+    if EMBEDDINGS_BACKEND == "onnx":
+        try:
+            model = SentenceTransformer(MODEL_NAME, device='cpu', backend="onnx",
+                                        model_kwargs={"file_name": ONNX_MODEL_FILE})
+            return model, f"onnx/{ONNX_MODEL_FILE}"
+        except Exception as e:
+            print(f"WARNING: Could not load ONNX model ({e}). Falling back to PyTorch.")
+    model = SentenceTransformer(MODEL_NAME, device='cpu') # Force CPU, or 'cuda' if you have a GPU
+    return model, "torch"
 
 def build_vector_database():
     """
@@ -40,23 +73,43 @@ def build_vector_database():
     print(f"Split documents into {len(splits)} chunks.")
 
     # 3. Initialize the embeddings model (runs locally)
-    model_name = "all-MiniLM-L6-v2"
-    embeddings = HuggingFaceEmbeddings(
-        model_name=model_name,
-        model_kwargs={'device': 'cpu'} # Force CPU, or 'cuda' if you have a GPU
+    model, backend_key = load_embedding_model()
+    print(f"Loaded embeddings model: {MODEL_NAME} ({backend_key})")
+
+    # 4. Embed all chunks in batched forward passes (unchanged chunks come from the cache)
+    texts = [doc.page_content for doc in splits]
+    vectors = emb_cache.encode_cached(
+        model,
+        f"{MODEL_NAME}:{backend_key}", # Keep INT8 and FP32 vectors apart in the cache
+        texts,
+        batch_size=EMBED_BATCH_SIZE,
+        show_progress_bar=True,
+        normalize_embeddings=True
     )
-    print(f"Loaded embeddings model: {model_name}")
+    print(f"Embedded {len(texts)} chunks.")
 
-    # 4. Create and persist the vector database
+    # 5. Create the persistent vector database and add the precomputed vectors
     print(f"Building vector database at: {DB_PATH}")
-    vectordb = Chroma.from_documents(
-        documents=splits,
-        embedding=embeddings,
-        persist_directory=DB_PATH
+    vectordb = Chroma(
+        persist_directory=DB_PATH,
+        collection_metadata=HNSW_METADATA
     )
-    
-    vectordb.persist()
+    ids = [str(i) for i in range(len(texts))]
+    vectordb._collection.upsert(
+        ids=ids,
+        embeddings=vectors.tolist(),
+        documents=texts,
+        metadatas=[doc.metadata or None for doc in splits]
+    )
+    # Ids are positional: drop any left over from a previous, larger build
+    new_ids = set(ids)
+    stale_ids = [i for i in vectordb._collection.get(include=[])["ids"] if i not in new_ids]
+    if stale_ids:
+        vectordb._collection.delete(ids=stale_ids)
+        print(f"Removed {len(stale_ids)} stale chunk(s) from the previous build.")
+    with open(BACKEND_FILE, "w") as f:
+        f.write(backend_key)
     print(f"Successfully built and persisted vector database.")
 
 if __name__ == "__main__":
-    build_vector_database()
\ No newline at end of file
+    build_vector_database()
@@ -0,0 +1,61 @@
+import hashlib
+import sqlite3
+from typing import List, Optional
+
+import numpy as np
+
+# On-disk embedding cache, keyed by sha256(model_name + "\0" + text).
+# Vectors are stored as float16 bytes to halve disk usage.
+CACHE_PATH = "emb_cache.sqlite"
+
+_conn = None
+
+def _get_conn():
+    """Opens (and creates if needed) the cache database once per process."""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_PATH)
+        _conn.execute("CREATE TABLE IF NOT EXISTS emb (hash BLOB PRIMARY KEY, vec BLOB)")
+    return _conn
+
+def text_hash(model_name: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+
+def get(key: bytes) -> Optional[np.ndarray]:
+    """Returns the cached vector for a hash, or None on a miss."""
+    row = _get_conn().execute("SELECT vec FROM emb WHERE hash = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    return np.frombuffer(row[0], dtype=np.float16).astype(np.float32)
+
+def put(key: bytes, vec: np.ndarray):
+    """Stores a vector for a hash (overwrites any existing entry)."""
+    conn = _get_conn()
+    conn.execute("INSERT OR REPLACE INTO emb (hash, vec) VALUES (?, ?)",
+                 (key, np.asarray(vec, dtype=np.float16).tobytes()))
+    conn.commit()
+
+def encode_cached(model, model_name: str, texts: List[str], **encode_kwargs) -> np.ndarray:
+    """
+    Embeds texts with a SentenceTransformer model, only sending cache misses
+    through the model. Results are returned in the original order.
+    """
+    keys = [text_hash(model_name, t) for t in texts]
+    vectors: List[Optional[np.ndarray]] = [get(k) for k in keys]
+    miss_idx = [i for i, v in enumerate(vectors) if v is None]
+    print(f"Embedding cache: {len(texts) - len(miss_idx)} hits, {len(miss_idx)} misses.")
+
+    if miss_idx:
+        new_vecs = model.encode([texts[i] for i in miss_idx], convert_to_numpy=True, **encode_kwargs)
+        conn = _get_conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO emb (hash, vec) VALUES (?, ?)",
+            [(keys[i], np.asarray(v, dtype=np.float16).tobytes()) for i, v in zip(miss_idx, new_vecs)]
+        )
+        conn.commit()
+        for i, v in zip(miss_idx, new_vecs):
+            vectors[i] = np.asarray(v, dtype=np.float32)
+
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.vstack(vectors)
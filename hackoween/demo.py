@@ -1,13 +1,16 @@
 
 
 # demo.py - Single-User Continuous Monitor Simulation
-import requests
-import time
+import asyncio
+import aiohttp
 import random
 from typing import Dict, Any, List
 
 # --- Context for Single User P001 ---
 PATIENT_ID = "P001"
+# All simulated watch streams; each one posts concurrently every interval
+PATIENT_IDS = [PATIENT_ID]
+POST_INTERVAL_SECONDS = 60
 # P001: Post-MI. Custom Max HR: 110, BP_SYS: 150
 # Note: Ranges are slightly expanded to hit the new tiered logic
 NORMAL_HR_RANGE = (75, 95)
@@ -20,8 +23,11 @@ CRITICAL_BP_SYS_RANGE = (166, 185) # RED_CRITICAL range (above 165)
 
 # CRITICAL FIX: The endpoint to post data to
 API_URL = "http://127.0.0.1:8001/api/vitals/receive"
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=5)
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.1
 
-def generate_p001_vitals_payload():
+def generate_p001_vitals_payload(patient_id: str = PATIENT_ID):
     """Generates a random vital sign payload for P001, with a chance of hitting warning/critical tiers."""
     
     # 60% chance of being normal, 20% warning, 20% critical
@@ -53,34 +59,53 @@ def generate_p001_vitals_payload():
     bp_dia = random.randint(int(bp_sys * 0.4) + 20, int(bp_sys * 0.5) + 30)
 
     return {
-        "patient_id": PATIENT_ID,
+        "patient_id": patient_id,
         "hr": hr,
         "bp_sys": bp_sys,
         "bp_dia": bp_dia
     }
 
-print(f"--- Starting CONTINUOUS PERSONAL MONITORING for {PATIENT_ID} (30s interval) ---")
-i = 0
-while True:
-    i += 1
-    
-    data = generate_p001_vitals_payload()
-    
-    print(f"\n[{i}] Posting new data to log...")
-    print(f"    HR: {data['hr']} | BP: {data['bp_sys']}/{data['bp_dia']}")
-    
-    try:
-        # POST data to the receiving endpoint. This triggers logging/analysis on the server.
-        response = requests.post(API_URL, json=data)
-        
-        if response.status_code == 200:
-            print(f"-> LOG STATUS: Success (Post complete).")
-        else:
-            print(f"-> LOG FAILED: Server returned status {response.status_code}")
-        
-        # Pause for 30 seconds
-        time.sleep(60) 
-        
-    except requests.exceptions.ConnectionError:
-        print("\n!!! CRITICAL ERROR: FastAPI server is unreachable. Ensure 'python main.py' is running. !!!")
-        break
\ No newline at end of file
+async def post_vitals(session: aiohttp.ClientSession, data: Dict[str, Any]) -> int:
+    """POSTs one reading and returns the HTTP status code (retries transient failures)."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with session.post(API_URL, json=data) as response:
+                return response.status
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt))
+
+async def run_monitor():
+    """Posts one reading per patient stream concurrently, then waits for the next interval."""
+    print(f"--- Starting CONTINUOUS PERSONAL MONITORING for {', '.join(PATIENT_IDS)} ({POST_INTERVAL_SECONDS}s interval) ---")
+    i = 0
+    # One session = one shared connection pool for every stream
+    # (keep-alive sockets are reused across intervals instead of reconnecting per post)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=100), timeout=REQUEST_TIMEOUT) as session:
+        while True:
+            i += 1
+            batch = [generate_p001_vitals_payload(pid) for pid in PATIENT_IDS]
+
+            print(f"\n[{i}] Posting new data to log...")
+            for data in batch:
+                print(f"    {data['patient_id']} -> HR: {data['hr']} | BP: {data['bp_sys']}/{data['bp_dia']}")
+
+            try:
+                # POST data to the receiving endpoint. This triggers logging/analysis on the server.
+                statuses = await asyncio.gather(*(post_vitals(session, data) for data in batch))
+
+                for data, status in zip(batch, statuses):
+                    if status == 200:
+                        print(f"-> LOG STATUS ({data['patient_id']}): Success (Post complete).")
+                    else:
+                        print(f"-> LOG FAILED ({data['patient_id']}): Server returned status {status}")
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                print("\n!!! CRITICAL ERROR: FastAPI server is unreachable. Ensure 'python main.py' is running. !!!")
+                break
+
+            await asyncio.sleep(POST_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    asyncio.run(run_monitor())
@@ -1,15 +1,72 @@
 # main.py - Vitals Monitoring, Alerting, and Logging Service
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 import json
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 from datetime import datetime
+import os
+import time
+import numpy as np
+import orjson
 import uvicorn
 
+# Optional: Numba JIT for batch alert scoring (falls back to NumPy if not installed)
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# --- Columnar Per-Patient Vitals Log ---
+class PatientLog:
+    """Struct-of-arrays log of one patient's readings (one column per vital)."""
+
+    def __init__(self, cap: int = 4096):
+        self.timestamps = np.empty(cap, dtype=np.int64) # epoch nanoseconds
+        self.hr = np.empty(cap, dtype=np.int16)
+        self.bp_sys = np.empty(cap, dtype=np.int16)
+        self.bp_dia = np.empty(cap, dtype=np.int16)
+        self.n = 0
+
+    def __len__(self) -> int:
+        return self.n
+
+    def append(self, timestamp: int, hr: int, bp_sys: int, bp_dia: int):
+        if self.n == self.hr.shape[0]:
+            # Double capacity when full (amortized O(1) appends)
+            new_cap = self.n * 2
+            self.timestamps = np.resize(self.timestamps, new_cap)
+            self.hr = np.resize(self.hr, new_cap)
+            self.bp_sys = np.resize(self.bp_sys, new_cap)
+            self.bp_dia = np.resize(self.bp_dia, new_cap)
+        self.timestamps[self.n] = timestamp
+        self.hr[self.n] = hr
+        self.bp_sys[self.n] = bp_sys
+        self.bp_dia[self.n] = bp_dia
+        self.n += 1
+
+    def to_readings(self, raw_timestamps: bool = False, start: int = 0, stop: int = None) -> List[Dict[str, Any]]:
+        """
+        Rebuilds the row-oriented readings list (optionally a [start:stop] slice) returned to the UI.
+        Timestamps are formatted here (on egress) unless raw epoch-ns ints are requested.
+        """
+        stop = self.n if stop is None else min(stop, self.n)
+        timestamps = self.timestamps[start:stop].tolist()
+        if not raw_timestamps:
+            timestamps = [format_timestamp(ts) for ts in timestamps]
+        return [
+            {"timestamp": ts, "hr": hr, "bp_sys": sys, "bp_dia": dia}
+            for ts, hr, sys, dia in zip(timestamps, self.hr[start:stop].tolist(), self.bp_sys[start:stop].tolist(), self.bp_dia[start:stop].tolist())
+        ]
+
+def format_timestamp(ts_ns: int) -> str:
+    """Formats an epoch-nanosecond timestamp the way the UI expects (local time)."""
+    return datetime.fromtimestamp(ts_ns / 1e9).strftime("%Y-%m-%d %H:%M:%S")
+
 # --- Global In-Memory Database (Simulates Persistence) ---
 # Stores the data history for all patients
-PATIENT_LOGS: Dict[str, List[Dict[str, Any]]] = {}
+PATIENT_LOGS: Dict[str, PatientLog] = {}
 
 # --- Load the Context Database ---
 def load_patient_data_lookup():
@@ -23,7 +80,13 @@ def load_patient_data_lookup():
         return {}
 
 PATIENT_CONTEXT_DB = load_patient_data_lookup()
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Histories longer than this are streamed in blocks instead of encoded in one go
+HISTORY_STREAM_THRESHOLD = 5000
+HISTORY_STREAM_BLOCK = 1000
+# The UI polls every few seconds, so second-level freshness is enough
+HISTORY_CACHE_HEADERS = {"Cache-Control": "max-age=1"}
 
 # --- CORS Configuration (CRITICAL FIX for UI) ---
 # Allows the browser (running on 'null' origin when opened locally) to talk to FastAPI
@@ -43,51 +106,102 @@ app.add_middleware(
 )
 
 # --- Data Model for Incoming Vitals ---
+# Bounded to the int16 PatientLog columns, so out-of-range input is a 422 rather than an OverflowError
+VITAL_MAX = int(np.iinfo(np.int16).max)
+
 class VitalsData(BaseModel):
     patient_id: str
-    hr: int
-    bp_sys: int
-    bp_dia: int
+    hr: int = Field(ge=0, le=VITAL_MAX)
+    bp_sys: int = Field(ge=0, le=VITAL_MAX)
+    bp_dia: int = Field(ge=0, le=VITAL_MAX)
 
 # --- TIERED MONITORING LOGIC (The Core Agent Analysis) ---
+# Tier index -> flag. A reading's tier is the number of thresholds it exceeds.
+FLAG_NAMES = np.array(["GREEN_STABLE", "YELLOW_WARNING", "ORANGE_DANGER", "RED_CRITICAL"])
+
+JUSTIFICATIONS = {
+    "GREEN_STABLE": "Vitals are within acceptable patient-specific range. Monitoring continues.",
+    "YELLOW_WARNING": ("WARNING TIER 2: Vitals ({hr} bpm / {bp_sys} mmHg) have exceeded managed baseline. "
+                       "Monitor closely and confirm reading in 5 minutes."),
+    "ORANGE_DANGER": ("DANGER TIER 3: HR ({hr} bpm) or Systolic BP ({bp_sys} mmHg) is significantly elevated. "
+                      "Notify care team for urgent re-assessment."),
+    "RED_CRITICAL": ("EMERGENCY TIER 4: HR ({hr} bpm) or Systolic BP ({bp_sys} mmHg) critically exceeds "
+                     "safe limits. IMMEDIATE intervention required for post-MI patient."),
+}
+
+def build_thresholds(context_db: Dict[str, Dict[str, Any]]) -> Dict[str, Tuple[int, int, int, int, int, int]]:
+    """
+    Precomputes each patient's tier thresholds once at startup:
+    (hr YELLOW, hr ORANGE, hr RED, bp YELLOW, bp ORANGE, bp RED).
+    """
+    thresholds = {}
+    for pid, ctx in context_db.items():
+        b = ctx['custom_vitals_baseline']
+        thresholds[pid] = (b['HR_MAX'], b['HR_MAX'] + 2, b['HR_MAX'] + 10,
+                           b['BP_SYS_MAX'], b['BP_SYS_MAX'] + 5, b['BP_SYS_MAX'] + 15)
+    return thresholds
+
+THRESHOLDS = build_thresholds(PATIENT_CONTEXT_DB)
+
+if njit is not None:
+    @njit(cache=True, parallel=True)
+    def _score_tiers_jit(hr, bp, thr, out):
+        for i in prange(hr.shape[0]):
+            h = hr[i]
+            b = bp[i]
+            t = 0
+            if h > thr[0] or b > thr[3]: t = 1
+            if h > thr[1] or b > thr[4]: t = 2
+            if h > thr[2] or b > thr[5]: t = 3
+            out[i] = t
+else:
+    _score_tiers_jit = None
+
+def score_vitals_batch(t: Tuple[int, ...], hr: np.ndarray, bp_sys: np.ndarray) -> np.ndarray:
+    """Scores many readings at once and returns an array of tier indices (0-3)."""
+    if _score_tiers_jit is not None:
+        out = np.empty(hr.shape[0], dtype=np.int8)
+        _score_tiers_jit(hr, bp_sys, np.asarray(t, dtype=np.int64), out)
+        return out
+    # side='left' counts thresholds strictly below the value, i.e. "value > threshold"
+    hr_tier = np.searchsorted(np.asarray(t[:3]), hr, side='left')
+    bp_tier = np.searchsorted(np.asarray(t[3:]), bp_sys, side='left')
+    return np.maximum(hr_tier, bp_tier)
+
+def warmup_batch_scorer():
+    """Runs the batch scorer once so the first real request doesn't pay JIT compile cost."""
+    if _score_tiers_jit is None:
+        print("INFO: Numba not installed. Batch scoring uses NumPy.")
+        return
+    sample = np.zeros(1, dtype=np.int16)
+    score_vitals_batch((0, 0, 0, 0, 0, 0), sample, sample)
+    print("INFO: Numba batch scorer compiled.")
+
+warmup_batch_scorer()
+
 def check_vitals_for_alert(patient_id: str, vitals: Dict[str, Any]) -> Dict[str, Any]:
     """Checks vitals against custom patient baselines to generate a tiered alert."""
-    context = PATIENT_CONTEXT_DB.get(patient_id)
+    t = THRESHOLDS.get(patient_id)
     
-    if not context:
+    if t is None:
         return {"flag_color": "ERROR", "justification": f"Patient {patient_id} context missing from database."}
 
-    baseline = context['custom_vitals_baseline']
     hr, bp_sys = vitals['hr'], vitals['bp_sys']
-    
-    flag = "GREEN_STABLE"
-    justification = "Vitals are within acceptable patient-specific range. Monitoring continues."
-    
-    # Tier 4: RED CRITICAL (Immediate danger)
-    if hr > baseline['HR_MAX'] + 10 or bp_sys > baseline['BP_SYS_MAX'] + 15:
-        flag = "RED_CRITICAL"
-        justification = (f"EMERGENCY TIER 4: HR ({hr} bpm) or Systolic BP ({bp_sys} mmHg) critically exceeds "
-                         f"safe limits. IMMEDIATE intervention required for post-MI patient.")
-
-    # Tier 3: ORANGE DANGER (Serious concern)
-    elif hr > baseline['HR_MAX'] + 2 or bp_sys > baseline['BP_SYS_MAX'] + 5:
-        flag = "ORANGE_DANGER"
-        justification = (f"DANGER TIER 3: HR ({hr} bpm) or Systolic BP ({bp_sys} mmHg) is significantly elevated. "
-                         f"Notify care team for urgent re-assessment.")
-
-    # Tier 2: YELLOW WARNING (Requires attention)
-    elif hr > baseline['HR_MAX'] or bp_sys > baseline['BP_SYS_MAX']:
-        flag = "YELLOW_WARNING"
-        justification = (f"WARNING TIER 2: Vitals ({hr} bpm / {bp_sys} mmHg) have exceeded managed baseline. "
-                         f"Monitor closely and confirm reading in 5 minutes.")
-        
-    # Tier 1: GREEN STABLE (Normal)
-    # If not triggered above, it remains "GREEN_STABLE"
+
+    # Single reading: plain integer compares against the precomputed tuple
+    if hr > t[2] or bp_sys > t[5]:
+        flag = "RED_CRITICAL"        # Tier 4: Immediate danger
+    elif hr > t[1] or bp_sys > t[4]:
+        flag = "ORANGE_DANGER"       # Tier 3: Serious concern
+    elif hr > t[0] or bp_sys > t[3]:
+        flag = "YELLOW_WARNING"      # Tier 2: Requires attention
+    else:
+        flag = "GREEN_STABLE"        # Tier 1: Normal
 
     return {
         "patient_id": patient_id,
         "flag_color": flag,
-        "justification": justification,
+        "justification": JUSTIFICATIONS[flag].format(hr=hr, bp_sys=bp_sys),
         "vitals_received": vitals
     }
 
@@ -95,18 +209,12 @@ def check_vitals_for_alert(patient_id: str, vitals: Dict[str, Any]) -> Dict[str,
 def log_vitals_data(patient_id: str, vitals: Dict[str, Any]):
     """Logs the incoming vital signs data to the in-memory log."""
     
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = {
-        "timestamp": timestamp,
-        "hr": vitals['hr'],
-        "bp_sys": vitals['bp_sys'],
-        "bp_dia": vitals['bp_dia']
-    }
+    timestamp = time.time_ns() # Formatted lazily in get_patient_history
     
     if patient_id not in PATIENT_LOGS:
-        PATIENT_LOGS[patient_id] = []
+        PATIENT_LOGS[patient_id] = PatientLog()
         
-    PATIENT_LOGS[patient_id].append(log_entry)
+    PATIENT_LOGS[patient_id].append(timestamp, vitals['hr'], vitals['bp_sys'], vitals['bp_dia'])
     print(f"INFO: Logged data for {patient_id}. Total entries: {len(PATIENT_LOGS[patient_id])}")
 
 
@@ -130,18 +238,61 @@ async def receive_vitals(vitals: VitalsData):
 
 
 @app.get("/api/vitals/history/{patient_id}")
-async def get_patient_history(patient_id: str):
-    """Provides the full historical log for a patient (used by the UI polling)."""
+async def get_patient_history(patient_id: str, raw_timestamps: bool = False):
+    """
+    Provides the full historical log for a patient (used by the UI polling).
+    Pass raw_timestamps=true to get epoch-nanosecond ints instead of formatted strings.
+    """
     
     # We retrieve the history *without* logging, avoiding the infinite loop bug.
     if patient_id in PATIENT_LOGS:
-        return {
+        log = PATIENT_LOGS[patient_id]
+        total = len(log)
+        if total > HISTORY_STREAM_THRESHOLD:
+            return StreamingResponse(
+                stream_history_json(patient_id, log, total, raw_timestamps),
+                media_type="application/json",
+                headers=HISTORY_CACHE_HEADERS
+            )
+        return ORJSONResponse({
             "patient_id": patient_id,
-            "total_readings": len(PATIENT_LOGS[patient_id]),
-            "readings": PATIENT_LOGS[patient_id]
-        }
-    return {"patient_id": patient_id, "total_readings": 0, "readings": []}
+            "total_readings": total,
+            "readings": log.to_readings(raw_timestamps)
+        }, headers=HISTORY_CACHE_HEADERS)
+    return ORJSONResponse({"patient_id": patient_id, "total_readings": 0, "readings": []}, headers=HISTORY_CACHE_HEADERS)
+
+def stream_history_json(patient_id: str, log: PatientLog, total: int, raw_timestamps: bool):
+    """Yields the history response body block by block (same JSON shape as the small-log path)."""
+    yield orjson.dumps({"patient_id": patient_id, "total_readings": total})[:-1] + b',"readings":['
+    for start in range(0, total, HISTORY_STREAM_BLOCK):
+        block = orjson.dumps(log.to_readings(raw_timestamps, start, min(start + HISTORY_STREAM_BLOCK, total)))[1:-1]
+        yield (b',' if start else b'') + block
+    yield b']}'
+
+
+@app.get("/api/vitals/flags/{patient_id}")
+async def get_patient_flags(patient_id: str):
+    """Re-scores the patient's full logged history in one vectorized pass."""
+    t = THRESHOLDS.get(patient_id)
+    if t is None:
+        raise HTTPException(status_code=404, detail=f"Patient {patient_id} context missing from database.")
+    log = PATIENT_LOGS.get(patient_id)
+    if not log:
+        return {"patient_id": patient_id, "flags": []}
+    tiers = score_vitals_batch(t, log.hr[:log.n], log.bp_sys[:log.n])
+    return {"patient_id": patient_id, "flags": FLAG_NAMES[tiers].tolist()}
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # PATIENT_LOGS lives in process memory, so each worker keeps its own logs;
+    # only raise WEB_CONCURRENCY once the logs move to a shared store.
+    # loop/http "auto" pick uvloop and httptools when they are installed.
+    uvicorn.run(
+        "rts_main:app",
+        host="0.0.0.0",
+        port=8001,
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop="auto",
+        http="auto",
+        access_log=False
+    )
@@ -1,12 +1,23 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import os
+import json
+import html
 import pandas as pd
+import numpy as np
+import pyarrow as pa # Installed with Streamlit
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 from datetime import datetime, timedelta, date
 # import plotly.express as px # Not used
 # import plotly.graph_objects as go # Not used
 
 # Configuration
 API_URL = "http://localhost:8002" # Ensure this matches your backend port
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
 st.set_page_config(
     page_title="Nurse Admin Dashboard",
     page_icon="🏥",
@@ -14,121 +25,457 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS
-st.markdown("""
-<style>
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        color: #1f77b4;
-        text-align: center;
-        padding: 1rem 0;
-        border-bottom: 3px solid #1f77b4;
-        margin-bottom: 2rem;
-    }
-    .metric-card {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 1.5rem;
-        border-radius: 10px;
-        color: white;
-        text-align: center;
-        box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-    }
-    .alert-box {
-        padding: 1rem;
-        border-radius: 8px;
-        margin: 0.5rem 0;
-        color: #333; /* Ensure text is readable */
-    }
-    .alert-warning {
-        background-color: #fff3cd;
-        border-left: 4px solid #ffc107;
-    }
-    .alert-danger {
-        background-color: #f8d7da;
-        border-left: 4px solid #dc3545;
-    }
-    /* Style for buttons *inside* a form (like submit) */
-    div[data-testid="stForm"] .stButton>button {
-        width: 100%;
-        background-color: #1f77b4;
-        color: white;
-        border-radius: 8px;
-        padding: 0.5rem 1rem;
-        border: none;
-        font-weight: bold;
-        transition: background-color 0.2s;
-    }
-    div[data-testid="stForm"] .stButton>button:hover {
-        background-color: #1557a0;
-        cursor: pointer;
-    }
-    /* Style for buttons *outside* a form (like Add/Remove Item) */
-    div:not([data-testid="stForm"]) > .stButton>button {
-        background-color: #007bff; /* Different color for distinction */
-        color: white;
-        border-radius: 8px;
-        padding: 0.5rem 1rem;
-        border: none;
-        font-weight: bold;
-        transition: background-color 0.2s;
-    }
-    div:not([data-testid="stForm"]) > .stButton>button:hover {
-        background-color: #0056b3;
-        cursor: pointer;
-    }
-    /* Improve Expander styling */
-     .stExpander > div:first-child > details > summary {
-        font-weight: bold;
-     }
-</style>
-""", unsafe_allow_html=True)
+# Custom CSS (static/custom.css). With static serving enabled (see .streamlit/config.toml)
+# the browser fetches and caches it once; otherwise it is inlined on each run.
+CSS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "custom.css")
+
+@st.cache_resource
+def _load_css():
+    with open(CSS_FILE, encoding="utf-8") as f: return f.read()
+
+if st.get_option("server.enableStaticServing"):
+    st.markdown('<link rel="stylesheet" href="app/static/custom.css">', unsafe_allow_html=True)
+else:
+    st.markdown(f"<style>\n{_load_css()}</style>", unsafe_allow_html=True)
 
 # Utility Functions
+@st.cache_resource
+def _http_session():
+    """One keep-alive connection pool to the backend, shared across reruns"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32,
+                          max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504],
+                                            allowed_methods=["GET"], raise_on_status=False))
+    session.mount("http://", adapter); session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def _etag_store():
+    """(url, params, accept) -> (ETag, raw body, content-type) of the last GET that sent an ETag"""
+    return {}
+
 def make_request(method, endpoint, **kwargs):
-    """Make API request with error handling"""
+    """Make API request with error handling (GETs revalidate with If-None-Match when the server sent an ETag)"""
     try:
         url = f"{API_URL}{endpoint}"
-        response = requests.request(method, url, **kwargs, timeout=15) # Increased timeout slightly
-        response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
-        try:
-            return response.json()
-        except requests.exceptions.JSONDecodeError:
-            if response.status_code in [200, 204]:
-                return {"message": "Success (No content)"}
-            else:
-                 st.error(f"❌ API Error: Received non-JSON response (Status: {response.status_code})")
-                 return None
+        etag_key = etag_entry = None
+        if method == "GET":
+            headers = dict(kwargs.pop('headers', None) or {})
+            etag_key = (url, repr(kwargs.get('params')), headers.get('Accept'))
+            etag_entry = _etag_store().get(etag_key)
+            if etag_entry: headers["If-None-Match"] = etag_entry[0]
+            kwargs['headers'] = headers
+        response = _http_session().request(method, url, **kwargs, timeout=15) # Increased timeout slightly
     except requests.exceptions.ConnectionError:
         st.error(f"❌ Cannot connect to API at {API_URL}. Is the backend ('main.py') running on port 8002?")
         return None
     except requests.exceptions.Timeout:
         st.error("⏱️ API Request timed out. The server might be busy or unresponsive.")
         return None
-    except requests.exceptions.HTTPError as e:
-        detail = "Unknown error"
-        try: detail = e.response.json().get('detail', f"HTTP Status {e.response.status_code}")
-        except: detail = f"HTTP Status {e.response.status_code}"
+    except Exception as e:
+        st.error(f"❌ An unexpected error occurred: {str(e)}")
+        return None
+    # Branch on the status code directly rather than raise_for_status() + except
+    if response.status_code >= 400:
+        try: detail = response.json().get('detail', f"HTTP Status {response.status_code}")
+        except (ValueError, AttributeError): detail = f"HTTP Status {response.status_code}"
         st.error(f"❌ API Error: {detail}")
         return None
+    if method != "GET": st.cache_data.clear() # Any successful write invalidates cached reads
+    if response.status_code == 304 and etag_entry:
+        content, content_type = etag_entry[1], etag_entry[2] # Not modified: reuse the stored body
+    else:
+        content, content_type = response.content, response.headers.get('content-type', '')
+        if etag_key and response.headers.get('ETag'):
+            _etag_store()[etag_key] = (response.headers['ETag'], content, content_type)
+    try:
+        if content_type.startswith(ARROW_MEDIA_TYPE):
+            return pa.ipc.open_stream(content).read_pandas()
+        return json.loads(content)
+    except ValueError:
+        if response.status_code in [200, 204]:
+            return {"message": "Success (No content)"}
+        st.error(f"❌ API Error: Received non-JSON response (Status: {response.status_code})")
+        return None
+    except Exception as e:
+        st.error(f"❌ An unexpected error occurred: {str(e)}")
+        return None
+
+def stream_request(endpoint, **kwargs):
+    """POST that returns the open streaming response (or None after showing the error); early exits still come back as JSON"""
+    try:
+        # Uncompressed, so tokens aren't held back in a gzip buffer
+        response = _http_session().post(f"{API_URL}{endpoint}", **kwargs, stream=True, timeout=60, headers={"Accept-Encoding": "identity"})
+    except requests.exceptions.ConnectionError:
+        st.error(f"❌ Cannot connect to API at {API_URL}. Is the backend ('main.py') running on port 8002?")
+        return None
+    except requests.exceptions.Timeout:
+        st.error("⏱️ API Request timed out. The server might be busy or unresponsive.")
+        return None
     except Exception as e:
         st.error(f"❌ An unexpected error occurred: {str(e)}")
         return None
+    if response.status_code >= 400:
+        try: detail = response.json().get('detail', f"HTTP Status {response.status_code}")
+        except (ValueError, AttributeError): detail = f"HTTP Status {response.status_code}"
+        st.error(f"❌ API Error: {detail}")
+        return None
+    response.encoding = response.encoding or 'utf-8' # Text chunks are decoded as they arrive
+    return response
+
+class _FetchFailed(Exception):
+    """Raised inside the cached fetch so failed requests are never cached."""
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_get(endpoint, params=None):
+    result = make_request("GET", endpoint, params=params)
+    if result is None: raise _FetchFailed(endpoint)
+    return result
+
+def cached_get(endpoint, params=None):
+    """GET through a 30s cache so widget reruns skip the HTTP round-trip (None on failure)"""
+    try: return _cached_get(endpoint, params)
+    except _FetchFailed: return None
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_table(endpoint):
+    result = make_request("GET", endpoint, headers={"Accept": f"{ARROW_MEDIA_TYPE}, application/json;q=0.9"})
+    if result is None: raise _FetchFailed(endpoint)
+    return result if isinstance(result, pd.DataFrame) else pd.DataFrame(result)
+
+def cached_table(endpoint):
+    """Tabular GET as a DataFrame, sent as Arrow when the backend supports it (None on failure)"""
+    try: return _cached_table(endpoint)
+    except _FetchFailed: return None
+
+def table_record(row):
+    """DataFrame row dict -> plain dict (missing/NaN values dropped, array cells as lists)"""
+    record = {}
+    for key, value in row.items():
+        if isinstance(value, np.ndarray): value = value.tolist()
+        elif value is None or (isinstance(value, float) and value != value): continue
+        record[key] = value
+    return record
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _fetch_inventory():
+    """Inventory page bundle (items, filter table, categories, low stock, expiring), derived once per fetch"""
+    page_data = make_request("GET", "/page/inventory", params={"days": 30})
+    if page_data is None: raise _FetchFailed("/page/inventory")
+    items = [i for i in page_data.get('items', []) if isinstance(i, dict)]
+    # Filter columns, one row per item in the same order, so the tab filters are boolean masks
+    items_df = pd.DataFrame({
+        'name_l': [i.get('item_name', '').lower() for i in items],
+        'mfr_l': [i.get('manufacturer', '').lower() for i in items],
+        'category': [i.get('category', 'Other') for i in items],
+        'is_low': [bool(i.get('is_low_stock')) for i in items],
+    })
+    return items, items_df, page_data.get('categories', []), page_data.get('low_stock', []), page_data.get('expiring', [])
 
+def fetch_inventory():
+    """Cached (items, items_df, categories, low_stock, expiring); all None on failure"""
+    try: return _fetch_inventory()
+    except _FetchFailed: return None, None, None, None, None
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _fetch_bill_item_options():
+    """Billable items keyed by their selectbox label, built once per fetch rather than per rerun"""
+    items = make_request("GET", "/inventory/available")
+    if items is None: raise _FetchFailed("/inventory/available")
+    options = {f"{item['item_name']} ({item['manufacturer']}) - {format_currency(item['price'])} | Stock: {item['quantity_available']}": item for item in items}
+    return options, list(options.keys())
+
+def fetch_bill_item_options():
+    """Cached (label -> item, labels); ({}, []) on failure"""
+    try: return _fetch_bill_item_options()
+    except _FetchFailed: return {}, []
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _fetch_roster(endpoint):
+    """Roster entries with sort keys filled in, sorted once by (shift_date, start_time)"""
+    entries = make_request("GET", endpoint)
+    if entries is None: raise _FetchFailed(endpoint)
+    entries = [e for e in entries if isinstance(e, dict)]
+    for entry in entries:
+        entry['shift_date'] = entry.get('shift_date') or 'Unknown Date'
+        entry['start_time'] = entry.get('start_time') or '' # Untimed shifts sort first
+    entries.sort(key=itemgetter('shift_date', 'start_time'))
+    return entries
+
+def fetch_roster(endpoint):
+    """Cached, presorted roster entries (None on failure)"""
+    try: return _fetch_roster(endpoint)
+    except _FetchFailed: return None
+
+def protocol_category(p): return p.get('category') or 'General'
+def protocol_sort_key(p): return (protocol_category(p), p.get('title') or '')
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _fetch_protocols():
+    """Protocol list plus one lowercased title/category/tags blob per protocol, built once per fetch"""
+    protocols = make_request("GET", "/protocols/")
+    if protocols is None: raise _FetchFailed("/protocols/")
+    # Sorted once by (category, title) so the list tab can groupby without re-sorting
+    protocols = sorted((p for p in protocols if isinstance(p, dict)), key=protocol_sort_key)
+    # Newline-joined so a search (single-line text input) never matches across fields
+    blobs = [f"{p.get('title', '')}\n{p.get('category', '')}\n{p.get('tags', '')}".lower() for p in protocols]
+    return protocols, blobs
+
+def fetch_protocols():
+    """Cached (protocols, search_blobs); (None, None) on failure"""
+    try: return _fetch_protocols()
+    except _FetchFailed: return None, None
+
+@lru_cache(maxsize=4096)
 def format_currency(amount):
-    """Format amount as Indian Rupee"""
+    """Format amount as Indian Rupee (memoized; the same amounts repeat across rows and reruns)"""
     if amount is None: return "₹0.00"
     try: return f"₹{float(amount):,.2f}"
     except (ValueError, TypeError): return "₹ N/A"
 
+@lru_cache(maxsize=4096)
+def _parse_iso(date_str):
+    return datetime.fromisoformat(date_str.replace('Z', '+00:00') if date_str.endswith('Z') else date_str)
+
+@lru_cache(maxsize=4096)
 def format_date(date_str, fmt="%d %b %Y"):
-    """Format ISO date/datetime string"""
+    """Format ISO date/datetime string (memoized per string and format)"""
     if not date_str: return "N/A"
-    try:
-        date_str = date_str.replace('Z', '+00:00')
-        dt_obj = datetime.fromisoformat(date_str)
-        return dt_obj.strftime(fmt)
-    except (ValueError, TypeError): return date_str
+    try: return _parse_iso(date_str).strftime(fmt)
+    except (ValueError, TypeError, AttributeError): return date_str
+
+@lru_cache(maxsize=512)
+def format_day(date_str):
+    """Roster day heading, e.g. 'Monday, 06 Jan 2025' (parsed once per distinct date)"""
+    try: return date.fromisoformat(date_str.split('T')[0]).strftime("%A, %d %b %Y")
+    except (ValueError, TypeError, AttributeError): return date_str
+
+# Display labels (anything not paid/pending renders as cancelled, as before)
+PAYMENT_STATUS_LABELS = {'paid': "🟢 Paid", 'pending': "🟡 Pending", 'cancelled': "🔴 Cancelled"}
+STOCK_STATUS_LABELS = {True: '🔴 Low Stock', False: '🟢 In Stock'}
+
+def celebrate():
+    """Queue one balloons animation; shown once at the end of the run (the flag survives an st.rerun())"""
+    st.session_state['_show_balloons'] = True
+
+@st.fragment
+def bill_items_editor(item_options, item_labels):
+    """Create Bill item rows; widget changes here rerun only this fragment"""
+    st.markdown("**📦 Add Items to Bill**")
+    item_rows = st.session_state.bill_items
+    total_preview = 0.0
+    
+    for i in range(len(item_rows)):
+        st.markdown(f"**Item {i+1}**")
+        cols = st.columns([4, 1, 1, 1])
+        item_key = f"item_select_{i}"; qty_key = f"item_qty_{i}"
+        if item_key not in st.session_state: st.session_state[item_key] = item_labels[0] if item_labels else None
+        if qty_key not in st.session_state: st.session_state[qty_key] = 1
+        
+        # Ensure existing session state value is valid
+        if st.session_state[item_key] not in item_labels:
+            st.session_state[item_key] = item_labels[0] if item_labels else None
+            
+        selected_label = cols[0].selectbox(f"Select Item*", options=item_labels, key=item_key, label_visibility="collapsed")
+        selected_item_data = item_options.get(selected_label)
+        
+        if selected_item_data:
+            max_qty = selected_item_data['quantity_available']
+            # Ensure current quantity isn't > max
+            current_qty_val = st.session_state[qty_key]
+            if current_qty_val > max_qty:
+                current_qty_val = max_qty
+
+            st.session_state[qty_key] = cols[1].number_input(f"Qty (Max {max_qty})", min_value=1, max_value=max_qty, value=current_qty_val, key=f"qty_input_{i}", label_visibility="collapsed")
+            quantity = st.session_state[qty_key]
+            item_price = selected_item_data['price']
+            item_total = item_price * quantity
+            total_preview += item_total
+            cols[2].text_input("Unit Price", value=format_currency(item_price), disabled=True, key=f"price_{i}", label_visibility="collapsed")
+            cols[3].text_input("Subtotal", value=format_currency(item_total), disabled=True, key=f"subtotal_{i}", label_visibility="collapsed")
+        else:
+            cols[0].selectbox("Select Item*", options=["No items available"], disabled=True, label_visibility="collapsed")
+            cols[1].number_input("Qty", value=1, disabled=True, key=f"qty_input_{i}", label_visibility="collapsed")
+            cols[2].text_input("Unit Price", value="N/A", disabled=True, key=f"price_{i}", label_visibility="collapsed")
+            cols[3].text_input("Subtotal", value="N/A", disabled=True, key=f"subtotal_{i}", label_visibility="collapsed")
+    
+    add_remove_cols = st.columns([1, 1, 4])
+    with add_remove_cols[0]:
+        if st.button("➕ Add Item Row", key="add_bill_item_outside"):
+            st.session_state.bill_items.append({'id': len(st.session_state.bill_items)})
+            st.rerun(scope="fragment")
+    with add_remove_cols[1]:
+        if len(st.session_state.bill_items) > 1:
+            if st.button("➖ Remove Last Row", key="remove_bill_item_outside"):
+                st.session_state.bill_items.pop()
+                # Clear session state for the removed item's widgets
+                last_id = len(st.session_state.bill_items)
+                for prefix in ("item_select_", "item_qty_", "qty_input_"): st.session_state.pop(f"{prefix}{last_id}", None)
+                st.rerun(scope="fragment")
+    st.markdown(f"### **Grand Total: {format_currency(total_preview)}**")
+    st.markdown("---")
+
+def inventory_item_details_html(item):
+    """One HTML block (3-column grid + notes) for an inventory item's read-only details"""
+    e = lambda v: html.escape(str(v))
+    expiry = item.get('expiry_date', 'N/A')
+    days_left = item.get('days_until_expiry') # computed by the backend
+    if expiry and expiry != 'N/A':
+        if days_left is None: expiry_html = f"<b>Expiry:</b> {e(expiry)} (invalid format)"
+        elif days_left <= 0: expiry_html = f"<b><span style='color:red;'>🔴 EXPIRED: {e(format_date(expiry))}</span></b>"
+        elif days_left < 30: expiry_html = f"<b><span style='color:orange;'>🟡 Expiry:</span></b> <span style='color:orange;'>{e(format_date(expiry))} ({days_left} days)</span>"
+        else: expiry_html = f"<b>Expiry:</b> {e(format_date(expiry))}"
+    else: expiry_html = "<b>Expiry:</b> N/A"
+    parts = [
+        '<div class="item-details">',
+        f"<div><b>Manufacturer:</b> {e(item.get('manufacturer', 'N/A'))}<br><b>Category:</b> {e(item.get('category', 'N/A'))}<br><b>Unit:</b> {e(item.get('unit', 'units'))}</div>",
+        f"<div><b>Price:</b> {e(format_currency(item.get('price')))}<br><b>Quantity:</b> {e(item.get('quantity', 'N/A'))}<br><b>Reorder Level:</b> {e(item.get('reorder_level', 10))}</div>",
+        f"<div>{expiry_html}</div>",
+        '</div>',
+    ]
+    if item.get('notes'): parts.append(f'<div class="item-notes">📝 Notes: {e(item["notes"])}</div>')
+    return "".join(parts)
+
+TODAY_HEADER_STYLE = "background-color:#1f77b4; color:white; padding: 5px; border-radius: 5px; text-align:center; margin-bottom: 5px;"
+DAY_HEADER_STYLE = "padding: 5px; border-bottom: 1px solid #ccc; margin-bottom: 5px; text-align:center;"
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def two_week_layout(today):
+    """(iso date, header html) for the 14 days from today, formatted once per day"""
+    days = [today + timedelta(days=i) for i in range(14)]
+    return [(d.isoformat(), f"<div style='{TODAY_HEADER_STYLE if d == today else DAY_HEADER_STYLE}'><b>{d.strftime('%a %d')}</b></div>") for d in days]
+
+def roster_shift_html(entry):
+    """One HTML row (staff, shift, time + notes) for a roster entry's read-only details"""
+    e = lambda v: html.escape(str(v))
+    availability = "🟢 Available" if entry.get('is_available', True) else "🔴 Unavailable/Leave"
+    parts = [
+        '<div class="shift-row">',
+        f"<div><b>{e(entry.get('staff_name', 'N/A'))}</b><br><small>{e(entry.get('role', 'Staff'))} | {availability}</small></div>",
+        f"<div><b>Shift:</b><br>{e(entry.get('shift_type', 'N/A'))}</div>",
+        f"<div><b>Time:</b><br>{e(entry['start_time'] or '--:--')} - {e(entry.get('end_time', '--:--'))}</div>",
+        '</div>',
+    ]
+    if entry.get('notes'): parts.append(f'<div class="item-notes">📝 Notes: {e(entry["notes"])}</div>')
+    return "".join(parts)
+
+def protocol_details_html(protocol):
+    """One HTML block (tags, preview, source, added date) for a protocol's read-only details"""
+    e = lambda v: html.escape(str(v))
+    parts = []
+    if protocol.get('tags'): parts.append(f"<small>Tags: {e(protocol['tags'])}</small>")
+    parts.append("<p><b>Preview:</b></p>")
+    # --- THIS IS THE FIX --- (content_preview, as a blockquote)
+    parts.append(f"<blockquote>{e(protocol.get('content_preview', 'No preview available.'))}</blockquote>")
+    if protocol.get('filename'): parts.append(f"<small>📎 Source: {e(protocol['filename'])}</small><br>")
+    parts.append(f"<small>Added: {e(format_date(protocol.get('created_at', '')))}</small>")
+    return "".join(parts)
+
+@st.fragment
+def roster_shifts_list():
+    """All Shifts tab; typing in the filters reruns only this fragment"""
+    st.subheader("All Roster Entries")
+    # Filters apply together on Enter / Apply, not on every edit
+    with st.form("roster_filters", border=False):
+        col1, col2 = st.columns(2)
+        staff_filter = col1.text_input("🔍 Search Staff", placeholder="Staff name", key="roster_staff_filter")
+        date_filter_val = col2.date_input("Filter by Date (Optional)", value=None, key="roster_date_filter")
+        st.form_submit_button("Apply")
+    
+    roster_list = fetch_roster("/roster/")
+    
+    if roster_list:
+        filtered_roster = roster_list
+        if staff_filter: filtered_roster = [r for r in filtered_roster if staff_filter.lower() in r.get('staff_name', '').lower()]
+        if date_filter_val: date_str = date_filter_val.isoformat(); filtered_roster = [r for r in filtered_roster if r.get('shift_date') == date_str]
+        
+        if filtered_roster:
+            # Entries arrive sorted by (shift_date, start_time), so each day's group is already in time order
+            roster_by_date = {d: list(g) for d, g in groupby(filtered_roster, key=itemgetter('shift_date'))}
+            
+            for shift_date_str in reversed(roster_by_date):
+                day_name = format_day(shift_date_str)
+                with st.expander(f"📅 {day_name} - {len(roster_by_date[shift_date_str])} shifts"):
+                    for entry in roster_by_date[shift_date_str]:
+                        cols = st.columns([5, 1])
+                        cols[0].markdown(roster_shift_html(entry), unsafe_allow_html=True)
+                        with cols[1]:
+                            if st.button("🗑️ Delete", key=f"del_roster_{entry.get('id', 'N/A')}", help="Delete this shift"):
+                                if make_request("DELETE", f"/roster/{entry.get('id')}"):
+                                    st.success("Deleted!")
+                                    st.rerun()
+        else: st.info("No shifts match your filters.")
+    elif roster_list is not None: st.info("No roster entries found.")
+
+@st.fragment
+def render_generate_tab():
+    """Generate Roster tab; form/widget interactions rerun only this fragment"""
+    # --- NEW Roster Generator ---
+    st.subheader("🤖 Auto-Generate Roster")
+    st.info("Define your staff and let the agent generate a schedule. This respects rest rules (no Night-to-Morning, max 6 consecutive work days) and assigns one random day off per week.")
+
+    # Get existing staff names to pre-fill
+    all_roster_data = fetch_roster("/roster/")
+    if all_roster_data:
+        staff_names_list = sorted({n for e in all_roster_data if (n := e.get('staff_name'))})
+        default_staff_text = "\n".join(staff_names_list)
+    else:
+        default_staff_text = "Nurse Anna\nDr. Ben\nTech Carla\nAdmin Dave\nNurse Leo\nNurse Maya\nDr. Patel\nNurse Riddhi\nDr. Mohan\nTech Sarah\nAdmin Frank\nNurse David\nDr. Priya" # Full fallback list
+
+    with st.form("generate_roster_form"):
+        st.markdown("**1. Define Staff**")
+        
+        staff_names_raw = st.text_area(
+            "Staff Names (one per line)",
+            value=default_staff_text,
+            height=200,
+            help="Enter the names of all staff to be included in scheduling."
+        )
+        
+        st.markdown("**2. Define Schedule Period & Shift Needs**")
+        g_cols = st.columns(2)
+        start_date_val = g_cols[0].date_input("Start Date", value=date.today() + timedelta(days=1))
+        num_days = g_cols[1].number_input("Number of Days to Generate", min_value=7, max_value=30, value=14, step=7)
+
+        s_cols = st.columns(3)
+        morning_needed = s_cols[0].number_input("Morning Shifts Needed / Day", min_value=0, value=1)
+        afternoon_needed = s_cols[1].number_input("Afternoon Shifts Needed / Day", min_value=0, value=1)
+        night_needed = s_cols[2].number_input("Night Shifts Needed / Day", min_value=0, value=1)
+
+        st.warning("Note: This will clear and regenerate all non-leave shifts in the selected date range.")
+        submitted = st.form_submit_button("🤖 Generate & Save Roster", use_container_width=True)
+
+        if submitted:
+            # --- Parse UI inputs into API payload ---
+            staff_list = [name.strip() for name in staff_names_raw.split('\n') if name.strip()]
+            
+            if not staff_list:
+                st.error("Please enter at least one staff name.")
+            elif len(staff_list) < (morning_needed + afternoon_needed + night_needed):
+                st.error(f"Not enough staff ({len(staff_list)}) to cover the required daily shifts ({morning_needed + afternoon_needed + night_needed}). Add more staff or reduce shift needs.")
+            else:
+                # Build final payload
+                payload = {
+                    "staff_names": staff_list,
+                    "start_date": start_date_val.isoformat(),
+                    "num_days": num_days,
+                    "shifts_per_day": {
+                        "Morning": morning_needed,
+                        "Afternoon": afternoon_needed,
+                        "Night": night_needed
+                    }
+                }
+                
+                with st.spinner(f"Generating {num_days}-day roster... This may take a moment."):
+                    result = make_request("POST", "/roster/generate", json=payload)
+                
+                if result:
+                    st.success(result.get('message', 'Roster generated!'))
+                    st.balloons() # Fragment runs never reach the end-of-script celebrate() check
+                    if result.get('new_entries_added'):
+                         st.info(f"Added {len(result['new_entries_added'])} new shifts (including leave/rest days).")
+                    st.info("Refresh the 'All Shifts' or '2-Week View' tabs to see the full schedule.")
+
 
 # Sidebar Navigation
 st.sidebar.image("https://img.icons8.com/fluency/96/hospital-3.png", width=100)
@@ -151,7 +498,9 @@ if 'bill_items' not in st.session_state:
 if page == "📊 Dashboard":
     # --- DASHBOARD CODE (Unchanged) ---
     st.markdown('<div class="main-header">📊 Admin Dashboard</div>', unsafe_allow_html=True)
-    stats = make_request("GET", "/analytics/dashboard/")
+    # Stats, alerts and recent bills arrive in one bundled request
+    dashboard_page = cached_get("/page/dashboard") or {}
+    stats, alerts, recent_bills = dashboard_page.get('stats'), dashboard_page.get('alerts'), dashboard_page.get('recent_bills')
     if stats:
         cols = st.columns(4)
         inv_stats = stats.get('inventory', {})
@@ -164,7 +513,6 @@ if page == "📊 Dashboard":
         col1, col2 = st.columns(2)
         with col1:
             st.subheader("⚠️ Inventory Alerts")
-            alerts = make_request("GET", "/analytics/inventory-alerts/")
             if alerts:
                 low_stock = alerts.get('low_stock', [])
                 expiring = alerts.get('expiring_soon', [])
@@ -180,7 +528,6 @@ if page == "📊 Dashboard":
             else: st.warning("Could not load inventory alerts.")
         with col2:
             st.subheader("📈 Recent Billing Activity")
-            recent_bills = make_request("GET", "/billing/")
             if recent_bills:
                 try:
                     df = pd.DataFrame(recent_bills)
@@ -189,7 +536,7 @@ if page == "📊 Dashboard":
                 except Exception as e: recent_bills_sorted = recent_bills[:5]
                 if recent_bills_sorted:
                     for bill in recent_bills_sorted:
-                        status_color = "🟢 Paid" if bill.get('payment_status') == 'paid' else "🟡 Pending" if bill.get('payment_status') == 'pending' else "🔴 Cancelled"
+                        status_color = PAYMENT_STATUS_LABELS.get(bill.get('payment_status'), "🔴 Cancelled")
                         st.markdown(f"**{status_color} - {bill.get('patient_name', 'N/A')}** - {format_currency(bill.get('total_amount', 0))}<br><small>Bill #{bill.get('id', 'N/A')} | {format_date(bill.get('date', ''), '%d %b %y')} | Dr. {bill.get('doctor_name', 'N/A')}</small>", unsafe_allow_html=True)
                         st.markdown("---")
                 else: st.info("No recent billing activity found.")
@@ -199,81 +546,76 @@ elif page == "💊 Inventory":
     # --- INVENTORY CODE (Unchanged) ---
     st.markdown('<div class="main-header">💊 Inventory Management</div>', unsafe_allow_html=True)
     tab1, tab2, tab3 = st.tabs(["📋 All Items", "➕ Add Item", "📊 Reports"])
-    inventory_data_for_edit = make_request("GET", "/inventory/") or []
-    for item_to_edit in inventory_data_for_edit:
-        item_id = item_to_edit.get('id')
-        if f'edit_item_{item_id}' in st.session_state and st.session_state[f'edit_item_{item_id}']:
-             st.subheader(f"✏️ Editing: {item_to_edit.get('item_name', '')}")
-             with st.form(f"edit_form_{item_id}"):
-                col1, col2 = st.columns(2)
-                with col1:
-                    edit_name = st.text_input("Item Name*", value=item_to_edit.get('item_name', ''))
-                    edit_manufacturer = st.text_input("Manufacturer*", value=item_to_edit.get('manufacturer', ''))
-                    edit_price = st.number_input("Price (₹)*", value=float(item_to_edit.get('price', 0.0)), min_value=0.01, step=0.01, format="%.2f")
-                    edit_quantity = st.number_input("Quantity*", value=int(item_to_edit.get('quantity', 0)), min_value=0, step=1)
-                with col2:
-                    category_options = ["Medicine", "Equipment", "Supplies", "Other"]
-                    current_category = item_to_edit.get('category', 'Other')
-                    if current_category not in category_options: category_options.append(current_category)
-                    cat_index = category_options.index(current_category)
-                    edit_category = st.selectbox("Category", category_options, index=cat_index)
-                    edit_unit = st.text_input("Unit", value=item_to_edit.get('unit', 'units'))
-                    current_expiry_val = None
-                    try:
-                        if item_to_edit.get('expiry_date'): current_expiry_val = date.fromisoformat(item_to_edit.get('expiry_date').split('T')[0])
-                    except: pass
-                    edit_expiry_date = st.date_input("Expiry Date (Optional)", value=current_expiry_val)
-                    edit_reorder = st.number_input("Reorder Level", value=int(item_to_edit.get('reorder_level', 10)), min_value=0, step=1)
-                edit_notes = st.text_area("Notes", value=item_to_edit.get('notes', ''))
-                save_edit = st.form_submit_button("💾 Save Changes")
-                cancel_edit = st.form_submit_button("❌ Cancel")
-                if save_edit:
-                    if not edit_name or not edit_manufacturer or edit_price is None: st.error("Please fill in required fields.")
-                    else:
-                        updated_data = {"item_name": edit_name, "manufacturer": edit_manufacturer, "price": float(edit_price), "quantity": int(edit_quantity), "category": edit_category, "unit": edit_unit, "expiry_date": edit_expiry_date.isoformat() if edit_expiry_date else None, "reorder_level": int(edit_reorder), "notes": edit_notes if edit_notes else None}
-                        result = make_request("PUT", f"/inventory/{item_id}", json=updated_data)
-                        if result: st.success("Item updated successfully!"); del st.session_state[f'edit_item_{item_id}']; st.rerun()
-                if cancel_edit: del st.session_state[f'edit_item_{item_id}']; st.rerun()
-             st.markdown("---")
+    inventory_data_for_edit, inventory_df, inventory_categories, low_stock, expiring = fetch_inventory()
+    inventory_data_for_edit = inventory_data_for_edit or []
+    # At most one item is edited at a time; look it up directly instead of scanning session state per item
+    editing_id = st.session_state.get('editing_id')
+    item_to_edit = next((i for i in inventory_data_for_edit if i.get('id') == editing_id), None) if editing_id is not None else None
+    if item_to_edit:
+        item_id = editing_id
+        st.subheader(f"✏️ Editing: {item_to_edit.get('item_name', '')}")
+        with st.form(f"edit_form_{item_id}"):
+            col1, col2 = st.columns(2)
+            with col1:
+                edit_name = st.text_input("Item Name*", value=item_to_edit.get('item_name', ''))
+                edit_manufacturer = st.text_input("Manufacturer*", value=item_to_edit.get('manufacturer', ''))
+                edit_price = st.number_input("Price (₹)*", value=float(item_to_edit.get('price', 0.0)), min_value=0.01, step=0.01, format="%.2f")
+                edit_quantity = st.number_input("Quantity*", value=int(item_to_edit.get('quantity', 0)), min_value=0, step=1)
+            with col2:
+                category_options = ["Medicine", "Equipment", "Supplies", "Other"]
+                current_category = item_to_edit.get('category', 'Other')
+                if current_category not in category_options: category_options.append(current_category)
+                cat_index = category_options.index(current_category)
+                edit_category = st.selectbox("Category", category_options, index=cat_index)
+                edit_unit = st.text_input("Unit", value=item_to_edit.get('unit', 'units'))
+                current_expiry_val = None
+                try:
+                    if item_to_edit.get('expiry_date'): current_expiry_val = date.fromisoformat(item_to_edit.get('expiry_date').split('T')[0])
+                except: pass
+                edit_expiry_date = st.date_input("Expiry Date (Optional)", value=current_expiry_val)
+                edit_reorder = st.number_input("Reorder Level", value=int(item_to_edit.get('reorder_level', 10)), min_value=0, step=1)
+            edit_notes = st.text_area("Notes", value=item_to_edit.get('notes', ''))
+            save_edit = st.form_submit_button("💾 Save Changes")
+            cancel_edit = st.form_submit_button("❌ Cancel")
+            if save_edit:
+                if not edit_name or not edit_manufacturer or edit_price is None: st.error("Please fill in required fields.")
+                else:
+                    updated_data = {"item_name": edit_name, "manufacturer": edit_manufacturer, "price": float(edit_price), "quantity": int(edit_quantity), "category": edit_category, "unit": edit_unit, "expiry_date": edit_expiry_date.isoformat() if edit_expiry_date else None, "reorder_level": int(edit_reorder), "notes": edit_notes if edit_notes else None}
+                    result = make_request("PUT", f"/inventory/{item_id}", json=updated_data)
+                    if result: st.success("Item updated successfully!"); st.session_state.pop('editing_id', None); st.rerun()
+            if cancel_edit: st.session_state.pop('editing_id', None); st.rerun()
+        st.markdown("---")
     with tab1:
         st.subheader("All Inventory Items")
         col1, col2, col3 = st.columns([2, 2, 1])
-        search_term = col1.text_input("🔍 Search items", placeholder="Search by name or manufacturer")
-        all_categories = ["All"] + sorted(list(set(i.get('category', 'Other') for i in inventory_data_for_edit if isinstance(i, dict) and i.get('category'))))
+        # Search only applies on Enter / Search, not on every edit of the box
+        with col1.form("inventory_search_form", border=False):
+            search_term = st.text_input("🔍 Search items", placeholder="Search by name or manufacturer", key="search_inv")
+            st.form_submit_button("Search")
+        all_categories = ["All"] + (inventory_categories or [])
         category_filter = col2.selectbox("Category", all_categories)
         col3.write(""); col3.write("")
         show_low_stock = col3.checkbox("Low Stock Only")
         inventory_display = inventory_data_for_edit
         if inventory_display:
+            mask = np.ones(len(inventory_display), dtype=bool)
             if search_term:
                 search_lower = search_term.lower()
-                inventory_display = [i for i in inventory_display if isinstance(i, dict) and (search_lower in i.get('item_name', '').lower() or search_lower in i.get('manufacturer', '').lower())]
-            if category_filter != "All": inventory_display = [i for i in inventory_display if isinstance(i,dict) and i.get('category', 'Other') == category_filter]
-            if show_low_stock: inventory_display = [i for i in inventory_display if isinstance(i,dict) and i.get('quantity', 0) <= i.get('reorder_level', 10)]
+                mask &= (inventory_df['name_l'].str.contains(search_lower, regex=False) | inventory_df['mfr_l'].str.contains(search_lower, regex=False)).to_numpy()
+            if category_filter != "All": mask &= (inventory_df['category'] == category_filter).to_numpy()
+            if show_low_stock: mask &= inventory_df['is_low'].to_numpy()
+            inventory_display = [inventory_display[k] for k in np.flatnonzero(mask)]
             if inventory_display:
                 for item in inventory_display:
                     item_id = item.get('id')
-                    if not item_id or (f'edit_item_{item_id}' in st.session_state and st.session_state[f'edit_item_{item_id}']): continue
-                    stock_status = '🔴 Low Stock' if item.get('quantity', 0) <= item.get('reorder_level', 10) else '🟢 In Stock'
+                    if not item_id or item_id == editing_id: continue
+                    stock_status = STOCK_STATUS_LABELS[bool(item.get('is_low_stock'))]
                     with st.expander(f"{stock_status} | {item.get('item_name', 'N/A')} | Stock: {item.get('quantity', 'N/A')}"):
-                        col1, col2, col3 = st.columns(3)
-                        with col1: st.markdown(f"**Manufacturer:** {item.get('manufacturer', 'N/A')}\n\n**Category:** {item.get('category', 'N/A')}\n\n**Unit:** {item.get('unit', 'units')}")
-                        with col2: st.markdown(f"**Price:** {format_currency(item.get('price'))}\n\n**Quantity:** {item.get('quantity', 'N/A')}\n\n**Reorder Level:** {item.get('reorder_level', 10)}")
-                        with col3:
-                            expiry = item.get('expiry_date', 'N/A')
-                            if expiry and expiry != 'N/A':
-                                try:
-                                    exp_date = date.fromisoformat(expiry.split('T')[0])
-                                    days_left = (exp_date - date.today()).days
-                                    if days_left <= 0: st.markdown(f"**<span style='color:red;'>🔴 EXPIRED: {format_date(expiry)}</span>**", unsafe_allow_html=True)
-                                    elif days_left < 30: st.markdown(f"**<span style='color:orange;'>🟡 Expiry:** {format_date(expiry)} ({days_left} days)</span>**", unsafe_allow_html=True)
-                                    else: st.markdown(f"**Expiry:** {format_date(expiry)}")
-                                except: st.markdown(f"**Expiry:** {expiry} (invalid format)")
-                            else: st.markdown(f"**Expiry:** N/A")
-                        if item.get('notes'): st.info(f"📝 Notes: {item.get('notes')}")
+                        # All read-only details go out as one markdown element
+                        st.markdown(inventory_item_details_html(item), unsafe_allow_html=True)
                         b_col1, b_col2, b_col3 = st.columns([1,1,5])
                         with b_col1:
-                            if st.button("✏️ Edit", key=f"edit_{item_id}", help="Edit this item"): st.session_state[f'edit_item_{item_id}'] = True; st.rerun()
+                            if st.button("✏️ Edit", key=f"edit_{item_id}", help="Edit this item"): st.session_state.editing_id = item_id; st.rerun()
                         with b_col2:
                             if st.button("🗑️ Delete", key=f"del_{item_id}", help="Delete this item"):
                                 if make_request("DELETE", f"/inventory/{item_id}"): st.success("Item deleted successfully!"); st.rerun()
@@ -300,18 +642,16 @@ elif page == "💊 Inventory":
                 else:
                     item_data = {"item_name": item_name, "manufacturer": manufacturer, "price": float(price), "quantity": int(quantity), "category": category, "unit": unit, "expiry_date": expiry_date_val.isoformat() if expiry_date_val else None, "reorder_level": int(reorder_level), "notes": notes if notes else None}
                     result = make_request("POST", "/inventory/", json=item_data)
-                    if result: st.success(f"✅ Item '{item_name}' added successfully!"); st.balloons()
+                    if result: st.success(f"✅ Item '{item_name}' added successfully!"); celebrate()
     with tab3:
         st.subheader("Inventory Reports")
         col1, col2 = st.columns(2)
         with col1:
             st.markdown("**📉 Low Stock Items**")
-            low_stock = make_request("GET", "/inventory/low-stock/")
             if low_stock: st.dataframe(pd.DataFrame(low_stock)[['item_name', 'quantity', 'reorder_level']], use_container_width=True, hide_index=True)
             elif low_stock is not None: st.success("All items above reorder level")
         with col2:
             st.markdown("**⏰ Expiring Soon (30 days)**")
-            expiring = make_request("GET", "/inventory/expiring/", params={"days": 30})
             if expiring: st.dataframe(pd.DataFrame(expiring)[['item_name', 'expiry_date', 'days_until_expiry', 'quantity']], use_container_width=True, hide_index=True)
             elif expiring is not None: st.success("No items expiring soon")
 
@@ -323,63 +663,85 @@ elif page == "💳 Billing":
         st.subheader("All Bills")
         col1, col2, col3 = st.columns(3)
         status_filter = col1.selectbox("Payment Status", ["All", "Pending", "Paid", "Cancelled"])
-        search_patient = col2.text_input("🔍 Search Patient/Doctor", placeholder="Name or ID")
+        with col2.form("billing_search_form", border=False):
+            search_patient = st.text_input("🔍 Search Patient/Doctor", placeholder="Name or ID", key="search_bills")
+            st.form_submit_button("Search")
         show_recent = col3.selectbox("Show", ["All Time", "Last 7 Days", "Last 30 Days"])
-        bills = make_request("GET", "/billing/")
-        if bills:
-            filtered_bills = bills
-            if status_filter != "All": filtered_bills = [b for b in filtered_bills if b.get('payment_status', '').lower() == status_filter.lower()]
+        bills_df = cached_table("/billing/")
+        if bills_df is not None and not bills_df.empty:
+            # One vectorized filter pass over the bills table instead of chained list comprehensions
+            df = bills_df.reindex(columns=['payment_status', 'patient_name', 'patient_id', 'doctor_name', 'date', 'total_amount'])
+            status = df['payment_status'].fillna('')
+            mask = pd.Series(True, index=df.index)
+            if status_filter != "All": mask &= status.str.lower().eq(status_filter.lower())
             if search_patient:
                 search_lower = search_patient.lower()
-                filtered_bills = [b for b in filtered_bills if search_lower in b.get('patient_name', '').lower() or search_lower in b.get('patient_id', '').lower() or search_lower in b.get('doctor_name', '').lower()]
+                mask &= (df['patient_name'].fillna('').str.lower().str.contains(search_lower, regex=False)
+                         | df['patient_id'].fillna('').astype(str).str.lower().str.contains(search_lower, regex=False)
+                         | df['doctor_name'].fillna('').str.lower().str.contains(search_lower, regex=False))
             if show_recent != "All Time":
                 days = 7 if show_recent == "Last 7 Days" else 30
-                cutoff = (datetime.now() - timedelta(days=days)).date()
-                filtered_bills = [b for b in filtered_bills if date.fromisoformat(b.get('date','2000-01-01').split('T')[0]) >= cutoff]
+                cutoff = pd.Timestamp((datetime.now() - timedelta(days=days)).date())
+                mask &= pd.to_datetime(df['date'].fillna('2000-01-01').str.split('T').str[0], errors='coerce') >= cutoff
+            filtered_bills = [table_record(row) for row in bills_df[mask].to_dict('records')]
             if filtered_bills:
-                total_billed = sum(b.get('total_amount', 0) for b in filtered_bills if b.get('payment_status') != 'cancelled')
-                total_paid = sum(b.get('total_amount', 0) for b in filtered_bills if b.get('payment_status') == 'paid')
+                amounts = df.loc[mask, 'total_amount'].fillna(0)
+                total_billed = amounts[status[mask] != 'cancelled'].sum()
+                total_paid = amounts[status[mask] == 'paid'].sum()
                 st.info(f"📊 **{len(filtered_bills)} bills displayed** | **Total Billed: {format_currency(total_billed)}** | **Total Paid: {format_currency(total_paid)}**")
-                for bill in filtered_bills:
-                    status_emoji = "🟢" if bill.get('payment_status') == 'paid' else "🟡" if bill.get('payment_status') == 'pending' else "🔴"
-                    with st.expander(f"{status_emoji} Bill #{bill.get('id','N/A')} | {bill.get('patient_name','N/A')} | {format_currency(bill.get('total_amount', 0))}"):
-                        col1, col2 = st.columns(2)
-                        with col1: st.markdown(f"**Patient ID:** {bill.get('patient_id', 'N/A')}\n\n**Patient Name:** {bill.get('patient_name', 'N/A')}\n\n**Doctor:** Dr. {bill.get('doctor_name', 'N/A')}\n\n**Date:** {format_date(bill.get('date', 'N/A'))}")
-                        with col2:
-                            st.markdown(f"**Status:** {bill.get('payment_status', 'N/A').upper()}")
-                            if bill.get('payment_method'): st.markdown(f"**Payment Method:** {bill.get('payment_method')}")
-                            st.markdown(f"**Total Amount:** {format_currency(bill.get('total_amount', 0))}")
-                            st.caption(f"Transaction Time: {format_date(bill.get('transaction_time', ''), '%d %b %Y %H:%M')}")
-                        st.markdown("**📦 Items Billed:**")
-                        items_df = pd.DataFrame(bill.get('items', []))
-                        if not items_df.empty:
-                            items_df_display = items_df[['item_name', 'manufacturer', 'quantity', 'unit_price', 'subtotal']]
-                            items_df_display.columns = ['Item', 'Manufacturer', 'Qty', 'Unit Price', 'Subtotal']
-                            items_df_display['Unit Price'] = items_df_display['Unit Price'].apply(format_currency)
-                            items_df_display['Subtotal'] = items_df_display['Subtotal'].apply(format_currency)
-                            st.dataframe(items_df_display, use_container_width=True, hide_index=True)
-                        else: st.write("No items listed.")
-                        if bill.get('notes'): st.info(f"📝 Notes: {bill['notes']}")
-                        if bill.get('payment_status') == 'pending':
-                             st.markdown("---"); st.markdown("**Update Payment:**")
-                             update_cols = st.columns([2,1])
-                             payment_method = update_cols[0].selectbox("Payment Method", ["Cash", "Card", "UPI", "Bank Transfer"], key=f"payment_method_{bill.get('id')}")
-                             if update_cols[1].button("✅ Mark as Paid", key=f"pay_{bill.get('id')}", use_container_width=True):
-                                 result = make_request("PUT", f"/billing/{bill.get('id')}/payment", params={"payment_status": "paid", "payment_method": payment_method})
-                                 if result: st.success("Payment updated!"); st.rerun()
-                             if st.button("❌ Cancel Bill", key=f"cancel_{bill.get('id')}", use_container_width=True):
-                                result = make_request("PUT", f"/billing/{bill.get('id')}/payment", params={"payment_status": "cancelled"})
-                                if result: st.warning("Bill marked as cancelled."); st.rerun()
+                # One table for the list (a single component) plus one detail pane for the selected bill
+                summary_df = pd.DataFrame({
+                    'Bill #': [b.get('id', 'N/A') for b in filtered_bills],
+                    'Patient': [b.get('patient_name', 'N/A') for b in filtered_bills],
+                    'Doctor': [f"Dr. {b.get('doctor_name', 'N/A')}" for b in filtered_bills],
+                    'Date': [format_date(b.get('date', 'N/A')) for b in filtered_bills],
+                    'Total': [format_currency(b.get('total_amount', 0)) for b in filtered_bills],
+                    'Status': [PAYMENT_STATUS_LABELS.get(b.get('payment_status'), "🔴 Cancelled") for b in filtered_bills],
+                })
+                st.caption("Select a row to view bill details.")
+                selection = st.dataframe(summary_df, use_container_width=True, hide_index=True, on_select="rerun", selection_mode="single-row", key="bills_table")
+                selected_rows = selection.selection.rows
+                if selected_rows and selected_rows[0] < len(filtered_bills):
+                    bill = filtered_bills[selected_rows[0]]
+                    st.markdown(f"#### Bill #{bill.get('id','N/A')} | {bill.get('patient_name','N/A')} | {format_currency(bill.get('total_amount', 0))}")
+                    col1, col2 = st.columns(2)
+                    with col1: st.markdown(f"**Patient ID:** {bill.get('patient_id', 'N/A')}\n\n**Patient Name:** {bill.get('patient_name', 'N/A')}\n\n**Doctor:** Dr. {bill.get('doctor_name', 'N/A')}\n\n**Date:** {format_date(bill.get('date', 'N/A'))}")
+                    with col2:
+                        st.markdown(f"**Status:** {bill.get('payment_status', 'N/A').upper()}")
+                        if bill.get('payment_method'): st.markdown(f"**Payment Method:** {bill.get('payment_method')}")
+                        st.markdown(f"**Total Amount:** {format_currency(bill.get('total_amount', 0))}")
+                        st.caption(f"Transaction Time: {format_date(bill.get('transaction_time', ''), '%d %b %Y %H:%M')}")
+                    st.markdown("**📦 Items Billed:**")
+                    items_df = pd.DataFrame(bill.get('items', []))
+                    if not items_df.empty:
+                        items_df_display = items_df[['item_name', 'manufacturer', 'quantity', 'unit_price', 'subtotal']]
+                        items_df_display.columns = ['Item', 'Manufacturer', 'Qty', 'Unit Price', 'Subtotal']
+                        items_df_display['Unit Price'] = items_df_display['Unit Price'].apply(format_currency)
+                        items_df_display['Subtotal'] = items_df_display['Subtotal'].apply(format_currency)
+                        st.dataframe(items_df_display, use_container_width=True, hide_index=True)
+                    else: st.write("No items listed.")
+                    if bill.get('notes'): st.info(f"📝 Notes: {bill['notes']}")
+                    if bill.get('payment_status') == 'pending':
+                         st.markdown("---"); st.markdown("**Update Payment:**")
+                         update_cols = st.columns([2,1])
+                         payment_method = update_cols[0].selectbox("Payment Method", ["Cash", "Card", "UPI", "Bank Transfer"], key=f"payment_method_{bill.get('id')}")
+                         if update_cols[1].button("✅ Mark as Paid", key=f"pay_{bill.get('id')}", use_container_width=True):
+                             result = make_request("PUT", f"/billing/{bill.get('id')}/payment", params={"payment_status": "paid", "payment_method": payment_method})
+                             if result: st.success("Payment updated!"); st.rerun()
+                         if st.button("❌ Cancel Bill", key=f"cancel_{bill.get('id')}", use_container_width=True):
+                            result = make_request("PUT", f"/billing/{bill.get('id')}/payment", params={"payment_status": "cancelled"})
+                            if result: st.warning("Bill marked as cancelled."); st.rerun()
             else: st.info("No bills match your filters.")
-        elif bills is not None: st.info("No bills recorded yet.")
+        elif bills_df is not None: st.info("No bills recorded yet.")
     with tab2:
         st.subheader("➕ Create New Bill")
-        available_items_data = make_request("GET", "/inventory/available")
-        if available_items_data:
-            item_options = {f"{item['item_name']} ({item['manufacturer']}) - {format_currency(item['price'])} | Stock: {item['quantity_available']}": item for item in available_items_data}
-            item_labels = list(item_options.keys())
+        item_options, item_labels = fetch_bill_item_options()
+        if item_options:
             
-            # --- Define form elements FIRST ---
+            # Item rows live in a fragment: changing an item/qty or adding a row reruns
+            # only the rows, not the whole page (fetches, filters and other tabs).
+            bill_items_editor(item_options, item_labels)
+
             with st.form("create_bill_form", clear_on_submit=True):
                 st.markdown("**👤 Patient Information**")
                 p_cols = st.columns(3)
@@ -387,49 +749,8 @@ elif page == "💳 Billing":
                 patient_name = p_cols[1].text_input("Patient Name*", placeholder="e.g., John Doe")
                 doctor_name = p_cols[2].text_input("Doctor Name*", placeholder="e.g., Dr. Smith")
                 
-                st.markdown("---")
-                st.markdown("**📦 Add Items to Bill**")
-                
-                item_rows = st.session_state.bill_items
-                total_preview = 0.0
-                
-                for i in range(len(item_rows)):
-                    st.markdown(f"**Item {i+1}**")
-                    cols = st.columns([4, 1, 1, 1])
-                    item_key = f"item_select_{i}"; qty_key = f"item_qty_{i}"
-                    if item_key not in st.session_state: st.session_state[item_key] = item_labels[0] if item_labels else None
-                    if qty_key not in st.session_state: st.session_state[qty_key] = 1
-                    
-                    # Ensure existing session state value is valid
-                    if st.session_state[item_key] not in item_labels:
-                        st.session_state[item_key] = item_labels[0] if item_labels else None
-                        
-                    selected_label = cols[0].selectbox(f"Select Item*", options=item_labels, key=item_key, label_visibility="collapsed")
-                    selected_item_data = item_options.get(selected_label)
-                    
-                    if selected_item_data:
-                        max_qty = selected_item_data['quantity_available']
-                        # Ensure current quantity isn't > max
-                        current_qty_val = st.session_state[qty_key]
-                        if current_qty_val > max_qty:
-                            current_qty_val = max_qty
-
-                        st.session_state[qty_key] = cols[1].number_input(f"Qty (Max {max_qty})", min_value=1, max_value=max_qty, value=current_qty_val, key=f"qty_input_{i}", label_visibility="collapsed")
-                        quantity = st.session_state[qty_key]
-                        item_price = selected_item_data['price']
-                        item_total = item_price * quantity
-                        total_preview += item_total
-                        cols[2].text_input("Unit Price", value=format_currency(item_price), disabled=True, key=f"price_{i}", label_visibility="collapsed")
-                        cols[3].text_input("Subtotal", value=format_currency(item_total), disabled=True, key=f"subtotal_{i}", label_visibility="collapsed")
-                    else:
-                        cols[0].selectbox("Select Item*", options=["No items available"], disabled=True, label_visibility="collapsed")
-                        cols[1].number_input("Qty", value=1, disabled=True, key=f"qty_input_{i}", label_visibility="collapsed")
-                        cols[2].text_input("Unit Price", value="N/A", disabled=True, key=f"price_{i}", label_visibility="collapsed")
-                        cols[3].text_input("Subtotal", value="N/A", disabled=True, key=f"subtotal_{i}", label_visibility="collapsed")
-                
                 st.markdown("---")
                 notes = st.text_area("Notes (Optional)", placeholder="Billing notes")
-                st.markdown(f"### **Grand Total: {format_currency(total_preview)}**")
                 
                 submitted = st.form_submit_button("💳 Create Bill", use_container_width=True)
                 
@@ -449,25 +770,11 @@ elif page == "💳 Billing":
                             bill_payload = {"patient_id": patient_id, "patient_name": patient_name, "doctor_name": doctor_name, "items": final_bill_items, "notes": notes if notes else None}
                             result = make_request("POST", "/billing/", json=bill_payload)
                             if result:
-                                st.success(f"✅ Bill #{result.get('id')} created! Total: {format_currency(result.get('total_amount', 0))}"); st.balloons()
+                                st.success(f"✅ Bill #{result.get('id')} created! Total: {format_currency(result.get('total_amount', 0))}"); celebrate()
+                                # Reset the item rows (they are outside the form, so clear_on_submit doesn't cover them)
+                                for i in range(len(st.session_state.bill_items)):
+                                    for key in (f"item_select_{i}", f"item_qty_{i}", f"qty_input_{i}"): st.session_state.pop(key, None)
                                 st.session_state.bill_items = [{'id': 0}] # Reset
-            
-            # --- FIX: Buttons are MOVED OUTSIDE the st.form block ---
-            st.markdown("---") 
-            add_remove_cols = st.columns([1, 1, 4])
-            with add_remove_cols[0]:
-                if st.button("➕ Add Item Row", key="add_bill_item_outside"):
-                    st.session_state.bill_items.append({'id': len(st.session_state.bill_items)})
-                    st.rerun()
-            with add_remove_cols[1]:
-                if len(st.session_state.bill_items) > 1:
-                    if st.button("➖ Remove Last Row", key="remove_bill_item_outside"):
-                        st.session_state.bill_items.pop()
-                        # Clear session state for the removed item's widgets
-                        last_id = len(st.session_state.bill_items)
-                        if f"item_select_{last_id}" in st.session_state: del st.session_state[f"item_select_{last_id}"]
-                        if f"item_qty_{last_id}" in st.session_state: del st.session_state[f"item_qty_{last_id}"]
-                        st.rerun()
         else:
             st.warning("⚠️ Inventory is empty or unavailable. Cannot create bills.")
 
@@ -479,66 +786,20 @@ elif page == "📅 Roster":
     tab1, tab2, tab3 = st.tabs(tab_titles)
     
     with tab1:
-        st.subheader("All Roster Entries")
-        col1, col2 = st.columns(2)
-        staff_filter = col1.text_input("🔍 Search Staff", placeholder="Staff name")
-        date_filter_val = col2.date_input("Filter by Date (Optional)", value=None)
-        
-        roster_list = make_request("GET", "/roster/")
-        
-        if roster_list:
-            filtered_roster = roster_list
-            if staff_filter: filtered_roster = [r for r in filtered_roster if staff_filter.lower() in r.get('staff_name', '').lower()]
-            if date_filter_val: date_str = date_filter_val.isoformat(); filtered_roster = [r for r in filtered_roster if r.get('shift_date') == date_str]
-            
-            if filtered_roster:
-                roster_by_date = {}
-                for entry in filtered_roster:
-                    shift_date_str = entry.get('shift_date', 'Unknown Date')
-                    if shift_date_str not in roster_by_date: roster_by_date[shift_date_str] = []
-                    roster_by_date[shift_date_str].append(entry)
-                
-                for shift_date_str in sorted(roster_by_date.keys(), reverse=True):
-                    try:
-                        date_obj = date.fromisoformat(shift_date_str.split('T')[0])
-                        day_name = date_obj.strftime("%A, %d %b %Y")
-                    except:
-                         day_name = shift_date_str
-
-                    with st.expander(f"📅 {day_name} - {len(roster_by_date[shift_date_str])} shifts"):
-                        for entry in sorted(roster_by_date[shift_date_str], key=lambda x: x.get('start_time', '00:00')):
-                            cols = st.columns([2, 1, 2, 1])
-                            with cols[0]:
-                                availability = "🟢 Available" if entry.get('is_available', True) else "🔴 Unavailable/Leave"
-                                st.markdown(f"**{entry.get('staff_name', 'N/A')}**")
-                                st.caption(f"{entry.get('role', 'Staff')} | {availability}")
-                            cols[1].markdown(f"**Shift:**<br>{entry.get('shift_type', 'N/A')}", unsafe_allow_html=True)
-                            cols[2].markdown(f"**Time:**<br>{entry.get('start_time', '--:--')} - {entry.get('end_time', '--:--')}", unsafe_allow_html=True)
-                            with cols[3]:
-                                if st.button("🗑️ Delete", key=f"del_roster_{entry.get('id', 'N/A')}", help="Delete this shift"):
-                                    if make_request("DELETE", f"/roster/{entry.get('id')}"):
-                                        st.success("Deleted!")
-                                        st.rerun()
-                            if entry.get('notes'): st.info(f"📝 Notes: {entry['notes']}")
-                            st.markdown("---")
-            else: st.info("No shifts match your filters.")
-        elif roster_list is not None: st.info("No roster entries found.")
+        roster_shifts_list()
 
     with tab2:
         # --- MOVED 2-Week View ---
         st.subheader("📆 Next 2 Weeks Schedule")
         
-        two_week_roster_data = make_request("GET", "/roster/two-weeks/")
+        two_week_roster_data = fetch_roster("/roster/two-weeks/")
         
         if two_week_roster_data:
-            roster_by_day = {}
-            for entry in two_week_roster_data:
-                d_str = entry.get('shift_date')
-                if d_str not in roster_by_day: roster_by_day[d_str] = []
-                roster_by_day[d_str].append(entry)
-
-            today = date.today()
-            dates_in_view = [today + timedelta(days=i) for i in range(14)]
+            # --- FIX: Filter out Leave/Rest shifts --- (once for the whole view; data is presorted)
+            working = [s for s in two_week_roster_data if s.get('is_available', True) and s.get('shift_type') not in ('Leave', 'Rest')]
+            working_by_day = {d: list(g) for d, g in groupby(working, key=itemgetter('shift_date'))}
+
+            days_in_view = two_week_layout(date.today())
             
             for week_start_idx in range(0, 14, 7):
                 cols = st.columns(7)
@@ -546,23 +807,15 @@ elif page == "📅 Roster":
                     current_idx = week_start_idx + day_idx
                     if current_idx >= 14: break
 
-                    current_date = dates_in_view[current_idx]
-                    date_str = current_date.isoformat()
-                    shifts_today = roster_by_day.get(date_str, [])
+                    date_str, header_html = days_in_view[current_idx]
+                    working_shifts_today = working_by_day.get(date_str, [])
                     
                     with cols[day_idx]:
-                        header_style = "background-color:#1f77b4; color:white; padding: 5px; border-radius: 5px; text-align:center; margin-bottom: 5px;" if current_date == today else "padding: 5px; border-bottom: 1px solid #ccc; margin-bottom: 5px; text-align:center;"
-                        st.markdown(f"<div style='{header_style}'><b>{current_date.strftime('%a %d')}</b></div>", unsafe_allow_html=True)
-                        
-                        # --- FIX: Filter out Leave/Rest shifts ---
-                        working_shifts_today = [
-                            s for s in shifts_today 
-                            if s.get('is_available', True) and s.get('shift_type') not in ['Leave', 'Rest']
-                        ]
+                        st.markdown(header_html, unsafe_allow_html=True)
                         
                         if working_shifts_today:
                             st.markdown(f"<small>{len(working_shifts_today)} working shifts</small>", unsafe_allow_html=True)
-                            for shift in sorted(working_shifts_today, key=lambda x: x.get('start_time','00:00')):
+                            for shift in working_shifts_today:
                                 availability = "🟢" # Always green, as requested
                                 st.caption(f"{availability} {shift.get('staff_name','?')} ({shift.get('shift_type','?')})")
                         else:
@@ -573,118 +826,37 @@ elif page == "📅 Roster":
              st.info("No shifts scheduled for the next 2 weeks.")
 
     with tab3:
-        # --- NEW Roster Generator ---
-        st.subheader("🤖 Auto-Generate Roster")
-        st.info("Define your staff and let the agent generate a schedule. This respects rest rules (no Night-to-Morning, max 6 consecutive work days) and assigns one random day off per week.")
-
-        # Get existing staff names to pre-fill
-        all_roster_data = make_request("GET", "/roster/")
-        if all_roster_data:
-            staff_names_list = sorted(list(set(e.get('staff_name') for e in all_roster_data if e.get('staff_name'))))
-            default_staff_text = "\n".join(staff_names_list)
-        else:
-            default_staff_text = "Nurse Anna\nDr. Ben\nTech Carla\nAdmin Dave\nNurse Leo\nNurse Maya\nDr. Patel\nNurse Riddhi\nDr. Mohan\nTech Sarah\nAdmin Frank\nNurse David\nDr. Priya" # Full fallback list
-
-        with st.form("generate_roster_form"):
-            st.markdown("**1. Define Staff**")
-            
-            staff_names_raw = st.text_area(
-                "Staff Names (one per line)",
-                value=default_staff_text,
-                height=200,
-                help="Enter the names of all staff to be included in scheduling."
-            )
-            
-            st.markdown("**2. Define Schedule Period & Shift Needs**")
-            g_cols = st.columns(2)
-            start_date_val = g_cols[0].date_input("Start Date", value=date.today() + timedelta(days=1))
-            num_days = g_cols[1].number_input("Number of Days to Generate", min_value=7, max_value=30, value=14, step=7)
-
-            s_cols = st.columns(3)
-            morning_needed = s_cols[0].number_input("Morning Shifts Needed / Day", min_value=0, value=1)
-            afternoon_needed = s_cols[1].number_input("Afternoon Shifts Needed / Day", min_value=0, value=1)
-            night_needed = s_cols[2].number_input("Night Shifts Needed / Day", min_value=0, value=1)
-
-            st.warning("Note: This will clear and regenerate all non-leave shifts in the selected date range.")
-            submitted = st.form_submit_button("🤖 Generate & Save Roster", use_container_width=True)
-
-            if submitted:
-                # --- Parse UI inputs into API payload ---
-                staff_list = [name.strip() for name in staff_names_raw.split('\n') if name.strip()]
-                
-                if not staff_list:
-                    st.error("Please enter at least one staff name.")
-                elif len(staff_list) < (morning_needed + afternoon_needed + night_needed):
-                    st.error(f"Not enough staff ({len(staff_list)}) to cover the required daily shifts ({morning_needed + afternoon_needed + night_needed}). Add more staff or reduce shift needs.")
-                else:
-                    # Build final payload
-                    payload = {
-                        "staff_names": staff_list,
-                        "start_date": start_date_val.isoformat(),
-                        "num_days": num_days,
-                        "shifts_per_day": {
-                            "Morning": morning_needed,
-                            "Afternoon": afternoon_needed,
-                            "Night": night_needed
-                        }
-                    }
-                    
-                    with st.spinner(f"Generating {num_days}-day roster... This may take a moment."):
-                        result = make_request("POST", "/roster/generate", json=payload)
-                    
-                    if result:
-                        st.success(result.get('message', 'Roster generated!'))
-                        st.balloons()
-                        if result.get('new_entries_added'):
-                             st.info(f"Added {len(result['new_entries_added'])} new shifts (including leave/rest days).")
-                        st.info("Refresh the 'All Shifts' or '2-Week View' tabs to see the full schedule.")
+        render_generate_tab()
 
 
 elif page == "📋 Protocols":
     # --- PROTOCOLS CODE (With content_preview fix) ---
     st.markdown('<div class="main-header">📋 Medical Protocols</div>', unsafe_allow_html=True)
     tab1, tab2, tab3 = st.tabs(["📚 All Protocols", "➕ Add Protocol", "🤖 Ask AI"])
+    protocols_list, protocol_blobs = fetch_protocols() # Shared by the list and Ask AI tabs
     
     with tab1:
         st.subheader("All Protocols")
-        search_query = st.text_input("🔍 Search Protocols", placeholder="Search title, category, tags...")
-        
-        protocols_list = make_request("GET", "/protocols/")
+        with st.form("protocol_search_form", border=False):
+            search_query = st.text_input("🔍 Search Protocols", placeholder="Search title, category, tags...", key="search_protocols")
+            st.form_submit_button("Search")
+
         
         if protocols_list:
             filtered_protocols = protocols_list
             if search_query:
                 search_lower = search_query.lower()
-                filtered_protocols = [
-                    p for p in filtered_protocols if isinstance(p, dict) and
-                    (search_lower in p.get('title', '').lower() or
-                     search_lower in p.get('category', '').lower() or
-                     search_lower in p.get('tags', '').lower())
-                ]
+                filtered_protocols = [p for p, blob in zip(protocols_list, protocol_blobs) if search_lower in blob]
             
             if filtered_protocols:
-                # Group by category
-                protocols_by_category = {}
-                for p in filtered_protocols:
-                    cat = p.get('category', 'General')
-                    if cat not in protocols_by_category: protocols_by_category[cat] = []
-                    protocols_by_category[cat].append(p)
-                
-                for cat in sorted(protocols_by_category.keys()):
+                # Group by category (already sorted by (category, title) at fetch time; filtering keeps the order)
+                for cat, cat_protocols in groupby(filtered_protocols, key=protocol_category):
                     st.markdown(f"#### {cat}")
-                    for protocol in sorted(protocols_by_category[cat], key=lambda x: x.get('title','')):
+                    for protocol in cat_protocols:
                         protocol_id = protocol.get('id')
                         with st.expander(f"📄 {protocol.get('title', 'N/A')}"):
                             col1, col2 = st.columns([4, 1])
-                            with col1:
-                                if protocol.get('tags'): st.caption(f"Tags: {protocol['tags']}")
-                                st.markdown("**Preview:**")
-                                # --- THIS IS THE FIX ---
-                                content_preview = protocol.get('content_preview', 'No preview available.')
-                                st.markdown(f"> {content_preview}") # Use blockquote for preview
-                                # --- END FIX ---
-                                if protocol.get('filename'): st.caption(f"📎 Source: {protocol['filename']}")
-                                st.caption(f"Added: {format_date(protocol.get('created_at', ''))}")
+                            col1.markdown(protocol_details_html(protocol), unsafe_allow_html=True)
                             with col2:
                                 if st.button("🗑️ Delete", key=f"del_protocol_{protocol_id}", help="Delete this protocol"):
                                     if make_request("DELETE", f"/protocols/{protocol_id}"):
@@ -713,15 +885,17 @@ elif page == "📋 Protocols":
                 if submitted:
                     if not uploaded_file or not title: st.error("PDF file and Title are required.")
                     else:
-                        files = {'file': (uploaded_file.name, uploaded_file.getvalue(), 'application/pdf')}
+                        uploaded_file.seek(0)
+                        files = {'file': (uploaded_file.name, uploaded_file, 'application/pdf')} # File object, no extra bytes copy
                         params = {'title': title, 'category': category or None, 'tags': tags or None}
                         try:
                             url = f"{API_URL}/protocols/upload-pdf/"
-                            response = requests.post(url, files=files, params=params, timeout=60)
+                            response = _http_session().post(url, files=files, params=params, timeout=60)
                             response.raise_for_status()
+                            st.cache_data.clear()
                             result = response.json()
                             st.success(f"✅ Protocol '{title}' uploaded & processed!")
-                            st.caption(f"Chunks created: {result.get('chunk_count', 'N/A')}"); st.balloons()
+                            st.caption(f"Chunks created: {result.get('chunk_count', 'N/A')}"); celebrate()
                         except requests.exceptions.HTTPError as e:
                              try: detail = e.response.json().get('detail', str(e))
                              except: detail = str(e)
@@ -744,13 +918,13 @@ elif page == "📋 Protocols":
                         result = make_request("POST", "/protocols/", json=protocol_data)
                         if result:
                             st.success(f"✅ Protocol '{title}' added!")
-                            st.caption(f"Chunks created: {result.get('chunk_count', 'N/A')}"); st.balloons()
+                            st.caption(f"Chunks created: {result.get('chunk_count', 'N/A')}"); celebrate()
     
     with tab3:
         st.subheader("🤖 AI Protocol Assistant")
         st.info("Ask questions about the uploaded protocols using Groq AI.")
         
-        protocols_available = make_request("GET", "/protocols/") # Check if any exist
+        protocols_available = protocols_list # Check if any exist
         
         if protocols_available:
             st.markdown(f"📚 **{len(protocols_available)} protocols available** for the AI to reference.")
@@ -763,12 +937,20 @@ elif page == "📋 Protocols":
                     if not question: st.error("Please enter a question.")
                     else:
                         with st.spinner("🧠 AI is processing..."):
-                            payload = {"question": question}
-                            result = make_request("POST", "/protocols/ask/", json=payload)
+                            payload = {"question": question, "stream": True}
+                            response = stream_request("/protocols/ask/", json=payload)
                             
-                            if result:
+                        if response is not None:
+                            with response:
+                                streamed = response.headers.get('content-type', '').startswith('text/plain')
                                 st.markdown("---"); st.markdown("#### 💬 AI Response:")
-                                st.info(result.get('answer', 'No answer generated.'))
+                                if streamed: # Tokens are shown as Groq generates them
+                                    result = {"protocols_found": int(response.headers.get('X-Protocols-Found', 0)),
+                                              "protocols_used_in_context": json.loads(response.headers.get('X-Protocols-Used', '[]'))}
+                                    st.write_stream(response.iter_content(chunk_size=None, decode_unicode=True))
+                                else:
+                                    result = response.json()
+                                    st.info(result.get('answer', 'No answer generated.'))
                                 st.markdown("---"); st.markdown("#### 📖 Protocols Used:")
                                 protocols_used = result.get('protocols_used_in_context', [])
                                 if protocols_used:
@@ -786,4 +968,7 @@ st.markdown(
     "🏥 Nurse Admin Dashboard | Hackathon Project | FastAPI & Groq AI"
     "</div>",
     unsafe_allow_html=True
-)
\ No newline at end of file
+)
+
+# One-shot balloons queued by celebrate() during this run (or the run before an st.rerun())
+if st.session_state.pop('_show_balloons', False): st.balloons()
@@ -1,8 +1,12 @@
-from fastapi import FastAPI, HTTPException, Query, UploadFile, File
+from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field, validator
 from datetime import date, datetime, timedelta
 from typing import List, Optional, Dict, Any, Tuple, Set
+import asyncio
+import heapq
 import json
 import os
 from groq import Groq
@@ -10,11 +14,42 @@ import PyPDF2
 import io
 import re # Import regex
 import random # Import random for shuffling and leave
+from operator import itemgetter
 from dotenv import load_dotenv
 
+# Optional: orjson for file I/O and responses (stdlib json and JSONResponse otherwise)
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:
+    orjson = None
+    from fastapi.responses import JSONResponse as FastJSONResponse
+
+# Optional: Arrow IPC responses for tabular endpoints (JSON is always available)
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Optional: PDFium (native) text extraction; PyPDF2 is the pure-Python fallback
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# Optional: semantic protocol search with the same MiniLM embeddings + Chroma stack as the
+# symptom RAG in ../main.py; the keyword index answers questions without it
+try:
+    from langchain_chroma import Chroma
+    from langchain_huggingface import HuggingFaceEmbeddings
+except ImportError:
+    Chroma = None
+
 load_dotenv() # Load .env file if used
 
-app = FastAPI(title="Nurse Admin API", version="2.0")
+# Routes render with orjson; hot list routes return FastJSONResponse themselves so records
+# loaded from our own (already validated) files skip jsonable_encoder as well
+app = FastAPI(title="Nurse Admin API", version="2.0", default_response_class=FastJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -25,6 +60,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress responses over 1 KB (JSON lists compress ~5x; Arrow streams as well)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Initialize Groq client
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 if not GROQ_API_KEY:
@@ -40,21 +78,50 @@ except Exception as e:
 
 # JSON file paths
 INVENTORY_FILE = "inventory.json"
-BILLING_FILE = "billing.json"
-ROSTER_FILE = "roster.json"
+BILLING_FILE = "billing.jsonl" # Append-only tables (see load_jsonl)
+ROSTER_FILE = "roster.jsonl"
 PROTOCOLS_FILE = "protocols.json"
-PROTOCOL_CHUNKS_FILE = "protocol_chunks.json"
+ID_COUNTERS_FILE = "id_counters.json" # {table filename: next free id}
+PROTOCOL_CHUNKS_DIR = "protocol_chunks" # One {"chunks": [...]} file per protocol id
+PROTOCOL_CHUNKS_FILE = "protocol_chunks.json" # Legacy single-list store, migrated on first use
+
+# Parsed JSON files keyed by filename -> (st_mtime_ns, st_size, data). An unchanged
+# file is served from memory without re-reading or re-parsing. The cached object is
+# shared between requests, so only mutate it right before passing it to save_json.
+_JSON_CACHE: Dict[str, Tuple[int, int, Any]] = {}
+
+def _file_version(filename):
+    st = os.stat(filename)
+    return st.st_mtime_ns, st.st_size
+
+# Records reach the files as plain JSON types (the models' validators hand dates over as
+# ISO strings), so orjson needs no default= fallback or non-str-key handling
+if orjson is not None:
+    json_loads = orjson.loads
+    _ENCODE_OPTS = orjson.OPT_INDENT_2
+    def json_dumps(data, indent=False):
+        """data as UTF-8 JSON bytes"""
+        return orjson.dumps(data, option=_ENCODE_OPTS if indent else None)
+else:
+    json_loads = json.loads # Accepts bytes as well
+    def json_dumps(data, indent=False):
+        """data as UTF-8 JSON bytes"""
+        return json.dumps(data, ensure_ascii=False, indent=2 if indent else None, separators=None if indent else (",", ":")).encode('utf-8')
 
 # ===== HELPER FUNCTIONS =====
 def load_json(filename):
-    """Load JSON file with error handling"""
+    """Load JSON file with error handling (cached until the file's mtime/size changes)"""
     if os.path.exists(filename):
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
+            version = _file_version(filename)
+            cached = _JSON_CACHE.get(filename)
+            if cached is not None and cached[:2] == version: return cached[2]
+            with open(filename, 'rb') as f:
                 content = f.read()
-                if not content: return [] # Handle empty file
-                return json.loads(content)
-        except json.JSONDecodeError:
+                data = json_loads(content) if content.strip() else [] # Handle empty file
+            _JSON_CACHE[filename] = (*version, data)
+            return data
+        except json.JSONDecodeError: # orjson.JSONDecodeError subclasses it
             print(f"Warning: Could not decode JSON from {filename}. Returning empty list.")
             return []
         except Exception as e:
@@ -66,42 +133,465 @@ def load_json(filename):
 def save_json(filename, data):
     """Save JSON file with error handling"""
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, default=str, ensure_ascii=False)
+        payload = json_dumps(data, indent=True)
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_filename, filename) # Readers (and a crash mid-write) never see a torn file
+        # data holds only JSON types (see _ENCODE_OPTS), so it is cached as written instead of re-parsed
+        _JSON_CACHE[filename] = (*_file_version(filename), data)
     except Exception as e:
+        _JSON_CACHE.pop(filename, None) # Caller may have mutated the cached object; re-read next time
         print(f"Error saving {filename}: {e}")
 
-def get_next_id(data):
-    """Get next available ID"""
+# ===== APPEND-ONLY TABLES (JSONL) =====
+# Billing and roster are stored one JSON record per line. Inserts append the record,
+# updates append {"_op": "patch", "id": ..., <fields>} and deletes {"_op": "delete", "id": ...},
+# so a write costs O(record) instead of rewriting the whole file. Loading replays the log;
+# once it has collected COMPACT_AFTER_OPS patch/delete lines it is rewritten as a snapshot.
+COMPACT_AFTER_OPS = 200
+LEGACY_JSON_FILES = {BILLING_FILE: "billing.json", ROSTER_FILE: "roster.json"} # Migrated on first load
+
+def _encode_jsonl(records):
+    return b"".join(json_dumps(r) + b"\n" for r in records)
+
+def _apply_op(data, record):
+    """Applies one parsed log line to a loaded table (list of records); returns True for patch/delete"""
+    op = record.pop('_op', None) if isinstance(record, dict) else None
+    if op is None:
+        data.append(record)
+        return False
+    for i, existing in enumerate(data):
+        if isinstance(existing, dict) and existing.get('id') == record.get('id'):
+            if op == "delete": del data[i]
+            else: data[i] = {**existing, **{k: v for k, v in record.items() if k != 'id'}}
+            break
+    return True
+
+def load_jsonl(filename):
+    """Load an append-only table (cached until the file's mtime/size changes)"""
+    if not os.path.exists(filename):
+        legacy = LEGACY_JSON_FILES.get(filename)
+        if not (legacy and os.path.exists(legacy)):
+            print(f"Info: File {filename} not found. Returning empty list.")
+            return []
+        save_jsonl(filename, load_json(legacy))
+        print(f"Migrated {legacy} to append-only {filename}")
+    try:
+        version = _file_version(filename)
+        cached = _JSON_CACHE.get(filename)
+        if cached is not None and cached[:2] == version: return cached[2]
+        records = {} # id (or line number for id-less records) -> record, in insertion order
+        op_count = 0
+        with open(filename, 'rb') as f:
+            for line_no, line in enumerate(f):
+                if not line.strip(): continue
+                try: record = json_loads(line)
+                except json.JSONDecodeError:
+                    print(f"Warning: Skipping undecodable line {line_no + 1} in {filename}.")
+                    continue
+                op = record.pop('_op', None) if isinstance(record, dict) else None
+                key = record.get('id', ('line', line_no)) if isinstance(record, dict) else ('line', line_no)
+                if op is None: records[key] = record
+                elif op == "delete": op_count += 1; records.pop(key, None)
+                else:
+                    op_count += 1
+                    if isinstance(records.get(key), dict): records[key].update({k: v for k, v in record.items() if k != 'id'})
+        data = list(records.values())
+        if op_count >= COMPACT_AFTER_OPS: save_jsonl(filename, data)
+        else: _JSON_CACHE[filename] = (*version, data)
+        return data
+    except Exception as e:
+        print(f"Error loading {filename}: {e}")
+        return []
+
+def append_jsonl(filename, *records):
+    """Append records / patch / delete ops to a table, keeping an up-to-date cache in step"""
+    try:
+        cached = _JSON_CACHE.get(filename)
+        fresh = cached is not None and os.path.exists(filename) and cached[:2] == _file_version(filename)
+        payload = _encode_jsonl(records)
+        with open(filename, 'ab') as f:
+            f.write(payload)
+        if fresh:
+            data = list(cached[2]) # Applied to a copy: readers of the cached list keep views that match it
+            for line in payload.splitlines(): _apply_op(data, json_loads(line))
+            _JSON_CACHE[filename] = (*_file_version(filename), data)
+        else: _JSON_CACHE.pop(filename, None)
+    except Exception as e:
+        _JSON_CACHE.pop(filename, None)
+        print(f"Error appending to {filename}: {e}")
+
+def save_jsonl(filename, data):
+    """Rewrite a table as a compacted snapshot (bulk changes and log compaction)"""
+    try:
+        payload = _encode_jsonl(data)
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_filename, filename) # Readers never see a half-written snapshot
+        _JSON_CACHE[filename] = (*_file_version(filename), list(data))
+    except Exception as e:
+        _JSON_CACHE.pop(filename, None)
+        print(f"Error saving {filename}: {e}")
+
+def _max_id_plus_one(data):
     if not data or not isinstance(data, list): return 1
     ids = [item.get('id', 0) for item in data if isinstance(item, dict)]
     if not ids: return 1
     return max(ids) + 1
 
+def _id_counters():
+    counters = load_json(ID_COUNTERS_FILE) if os.path.exists(ID_COUNTERS_FILE) else {}
+    return counters if isinstance(counters, dict) else {}
+
+def set_next_id(filename, next_id):
+    save_json(ID_COUNTERS_FILE, {**_id_counters(), filename: next_id})
+
+def get_next_id(filename, data):
+    """Reserve and return the next ID for a table (never below the table's max ID + 1, e.g. after a restore)"""
+    next_id = max(_id_counters().get(filename) or 0, _max_id_plus_one(data))
+    set_next_id(filename, next_id + 1)
+    return next_id
+
+def date_ordinal(date_str):
+    """Proleptic ordinal of an ISO date/datetime string (None if missing or invalid)"""
+    if not date_str: return None
+    try: return date.fromisoformat(date_str.split('T')[0]).toordinal()
+    except (ValueError, TypeError, AttributeError): return None
+
+# Lookup keys older versions stored on inventory records; now kept in the
+# inventory_name_keys / inventory_expiry_ords views instead
+LEGACY_INVENTORY_FIELDS = ('item_name_lc', 'expiry_ord')
+_CLEANED_INVENTORY = None # Cached inventory list already stripped of LEGACY_INVENTORY_FIELDS
+
+def load_inventory():
+    """Inventory from INVENTORY_FILE, dropping derived fields stored by older versions"""
+    global _CLEANED_INVENTORY
+    data = load_json(INVENTORY_FILE)
+    if data is not _CLEANED_INVENTORY:
+        for item in data:
+            if isinstance(item, dict):
+                for field in LEGACY_INVENTORY_FIELDS: item.pop(field, None)
+        _CLEANED_INVENTORY = data
+    return data
+
+_CLEANED_ROSTER = None # Cached roster list already stripped of the legacy shift_date_ord field
+
+def load_roster():
+    """Roster entries from ROSTER_FILE (date ordinals are kept in roster_date_ords, not on the entries)"""
+    global _CLEANED_ROSTER
+    data = load_jsonl(ROSTER_FILE)
+    if data is not _CLEANED_ROSTER:
+        for entry in data:
+            if isinstance(entry, dict): entry.pop('shift_date_ord', None) # Stored on entries by older versions
+        _CLEANED_ROSTER = data
+    return data
+
+_CLEANED_BILLING = None # Cached billing list already stripped of the legacy date_ord field
+
+def load_billing():
+    """Bills from BILLING_FILE (date ordinals are kept in billing_date_ords, not on the bills)"""
+    global _CLEANED_BILLING
+    data = load_jsonl(BILLING_FILE)
+    if data is not _CLEANED_BILLING:
+        for bill in data:
+            if isinstance(bill, dict): bill.pop('date_ord', None) # Stored on bills by older versions
+        _CLEANED_BILLING = data
+    return data
+
+# Derived views (pending bills, low stock) keyed by name -> (source list, file version, value).
+# A view is rebuilt only when its table is rewritten (save_json) or appended to (append_jsonl).
+_VIEW_CACHE: Dict[str, Tuple[Any, Any, Any]] = {}
+
+def cached_view(name, filename, data, build):
+    """build(data), reused until data (as loaded from filename) changes"""
+    cached = _JSON_CACHE.get(filename)
+    version = cached[:2] if cached is not None and cached[2] is data else None
+    view = _VIEW_CACHE.get(name)
+    if version is not None and view is not None and view[0] is data and view[1] == version: return view[2]
+    value = build(data)
+    if version is not None: _VIEW_CACHE[name] = (data, version, value)
+    return value
+
+def inventory_index(data):
+    """{id: position} in the list returned by load_inventory(), rebuilt after each inventory write"""
+    return cached_view('inventory_index', INVENTORY_FILE, data,
+                       lambda inventory: {item['id']: i for i, item in enumerate(inventory) if isinstance(item, dict) and 'id' in item})
+
+def inventory_name_keys(data):
+    """Lowercased item_name per position in the list returned by load_inventory() (sort / duplicate key)"""
+    return cached_view('inventory_name_keys', INVENTORY_FILE, data,
+                       lambda inventory: [str(item.get('item_name', '')).lower() if isinstance(item, dict) else '' for item in inventory])
+
+def inventory_expiry_ords(data):
+    """Expiry date ordinal (None if missing/invalid) per position in the list returned by load_inventory()"""
+    return cached_view('inventory_expiry_ords', INVENTORY_FILE, data,
+                       lambda inventory: [date_ordinal(item.get('expiry_date')) if isinstance(item, dict) else None for item in inventory])
+
+def roster_date_ords(data):
+    """shift_date ordinal (None if missing/invalid) per position in the list returned by load_roster()"""
+    return cached_view('roster_date_ords', ROSTER_FILE, data,
+                       lambda roster: [date_ordinal(entry.get('shift_date')) if isinstance(entry, dict) else None for entry in roster])
+
+def billing_date_ords(data):
+    """Bill date ordinal (None if missing/invalid) per position in the list returned by load_billing()"""
+    return cached_view('billing_date_ords', BILLING_FILE, data,
+                       lambda bills: [date_ordinal(bill.get('date')) if isinstance(bill, dict) else None for bill in bills])
+
+def protocol_id_index(data):
+    """{id: position} in the protocols list from load_json(PROTOCOLS_FILE), rebuilt after each write"""
+    return cached_view('protocol_id_index', PROTOCOLS_FILE, data,
+                       lambda protocols: {p['id']: i for i, p in enumerate(protocols) if isinstance(p, dict) and p.get('id')})
+
+def with_stock_fields(item, today_date, expiry_ord):
+    """Copy of an inventory item with server-computed is_low_stock and days_until_expiry"""
+    item_copy = item.copy()
+    item_copy['is_low_stock'] = item.get('quantity', 0) <= item.get('reorder_level', 10)
+    item_copy['days_until_expiry'] = None if expiry_ord is None else expiry_ord - today_date.toordinal()
+    return item_copy
+
+def file_etag(filename):
+    """Weak ETag from a JSON file's mtime and size (None if the file is missing)"""
+    try: st = os.stat(filename)
+    except OSError: return None
+    return f'W/"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def json_cache_fresh(*filenames):
+    """True if every file is already parsed in _JSON_CACHE and unchanged on disk"""
+    for filename in filenames:
+        cached = _JSON_CACHE.get(filename)
+        try:
+            if cached is None or cached[:2] != _file_version(filename): return False
+        except OSError: return False
+    return True
+
+async def run_cached(build, *filenames):
+    """build() on the event loop when its files are cached (no disk read), else in a worker thread"""
+    if json_cache_fresh(*filenames): return build()
+    return await asyncio.to_thread(build)
+
+# Tabular list endpoints (inventory, low stock, expiring, billing) answer with an Arrow IPC
+# stream instead of JSON when the client sends "Accept: application/vnd.apache.arrow.stream"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+def tabular_response(request: Request, rows, headers=None):
+    """rows as an Arrow IPC stream if the client accepts one, else (or if Arrow can't encode them) as JSON"""
+    if pa is not None and ARROW_MEDIA_TYPE in request.headers.get("accept", ""):
+        try:
+            table = pa.Table.from_pylist(rows)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer: writer.write_table(table)
+            return Response(sink.getvalue().to_pybytes(), media_type=ARROW_MEDIA_TYPE, headers=headers)
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            print(f"Warning: Could not encode {request.url.path} as Arrow ({e}). Sending JSON.")
+    return FastJSONResponse(rows, headers=headers)
+
+async def conditional_json(request: Request, filename, build):
+    """build() as JSON tagged with the file's ETag, or a bare 304 if the client already has that version"""
+    etag = file_etag(filename)
+    headers = {"ETag": etag} if etag else None
+    if etag and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(await run_cached(build, filename), headers=headers)
+
+# ===== PROTOCOL CHUNK STORE =====
+WORD_RE = re.compile(r'\b\w+\b')
+# Query words too common to say anything about which protocol is meant
+QUERY_STOPWORDS = frozenset({"the", "a", "an", "is", "are", "of", "and", "or", "to", "in", "for", "on", "at", "by", "with", "be", "it", "i", "do", "does", "what", "how"})
+
+def query_keywords(question):
+    """Distinct lowercased words of a question, minus QUERY_STOPWORDS"""
+    return {w for w in WORD_RE.findall(question.lower()) if w not in QUERY_STOPWORDS}
+
+def chunk_tokens(chunk):
+    """Distinct lowercased words of a chunk (what the protocol index is built from)"""
+    return sorted(set(WORD_RE.findall(chunk.lower())))
+
+def ensure_protocol_chunks_dir():
+    """Creates PROTOCOL_CHUNKS_DIR on first use, splitting the legacy PROTOCOL_CHUNKS_FILE into it"""
+    if not os.path.isdir(PROTOCOL_CHUNKS_DIR):
+        os.makedirs(PROTOCOL_CHUNKS_DIR, exist_ok=True)
+        if os.path.exists(PROTOCOL_CHUNKS_FILE):
+            legacy = load_json(PROTOCOL_CHUNKS_FILE)
+            for entry in legacy:
+                if isinstance(entry, dict) and 'protocol_id' in entry:
+                    write_protocol_chunk_files(entry['protocol_id'], entry.get('chunks', [])) # Vector store backfills itself
+            os.replace(PROTOCOL_CHUNKS_FILE, f"{PROTOCOL_CHUNKS_FILE}.migrated")
+            _JSON_CACHE.pop(PROTOCOL_CHUNKS_FILE, None)
+            print(f"Migrated {len(legacy)} chunk entries from {PROTOCOL_CHUNKS_FILE} to {PROTOCOL_CHUNKS_DIR}/")
+
+def protocol_chunks_path(protocol_id):
+    ensure_protocol_chunks_dir()
+    return os.path.join(PROTOCOL_CHUNKS_DIR, f"{protocol_id}.json")
+
+def load_protocol_chunks(protocol_id):
+    """Text chunks of one protocol ([] if it has none)"""
+    path = protocol_chunks_path(protocol_id)
+    if not os.path.exists(path): return []
+    entry = load_json(path)
+    return entry.get('chunks', []) if isinstance(entry, dict) else []
+
+# Chunk file path -> (st_mtime_ns, st_size, raw {"chunks": [...]} bytes or None if it has no chunks)
+_CHUNK_BYTES_CACHE: Dict[str, Tuple[int, int, Optional[bytes]]] = {}
+
+def protocol_chunks_json(protocol_id):
+    """Raw JSON bytes of a protocol's chunk file (None if missing or without chunks), read once per file version"""
+    path = protocol_chunks_path(protocol_id)
+    try: version = _file_version(path)
+    except OSError: return None
+    cached = _CHUNK_BYTES_CACHE.get(path)
+    if cached is not None and cached[:2] == version: return cached[2]
+    try:
+        with open(path, 'rb') as f: raw = f.read().strip()
+        entry = json_loads(raw) if raw else None
+    except (OSError, json.JSONDecodeError): return None
+    chunk_json = raw if isinstance(entry, dict) and entry.get('chunks') else None
+    _CHUNK_BYTES_CACHE[path] = (*version, chunk_json)
+    return chunk_json
+
+def protocol_tokens_path(protocol_id):
+    ensure_protocol_chunks_dir()
+    return os.path.join(PROTOCOL_CHUNKS_DIR, f"{protocol_id}.tokens.json")
+
+def load_protocol_tokens(protocol_id, chunks):
+    """Per-chunk word lists saved at ingest; tokenized on the fly for chunks saved before they existed"""
+    path = protocol_tokens_path(protocol_id)
+    tokens = load_json(path) if os.path.exists(path) else None
+    if isinstance(tokens, list) and len(tokens) == len(chunks): return tokens
+    return [chunk_tokens(chunk) for chunk in chunks]
+
+def write_protocol_chunk_files(protocol_id, chunks):
+    # Tokens go in a sidecar so the chunk file stays {"chunks": [...]} (served as-is by /full)
+    save_json(protocol_tokens_path(protocol_id), [chunk_tokens(chunk) for chunk in chunks])
+    save_json(protocol_chunks_path(protocol_id), {'chunks': chunks})
+
+def save_protocol_chunks(protocol_id, chunks):
+    vector_db = protocol_vector_db() # Opened first so its backfill does not also pick up these chunks
+    write_protocol_chunk_files(protocol_id, chunks)
+    if vector_db is not None: add_protocol_vectors(vector_db, protocol_id, chunks)
+
+def delete_protocol_chunks(protocol_id):
+    for path in (protocol_chunks_path(protocol_id), protocol_tokens_path(protocol_id)):
+        _JSON_CACHE.pop(path, None)
+        _CHUNK_BYTES_CACHE.pop(path, None)
+        try: os.remove(path)
+        except FileNotFoundError: pass
+    vector_db = _PROTOCOL_VECTOR_DB # Not opened yet: the open prunes deleted protocols, no model load needed here
+    if vector_db:
+        try: vector_db.delete(where={"protocol_id": protocol_id})
+        except Exception as e: print(f"Warning: Could not remove protocol {protocol_id} from the vector store: {e}")
+
+# ===== PROTOCOL VECTOR STORE (optional) =====
+PROTOCOL_VECTOR_DIR = "protocol_chroma_db"
+PROTOCOL_VECTOR_K = 8 # Chunks fetched per question (the prompt still uses at most ASK_MAX_CHUNKS)
+ASK_MAX_CHUNKS = 5 # Excerpts sent to the LLM per question
+_PROTOCOL_VECTOR_DB = None # Chroma store once opened; False if unavailable
+
+def add_protocol_vectors(vector_db, protocol_id, chunks):
+    """Embeds a protocol's chunks in one batch and stores them (ids "<protocol_id>-<chunk_index>")"""
+    if not chunks: return
+    try:
+        vector_db.add_texts(texts=chunks, metadatas=[{"protocol_id": protocol_id, "chunk_index": i} for i in range(len(chunks))],
+                            ids=[f"{protocol_id}-{i}" for i in range(len(chunks))])
+    except Exception as e:
+        print(f"Warning: Could not embed protocol {protocol_id}: {e}")
+
+def protocol_vector_db():
+    """Chroma store of protocol chunks, opened on first use (None without langchain-chroma/-huggingface)"""
+    global _PROTOCOL_VECTOR_DB
+    if Chroma is None or _PROTOCOL_VECTOR_DB is False: return None
+    if _PROTOCOL_VECTOR_DB is None:
+        ensure_protocol_chunks_dir() # Migrate legacy chunks before the backfill reads them
+        try:
+            embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2", model_kwargs={'device': 'cpu'}, encode_kwargs={'batch_size': 64})
+            vector_db = Chroma(collection_name="protocol_chunks", persist_directory=PROTOCOL_VECTOR_DIR, embedding_function=embeddings)
+            indexed = {m.get("protocol_id") for m in vector_db.get(include=["metadatas"])["metadatas"] if m}
+        except Exception as e:
+            print(f"Warning: Protocol vector store unavailable ({e}). Using keyword search.")
+            _PROTOCOL_VECTOR_DB = False
+            return None
+        _PROTOCOL_VECTOR_DB = vector_db
+        # Backfill protocols saved before the store existed, and drop ones deleted while it was closed
+        live_ids = set()
+        for meta in load_json(PROTOCOLS_FILE):
+            if isinstance(meta, dict) and meta.get('id'):
+                live_ids.add(meta['id'])
+                if meta['id'] not in indexed: add_protocol_vectors(vector_db, meta['id'], load_protocol_chunks(meta['id']))
+        stale_ids = [pid for pid in indexed if pid not in live_ids]
+        if stale_ids:
+            try: vector_db.delete(where={"protocol_id": {"$in": stale_ids}})
+            except Exception as e: print(f"Warning: Could not prune deleted protocols from the vector store: {e}")
+        print(f"Opened protocol vector store ({PROTOCOL_VECTOR_DIR}).")
+    return _PROTOCOL_VECTOR_DB
+
+def semantic_protocol_chunks(question, protocols_meta):
+    """Nearest chunks to the question as relevant_chunks entries (best first), [] without a vector store"""
+    vector_db = protocol_vector_db()
+    if vector_db is None: return []
+    positions = protocol_id_index(protocols_meta)
+    try: docs = vector_db.similarity_search(question, k=PROTOCOL_VECTOR_K)
+    except Exception as e:
+        print(f"Warning: Vector search failed ({e}). Using keyword search.")
+        return []
+    relevant_chunks = []
+    for rank, doc in enumerate(docs):
+        i = positions.get(doc.metadata.get("protocol_id"))
+        if i is None: continue # Protocol deleted since it was embedded
+        meta = protocols_meta[i]
+        relevant_chunks.append({'protocol_id': meta['id'], 'title': meta.get('title', 'N/A'), 'category': meta.get('category', 'N/A'), 'chunk_index': doc.metadata.get("chunk_index", 0), 'content': doc.page_content, 'score': len(docs) - rank})
+    return relevant_chunks
+
+def build_protocol_index(protocols_meta):
+    """Inverted index over all protocol chunks: word -> {(protocol_id, chunk_index), ...}"""
+    index: Dict[str, Set[Tuple[int, int]]] = {}
+    for meta in protocols_meta:
+        if not isinstance(meta, dict) or not meta.get('id'): continue
+        chunks = load_protocol_chunks(meta['id'])
+        for i, words in enumerate(load_protocol_tokens(meta['id'], chunks)):
+            for word in words:
+                index.setdefault(word, set()).add((meta['id'], i))
+    print(f"Built protocol index: {len(index)} words.")
+    return index
+
+def chunk_spans(text_length: int, chunk_size: int = 500, overlap: int = 50):
+    """Yields (start, end) offsets of overlapping chunks based on character count."""
+    for start in range(0, text_length, chunk_size):
+        yield start, min(start + chunk_size + overlap, text_length)
+
 def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-    """Splits text into overlapping chunks based on character count."""
+    """Splits text into overlapping chunks; substrings are only cut at the persistence boundary."""
     if not text: return []
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        actual_end = min(end + overlap, len(text))
-        chunks.append(text[start:actual_end])
-        start += chunk_size
-        if start >= len(text): break
-    print(f"Chunking: Created {len(chunks)} chunks from text.")
-    return chunks
+    return [text[start:end] for start, end in chunk_spans(len(text), chunk_size, overlap)]
 
 def extract_text_from_pdf(pdf_content_bytes):
     """Extract text content from PDF bytes"""
-    text = ""
+    if pdfium is not None:
+        try:
+            pdf = pdfium.PdfDocument(pdf_content_bytes)
+            try:
+                parts = []
+                for page in pdf:
+                    textpage = page.get_textpage()
+                    page_text = textpage.get_text_range()
+                    textpage.close(); page.close()
+                    if page_text: parts.append(page_text)
+            finally:
+                pdf.close()
+            text = "\n".join(parts)
+            print(f"PDF Extraction (pdfium): Extracted {len(text)} characters.")
+            return text.strip() or None
+        except Exception as e:
+            print(f"Warning: pdfium could not read PDF ({e}). Falling back to PyPDF2.")
     try:
         pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_content_bytes))
+        parts = [] # Joined once: += on str is quadratic in the page count
         for page in pdf_reader.pages:
             page_text = page.extract_text()
-            if page_text: text += page_text + "\n"
+            if page_text: parts.append(page_text)
+        text = "\n".join(parts)
         print(f"PDF Extraction: Extracted {len(text)} characters.")
-        return text.strip() if text else None
+        return text.strip() or None
     except Exception as e:
         print(f"Error reading PDF content: {e}")
         return None
@@ -120,11 +610,12 @@ class InventoryItem(BaseModel):
 
     @validator('expiry_date', pre=True, always=True)
     def validate_expiry_date_format(cls, v):
+        """Normalizes the expiry date (or datetime) to a YYYY-MM-DD string"""
         if v:
-            try: date.fromisoformat(v)
+            try: return date.fromisoformat(v).isoformat()
             except (ValueError, TypeError):
-                 try: datetime.fromisoformat(v.replace('Z', '+00:00'))
-                 except ValueError: raise ValueError('Invalid date format. Use YYYY-MM-DD')
+                 try: return datetime.fromisoformat(v.replace('Z', '+00:00')).date().isoformat()
+                 except (ValueError, AttributeError): raise ValueError('Invalid date format. Use YYYY-MM-DD')
         return v
 
 class BillingItem(BaseModel):
@@ -152,9 +643,8 @@ class RosterEntry(BaseModel):
 
     @validator('shift_date', pre=True, always=True)
     def validate_shift_date_format(cls, v):
-        try: date.fromisoformat(v)
+        try: return date.fromisoformat(v).isoformat()
         except (ValueError, TypeError): raise ValueError('Invalid shift_date format. Use YYYY-MM-DD')
-        return v
 
 class Protocol(BaseModel):
     title: str = Field(..., min_length=1)
@@ -164,6 +654,7 @@ class Protocol(BaseModel):
 
 class ProtocolQuery(BaseModel):
     question: str = Field(..., min_length=1)
+    stream: bool = False # Stream the answer as plain text (metadata in X-Protocols-* headers)
 
 # ===== NEW ROSTER GENERATOR MODEL =====
 class RosterRequest(BaseModel):
@@ -171,216 +662,211 @@ class RosterRequest(BaseModel):
     start_date: str # YYYY-MM-DD
     num_days: int = Field(14, gt=0, le=30)
     shifts_per_day: Dict[str, int] = {"Morning": 1, "Afternoon": 1, "Night": 1}
+    seed: Optional[int] = None # Set to make leave days and shift picks reproducible
     # Leave/unavailability is now handled by the generator
 
     @validator('start_date', pre=True, always=True)
     def validate_start_date_format(cls, v):
-        try: date.fromisoformat(v)
+        try: return date.fromisoformat(v).isoformat()
         except (ValueError, TypeError): raise ValueError('Invalid start_date format. Use YYYY-MM-DD')
-        return v
 
 # ===== ROOT ENDPOINT =====
 @app.get("/")
 def read_root():
-     return {"message": "Nurse Admin API v2.0", "endpoints": {"inventory": "/inventory/", "billing": "/billing/", "roster": "/roster/", "protocols": "/protocols/", "analytics": "/analytics/"}}
+     return {"message": "Nurse Admin API v2.0", "endpoints": {"inventory": "/inventory/", "billing": "/billing/", "roster": "/roster/", "protocols": "/protocols/", "analytics": "/analytics/", "pages": "/page/"}}
 
 # ===== INVENTORY ENDPOINTS =====
+def inventory_items():
+    inventory = load_inventory()
+    today_date = date.today()
+    expiry_ords = inventory_expiry_ords(inventory)
+    order = sorted(range(len(inventory)), key=inventory_name_keys(inventory).__getitem__)
+    return [with_stock_fields(inventory[i], today_date, expiry_ords[i]) for i in order if isinstance(inventory[i], dict)]
+
+# Hot GETs are async: served straight from _JSON_CACHE without a threadpool hop,
+# and only a cache miss (file changed on disk) is read in a worker thread
 @app.get("/inventory/")
-def list_inventory():
-    inventory = load_json(INVENTORY_FILE)
-    return sorted(inventory, key=lambda x: x.get('item_name', '').lower())
+async def list_inventory(request: Request):
+    return tabular_response(request, await run_cached(inventory_items, INVENTORY_FILE))
+
+def available_items():
+    inventory = load_inventory()
+    today_ord = date.today().toordinal()
+    # In stock and not expired (missing/invalid expiry dates count as not expired)
+    names, expiry_ords = inventory_name_keys(inventory), inventory_expiry_ords(inventory)
+    available = [i for i, item in enumerate(inventory) if isinstance(item, dict) and item.get('quantity', 0) > 0
+                 and (expiry_ords[i] is None or expiry_ords[i] > today_ord)]
+    available.sort(key=names.__getitem__)
+    available = [inventory[i] for i in available]
+    return [{'id': item.get('id', 'N/A'), 'item_name': item.get('item_name', 'Unnamed Item'), 'manufacturer': item.get('manufacturer', 'Unknown'), 'price': item.get('price', 0.0), 'quantity_available': item.get('quantity', 0), 'unit': item.get('unit', 'units'), 'category': item.get('category', 'General')} for item in available]
 
 @app.get("/inventory/available")
-def list_available_items():
-    inventory = load_json(INVENTORY_FILE)
-    today_date = date.today()
-    available_items = []
-    for item in inventory:
-        if not isinstance(item, dict) or item.get('quantity', 0) <= 0: continue
-        expiry_date_str = item.get('expiry_date')
-        is_expired = False
-        if expiry_date_str:
-            try:
-                exp_date = date.fromisoformat(expiry_date_str.split('T')[0])
-                if exp_date <= today_date: is_expired = True
-            except (ValueError, TypeError): pass
-        if is_expired: continue
-        available_items.append({'id': item.get('id', 'N/A'), 'item_name': item.get('item_name', 'Unnamed Item'), 'manufacturer': item.get('manufacturer', 'Unknown'), 'price': item.get('price', 0.0), 'quantity_available': item.get('quantity', 0), 'unit': item.get('unit', 'units'), 'category': item.get('category', 'General')})
-    return sorted(available_items, key=lambda x: x['item_name'].lower())
+async def list_available_items():
+    return FastJSONResponse(await run_cached(available_items, INVENTORY_FILE))
 
 @app.post("/inventory/", status_code=201)
 def add_inventory_item(item: InventoryItem):
-    data = load_json(INVENTORY_FILE)
-    if any(i.get('item_name', '').lower() == item.item_name.lower() for i in data if isinstance(i, dict)):
+    data = load_inventory()
+    name_lc = item.item_name.lower()
+    if name_lc in inventory_name_keys(data):
         raise HTTPException(status_code=400, detail="Item with this name already exists")
-    new_item_dict = item.dict()
-    new_item_dict['id'] = get_next_id(data)
+    new_item_dict = item.model_dump(mode='json')
+    new_item_dict['id'] = get_next_id(INVENTORY_FILE, data)
     now_iso = datetime.now().isoformat()
     new_item_dict['created_at'] = now_iso
     new_item_dict['last_updated'] = now_iso
-    if new_item_dict.get('expiry_date'):
-         try: new_item_dict['expiry_date'] = date.fromisoformat(new_item_dict['expiry_date'].split('T')[0]).isoformat()
-         except: pass
-    data.append(new_item_dict)
-    save_json(INVENTORY_FILE, data)
+    save_json(INVENTORY_FILE, data + [new_item_dict]) # New list: readers of the cached one keep a consistent index
     return new_item_dict
 
 @app.put("/inventory/{item_id}")
 def update_inventory_item(item_id: int, item_update: InventoryItem):
-    data = load_json(INVENTORY_FILE)
-    updated = False
-    for i, existing_item in enumerate(data):
-        if isinstance(existing_item, dict) and existing_item.get('id') == item_id:
-            update_data_dict = item_update.dict(exclude_unset=True)
-            update_data_dict['created_at'] = existing_item.get('created_at', datetime.now().isoformat())
-            update_data_dict['last_updated'] = datetime.now().isoformat()
-            update_data_dict['id'] = item_id
-            if 'expiry_date' in update_data_dict and update_data_dict['expiry_date']:
-                 try: update_data_dict['expiry_date'] = date.fromisoformat(update_data_dict['expiry_date'].split('T')[0]).isoformat()
-                 except: pass
-            data[i] = update_data_dict
-            save_json(INVENTORY_FILE, data)
-            updated = True
-            return data[i]
-    if not updated: raise HTTPException(status_code=404, detail=f"Item with ID {item_id} not found")
+    data = load_inventory()
+    i = inventory_index(data).get(item_id)
+    if i is None: raise HTTPException(status_code=404, detail=f"Item with ID {item_id} not found")
+    existing_item = data[i]
+    update_data_dict = item_update.model_dump(mode='json', exclude_unset=True)
+    update_data_dict['created_at'] = existing_item.get('created_at', datetime.now().isoformat())
+    update_data_dict['last_updated'] = datetime.now().isoformat()
+    update_data_dict['id'] = item_id
+    save_json(INVENTORY_FILE, data[:i] + [update_data_dict] + data[i + 1:])
+    return update_data_dict
 
 @app.delete("/inventory/{item_id}", status_code=200)
 def delete_inventory_item(item_id: int):
-    data = load_json(INVENTORY_FILE)
-    initial_count = len(data)
-    data = [item for item in data if not (isinstance(item, dict) and item.get('id') == item_id)]
-    if len(data) == initial_count: raise HTTPException(status_code=404, detail=f"Item with ID {item_id} not found")
-    save_json(INVENTORY_FILE, data)
+    data = load_inventory()
+    i = inventory_index(data).get(item_id)
+    if i is None: raise HTTPException(status_code=404, detail=f"Item with ID {item_id} not found")
+    save_json(INVENTORY_FILE, data[:i] + data[i + 1:]) # New list: the cached one (and its index) stay intact
     return {"message": "Item deleted successfully"}
 
+def expiring_items(days):
+    inventory = load_inventory()
+    today_ord = date.today().toordinal()
+    target_ord = today_ord + days
+    expiry_ords = inventory_expiry_ords(inventory)
+    expiring = [i for i, item in enumerate(inventory) if isinstance(item, dict) and expiry_ords[i] is not None and today_ord < expiry_ords[i] <= target_ord]
+    expiring.sort(key=expiry_ords.__getitem__)
+    return [{**inventory[i], 'days_until_expiry': expiry_ords[i] - today_ord} for i in expiring]
+
 @app.get("/inventory/expiring/")
-def get_expiring_inventory(days: int = Query(30, ge=1, le=365)):
-    inventory = load_json(INVENTORY_FILE)
-    today_date = date.today()
-    target_date = today_date + timedelta(days=days)
-    expiring = []
-    for item in inventory:
-         if not isinstance(item, dict): continue
-         expiry_date_str = item.get('expiry_date')
-         if expiry_date_str:
-             try:
-                 exp_date = date.fromisoformat(expiry_date_str.split('T')[0])
-                 if today_date < exp_date <= target_date:
-                     days_until = (exp_date - today_date).days
-                     item_copy = item.copy()
-                     item_copy['days_until_expiry'] = days_until
-                     expiring.append(item_copy)
-             except (ValueError, TypeError): pass
-    return sorted(expiring, key=lambda x: x.get('days_until_expiry', 999))
+async def get_expiring_inventory(request: Request, days: int = Query(30, ge=1, le=365)):
+    return tabular_response(request, await run_cached(lambda: expiring_items(days), INVENTORY_FILE))
+
+def low_stock_items():
+    return cached_view('low_stock', INVENTORY_FILE, load_inventory(), lambda inventory: [
+        item for item in inventory if isinstance(item, dict) and item.get('quantity', 0) <= item.get('reorder_level', 10)])
 
 @app.get("/inventory/low-stock/")
-def get_low_stock():
-    inventory = load_json(INVENTORY_FILE)
-    return [item for item in inventory if isinstance(item, dict) and item.get('quantity', 0) <= item.get('reorder_level', 10)]
+async def get_low_stock(request: Request):
+    return tabular_response(request, await run_cached(low_stock_items, INVENTORY_FILE))
 
 # ===== BILLING ENDPOINTS =====
-@app.get("/billing/")
-def list_billing():
-    data = load_json(BILLING_FILE)
+def billing_records():
+    data = load_billing()
     valid_bills = [b for b in data if isinstance(b, dict) and 'date' in b]
     return sorted(valid_bills, key=lambda x: x['date'], reverse=True)
 
+@app.get("/billing/")
+async def list_billing(request: Request):
+    return tabular_response(request, await run_cached(billing_records, BILLING_FILE))
+
 @app.post("/billing/", status_code=201)
 def create_bill(bill: BillingRecord):
-    inventory_data = load_json(INVENTORY_FILE)
-    inventory_backup = [dict(item) for item in inventory_data if isinstance(item, dict)]
-    billing_data = load_json(BILLING_FILE)
-    inventory_map = {item['id']: item for item in inventory_data if isinstance(item, dict) and 'id' in item}
+    inventory_data = load_inventory()
+    billing_data = load_billing()
+    inventory_idx = inventory_index(inventory_data)
+    expiry_ords = inventory_expiry_ords(inventory_data)
     total_amount = 0.0
     enriched_items = []
     items_to_update_in_inventory = {}
     for bill_item in bill.items:
         item_id = bill_item.item_id
         qty_needed = bill_item.quantity
-        inv_item = inventory_map.get(item_id)
+        inv_item = inventory_data[inventory_idx[item_id]] if item_id in inventory_idx else None
         if not inv_item: raise HTTPException(status_code=404, detail=f"Inventory item ID {item_id} not found")
         current_qty = inv_item.get('quantity', 0)
         if current_qty < qty_needed: raise HTTPException(status_code=400, detail=f"Insufficient quantity for {inv_item.get('item_name', 'Unknown')}. Available: {current_qty}, Requested: {qty_needed}")
-        expiry_date_str = inv_item.get('expiry_date')
-        if expiry_date_str:
-            try:
-                exp_date = date.fromisoformat(expiry_date_str.split('T')[0])
-                if exp_date <= date.today(): raise HTTPException(status_code=400, detail=f"Item {inv_item.get('item_name', 'Unknown')} has expired on {exp_date.isoformat()}")
-            except (ValueError, TypeError): pass
+        expiry_ord = expiry_ords[inventory_idx[item_id]]
+        if expiry_ord is not None and expiry_ord <= date.today().toordinal():
+            raise HTTPException(status_code=400, detail=f"Item {inv_item.get('item_name', 'Unknown')} has expired on {date.fromordinal(expiry_ord).isoformat()}")
         unit_price = inv_item.get('price', 0.0)
         subtotal = unit_price * qty_needed
         total_amount += subtotal
         enriched_items.append({'item_id': item_id, 'item_name': inv_item.get('item_name', 'Unknown'), 'manufacturer': inv_item.get('manufacturer', 'Unknown'), 'quantity': qty_needed, 'unit_price': unit_price, 'subtotal': round(subtotal, 2), 'unit': inv_item.get('unit', 'units')})
         items_to_update_in_inventory[item_id] = items_to_update_in_inventory.get(item_id, 0) + qty_needed
+    # Rollback snapshot of just the fields this bill changes, not the whole inventory
+    stock_backup = {iid: (inventory_data[inventory_idx[iid]].get('quantity', 0), inventory_data[inventory_idx[iid]].get('last_updated'))
+                    for iid in items_to_update_in_inventory}
     try:
-        for item in inventory_data:
-             if isinstance(item, dict) and item.get('id') in items_to_update_in_inventory:
-                 item_id_to_update = item['id']
-                 qty_to_deduct = items_to_update_in_inventory[item_id_to_update]
-                 item['quantity'] = item.get('quantity', 0) - qty_to_deduct
-                 item['last_updated'] = datetime.now().isoformat()
+        for item_id_to_update, qty_to_deduct in items_to_update_in_inventory.items():
+            item = inventory_data[inventory_idx[item_id_to_update]]
+            item['quantity'] = item.get('quantity', 0) - qty_to_deduct
+            item['last_updated'] = datetime.now().isoformat()
         save_json(INVENTORY_FILE, inventory_data)
-        new_bill_dict = bill.dict(exclude={'items'})
-        new_bill_dict['id'] = get_next_id(billing_data)
+        new_bill_dict = bill.model_dump(mode='json', exclude={'items'})
+        new_bill_dict['id'] = get_next_id(BILLING_FILE, billing_data)
         new_bill_dict['items'] = enriched_items
         new_bill_dict['total_amount'] = round(total_amount, 2)
         new_bill_dict['date'] = date.today().isoformat()
         new_bill_dict['transaction_time'] = datetime.now().isoformat()
         new_bill_dict['payment_status'] = new_bill_dict.get('payment_status', 'pending')
-        billing_data.append(new_bill_dict)
-        save_json(BILLING_FILE, billing_data)
+        append_jsonl(BILLING_FILE, new_bill_dict)
         return new_bill_dict
     except Exception as e:
         print(f"Error during bill creation/saving: {e}. Rolling back inventory.")
-        save_json(INVENTORY_FILE, inventory_backup)
+        for iid, (quantity, last_updated) in stock_backup.items():
+            item = inventory_data[inventory_idx[iid]]
+            item['quantity'] = quantity
+            if last_updated is None: item.pop('last_updated', None)
+            else: item['last_updated'] = last_updated
+        save_json(INVENTORY_FILE, inventory_data)
         raise HTTPException(status_code=500, detail=f"Internal server error during bill creation: {str(e)}")
 
+def pending_bills():
+    return cached_view('pending_bills', BILLING_FILE, load_billing(), lambda data: [
+        bill for bill in data if isinstance(bill, dict) and bill.get('payment_status') == 'pending'])
+
 @app.get("/billing/pending/")
-def get_pending_bills():
-    data = load_json(BILLING_FILE)
-    return [bill for bill in data if isinstance(bill, dict) and bill.get('payment_status') == 'pending']
+async def get_pending_bills():
+    return FastJSONResponse(await run_cached(pending_bills, BILLING_FILE))
 
 @app.put("/billing/{bill_id}/payment")
 def update_payment_status(bill_id: int, payment_status: str = Query(..., pattern="^(pending|paid|cancelled)$"), payment_method: Optional[str] = Query(None)):
-    data = load_json(BILLING_FILE)
-    updated = False
+    data = load_billing()
     for bill in data:
         if isinstance(bill, dict) and bill.get('id') == bill_id:
-            bill['payment_status'] = payment_status
-            if payment_method: bill['payment_method'] = payment_method
-            bill['last_updated'] = datetime.now().isoformat()
-            save_json(BILLING_FILE, data)
-            updated = True
-            return bill
-    if not updated: raise HTTPException(status_code=404, detail=f"Bill with ID {bill_id} not found")
+            patch = {'payment_status': payment_status, 'last_updated': datetime.now().isoformat()}
+            if payment_method: patch['payment_method'] = payment_method
+            append_jsonl(BILLING_FILE, {'_op': 'patch', 'id': bill_id, **patch})
+            return {**bill, **patch}
+    raise HTTPException(status_code=404, detail=f"Bill with ID {bill_id} not found")
 
 # ===== ROSTER ENDPOINTS (MODIFIED) =====
 @app.get("/roster/")
-def list_roster():
-    """Get all roster entries sorted by date"""
-    data = load_json(ROSTER_FILE)
-    valid_entries = [r for r in data if isinstance(r, dict) and 'shift_date' in r]
-    return sorted(valid_entries, key=lambda x: x['shift_date'])
-
+async def list_roster(request: Request):
+    """Get all roster entries sorted by date (conditional on If-None-Match)"""
+    def build():
+        data = load_roster()
+        valid_entries = [r for r in data if isinstance(r, dict) and 'shift_date' in r]
+        return sorted(valid_entries, key=itemgetter('shift_date'))
+    return await conditional_json(request, ROSTER_FILE, build)
+
+
+def two_week_roster():
+    data = load_roster()
+    today_ord = date.today().toordinal()
+    end_ord = today_ord + 14
+    date_ords = roster_date_ords(data)
+    # Entries with missing/invalid dates have a None ordinal and are skipped
+    result = [i for i, entry in enumerate(data) if isinstance(entry, dict) and date_ords[i] is not None
+              and today_ord <= date_ords[i] <= end_ord]
+    result.sort(key=date_ords.__getitem__)
+    return [data[i] for i in result]
 
 @app.get("/roster/two-weeks/")
-def get_two_week_roster():
+async def get_two_week_roster():
     """Get roster for next 14 days"""
-    data = load_json(ROSTER_FILE)
-    today_date = date.today()
-    end_date = today_date + timedelta(days=14)
-    result = []
-
-    for entry in data:
-        if not isinstance(entry, dict) or 'shift_date' not in entry: continue
-        try:
-            shift_date_obj = date.fromisoformat(entry['shift_date'].split('T')[0])
-            if today_date <= shift_date_obj <= end_date:
-                result.append(entry)
-        except (ValueError, TypeError):
-            pass # Ignore entries with invalid dates
-
-    return sorted(result, key=lambda x: x['shift_date'])
+    return FastJSONResponse(await run_cached(two_week_roster, ROSTER_FILE))
 
 # --- (REMOVED) @app.post("/roster/") ---
 # --- (REMOVED) @app.put("/roster/{roster_id}") ---
@@ -388,12 +874,10 @@ def get_two_week_roster():
 @app.delete("/roster/{roster_id}", status_code=200)
 def delete_roster_entry(roster_id: int):
     """Delete roster entry (Kept for manual cleanup)"""
-    data = load_json(ROSTER_FILE)
-    initial_count = len(data)
-    data = [entry for entry in data if not (isinstance(entry, dict) and entry.get('id') == roster_id)]
-    if len(data) == initial_count:
+    data = load_roster()
+    if not any(isinstance(entry, dict) and entry.get('id') == roster_id for entry in data):
         raise HTTPException(status_code=404, detail=f"Roster entry with ID {roster_id} not found")
-    save_json(ROSTER_FILE, data)
+    append_jsonl(ROSTER_FILE, {'_op': 'delete', 'id': roster_id})
     return {"message": "Roster entry deleted successfully"}
 
 
@@ -415,11 +899,15 @@ def generate_roster(request: RosterRequest):
     # 2. Prepare data structures
     new_entries = []
     # Tracks last assigned shift (date, type)
-    last_shift_map: Dict[str, Tuple[date, str]] = {}
+    last_shift_map: Dict[str, Tuple[int, str]] = {} # (date ordinal, shift type)
     # Tracks consecutive work days
     consecutive_work_days: Dict[str, int] = {name: 0 for name in all_staff_names}
+    # Staff whose counter reached 6, kept in step with consecutive_work_days
+    must_rest: Set[str] = set()
     # Tracks which staff are on leave on which date
-    leave_map: Dict[str, Set[str]] = {name: set() for name in all_staff_names} # Key: staff_name, Value: set of leave date strings
+    leave_by_date: Dict[str, Set[str]] = {} # Key: leave date string, Value: set of staff_names
+
+    rng = random.Random(request.seed) # Per-request generator: seedable, independent of other callers
 
     # --- NEW: Pre-generate random leave days ---
     num_weeks = (request.num_days + 6) // 7 # Calculate number of weeks
@@ -427,27 +915,31 @@ def generate_roster(request: RosterRequest):
         for week_num in range(num_weeks):
             week_start_day_index = week_num * 7
             # Find a valid random day index within the schedule and this week
-            day_index = random.randint(0, 6)
+            day_index = rng.randint(0, 6)
             leave_date_index = week_start_day_index + day_index
             
             if leave_date_index < request.num_days:
                 leave_date = dates_to_schedule[leave_date_index].isoformat()
-                leave_map[staff_name].add(leave_date)
+                leave_by_date.setdefault(leave_date, set()).add(staff_name)
                 print(f"DEBUG: Auto-assigned leave for {staff_name} on {leave_date}") # DEBUG
     
     # 3. Filter existing roster: Keep only entries OUTSIDE the new date range
     # This effectively clears the schedule for the new period.
-    roster_to_keep = [
-        entry for entry in load_json(ROSTER_FILE)
-        if isinstance(entry, dict) and entry.get('shift_date') not in date_str_set
-    ]
-
-    # 4. Find the most recent shift for all staff *before* the new start_date
-    roster_before_start = [e for e in roster_to_keep if e.get('shift_date', 'z') < request.start_date]
-    roster_before_start.sort(key=lambda x: x.get('shift_date', '2000-01-01'))
-    for entry in roster_before_start:
-        if isinstance(entry, dict) and 'staff_name' in entry and 'shift_type' in entry:
-            last_shift_map[entry['staff_name']] = (date.fromisoformat(entry['shift_date']), entry['shift_type'])
+    # 4. In the same pass, find the most recent shift for all staff *before* the new start_date
+    start_ord = start_date.toordinal()
+    roster_to_keep = []
+    roster = load_roster()
+    for entry, entry_ord in zip(roster, roster_date_ords(roster)):
+        if not isinstance(entry, dict) or entry.get('shift_date') in date_str_set: continue
+        roster_to_keep.append(entry)
+        if entry_ord is not None and entry_ord < start_ord and 'staff_name' in entry and 'shift_type' in entry:
+            last = last_shift_map.get(entry['staff_name'])
+            if last is None or entry_ord >= last[0]: # Same date: the later record wins, as before
+                last_shift_map[entry['staff_name']] = (entry_ord, entry['shift_type'])
+    # Staff who worked Night shift the day before the range; afterwards this is
+    # replaced at the end of each day by that day's Night assignments
+    night_workers_yesterday = {name for name, (last_ord, last_shift) in last_shift_map.items()
+                               if last_ord == start_ord - 1 and last_shift == "Night"}
 
     # 5. Define shift types and their start/end times
     shift_definitions = {
@@ -457,33 +949,25 @@ def generate_roster(request: RosterRequest):
     }
     
     # 6. Start Generation Loop
-    current_max_id = get_next_id(roster_to_keep)
+    current_max_id = get_next_id(ROSTER_FILE, roster_to_keep)
     
     for current_date in dates_to_schedule:
         date_str = current_date.isoformat()
         
-        # Staff who worked Night shift yesterday
-        yesterday = current_date - timedelta(days=1)
-        staff_worked_night_yesterday = set()
-        for staff_name in all_staff_names:
-            last_work = last_shift_map.get(staff_name)
-            if last_work:
-                last_date, last_shift = last_work
-                if last_date == yesterday and last_shift == "Night":
-                    staff_worked_night_yesterday.add(staff_name)
-
-        # Staff who must rest (worked 6 days)
-        staff_must_rest = set()
-        for staff_name in all_staff_names:
-            if consecutive_work_days.get(staff_name, 0) >= 6:
-                staff_must_rest.add(staff_name)
+        # Staff who worked Night shift yesterday / must rest (worked 6 days) / are on leave
+        staff_worked_night_yesterday = night_workers_yesterday
+        staff_must_rest = set(must_rest)
+        staff_on_leave = leave_by_date.get(date_str, set())
                 
         # Combine all unavailable staff for this day
-        staff_on_leave = {name for name, dates in leave_map.items() if date_str in dates}
         staff_unavailable_today = staff_on_leave.union(staff_must_rest)
+        working_today: Set[str] = set()
+        night_workers_today: Set[str] = set()
 
         # Assign shifts for the day
         daily_assignments: Dict[str, str] = {} # Tracks who is assigned *today*
+        # Rule 1 (not on leave or resting) only changes per day, so apply it once here
+        available_today = [name for name in all_staff_names if name not in staff_unavailable_today]
         
         # Add pre-generated leave shifts to the roster first
         for staff_name in staff_on_leave:
@@ -516,27 +1000,13 @@ def generate_roster(request: RosterRequest):
                 
             num_assigned = 0
             
-            # Build list of eligible staff
-            eligible_staff = []
-            for staff_name in all_staff_names:
-                # Rule 1: Not on leave or resting
-                if staff_name in staff_unavailable_today:
-                    continue
-                # Rule 2: Not already assigned today
-                if staff_name in daily_assignments:
-                    continue
-                # Rule 3: No "Clopening" (Night -> Morning)
-                if shift_type == "Morning" and staff_name in staff_worked_night_yesterday:
-                    continue
-                
-                eligible_staff.append(staff_name)
+            # Build list of eligible staff from today's available pool
+            # Rule 2: Not already assigned today; Rule 3: No "Clopening" (Night -> Morning)
+            excluded = staff_worked_night_yesterday if shift_type == "Morning" else ()
+            eligible_staff = [name for name in available_today if name not in daily_assignments and name not in excluded]
 
-            random.shuffle(eligible_staff)
-            
-            for staff_name in eligible_staff:
-                if num_assigned >= num_needed:
-                    break # Shift quota filled
-                    
+            # Draw only as many staff as the shift needs instead of shuffling the whole pool
+            for staff_name in rng.sample(eligible_staff, max(0, min(num_needed, len(eligible_staff)))):
                 # Assign the shift!
                 shift_times = shift_definitions[shift_type]
                 new_entry = {
@@ -549,9 +1019,11 @@ def generate_roster(request: RosterRequest):
                 new_entries.append(new_entry)
                 
                 # Update tracking maps
-                last_shift_map[staff_name] = (current_date, shift_type)
                 daily_assignments[staff_name] = shift_type
+                working_today.add(staff_name)
+                if shift_type == "Night": night_workers_today.add(staff_name)
                 consecutive_work_days[staff_name] = consecutive_work_days.get(staff_name, 0) + 1 # Increment work counter
+                if consecutive_work_days[staff_name] >= 6: must_rest.add(staff_name)
                 
                 num_assigned += 1
                 current_max_id += 1
@@ -561,12 +1033,16 @@ def generate_roster(request: RosterRequest):
 
 
         # After all shifts for the day, reset rest counters for those who didn't work
+        # (including leave and rest days, which end a run of consecutive work days)
         for staff_name in all_staff_names:
-            if staff_name not in daily_assignments:
+            if staff_name not in working_today:
                 consecutive_work_days[staff_name] = 0
+                must_rest.discard(staff_name)
+        night_workers_yesterday = night_workers_today
     
     # 7. Save and Return
-    save_json(ROSTER_FILE, roster_to_keep + new_entries)
+    set_next_id(ROSTER_FILE, current_max_id) # current_max_id is the first unused ID by now
+    save_jsonl(ROSTER_FILE, roster_to_keep + new_entries) # Bulk change: write a fresh snapshot
     return {
         "message": f"Successfully generated and added {len(new_entries)} new shifts (including leave/rest days).",
         "new_entries_added": new_entries
@@ -574,23 +1050,25 @@ def generate_roster(request: RosterRequest):
 
 # ===== PROTOCOL ENDPOINTS (MODIFIED FOR CHUNKING) =====
 @app.get("/protocols/")
-def list_protocols():
-    """Get all protocols (metadata only)"""
-    protocols = load_json(PROTOCOLS_FILE)
-    return [{k: v for k, v in p.items()} for p in protocols if isinstance(p,dict)]
+async def list_protocols(request: Request):
+    """Get all protocols (metadata only, conditional on If-None-Match)"""
+    return await conditional_json(request, PROTOCOLS_FILE, lambda: [p for p in load_json(PROTOCOLS_FILE) if isinstance(p, dict)])
 
 @app.get("/protocols/{protocol_id}/full")
 def get_full_protocol_chunks(protocol_id: int):
     """Get the full text content of a specific protocol as chunks"""
-    protocol_chunks = load_json(PROTOCOL_CHUNKS_FILE)
     protocol_meta = load_json(PROTOCOLS_FILE)
-    meta = next((p for p in protocol_meta if isinstance(p, dict) and p.get('id') == protocol_id), None)
-    if not meta: raise HTTPException(status_code=404, detail=f"Protocol metadata with ID {protocol_id} not found")
-    chunk_entry = next((pc for pc in protocol_chunks if isinstance(pc, dict) and pc.get('protocol_id') == protocol_id), None)
-    if not chunk_entry or not chunk_entry.get('chunks'):
+    i = protocol_id_index(protocol_meta).get(protocol_id)
+    if i is None: raise HTTPException(status_code=404, detail=f"Protocol metadata with ID {protocol_id} not found")
+    meta = protocol_meta[i]
+    header = {"id": protocol_id, "title": meta.get('title', 'N/A'), "category": meta.get('category', 'N/A'), "tags": meta.get('tags', '')}
+    # The chunk file already is {"chunks": [...]} JSON: splice its bytes in after the
+    # metadata fields instead of re-encoding (possibly megabytes of) text per request
+    chunk_json = protocol_chunks_json(protocol_id)
+    if chunk_json is None:
          print(f"Warning: Chunks not found for protocol ID {protocol_id}. Returning metadata preview.")
-         return {"id": protocol_id, "title": meta.get('title', 'N/A'), "category": meta.get('category', 'N/A'), "tags": meta.get('tags', ''), "chunks": [meta.get('content_preview', 'Full text missing.')]}
-    return {"id": protocol_id, "title": meta.get('title', 'N/A'), "category": meta.get('category', 'N/A'), "tags": meta.get('tags', ''), "chunks": chunk_entry.get('chunks', [])}
+         return {**header, "chunks": [meta.get('content_preview', 'Full text missing.')]}
+    return Response(json_dumps(header)[:-1] + b"," + chunk_json[1:], media_type="application/json")
 
 @app.post("/protocols/upload-pdf/", status_code=201)
 async def upload_protocol_pdf(
@@ -604,77 +1082,63 @@ async def upload_protocol_pdf(
         raise HTTPException(status_code=400, detail="Invalid file type. Only PDF.")
     pdf_content = await file.read()
     if not pdf_content: raise HTTPException(status_code=400, detail="PDF file empty.")
-    extracted_text = extract_text_from_pdf(pdf_content)
+    # PDF parsing and chunk embedding are CPU-bound: run them off the event loop
+    extracted_text = await asyncio.to_thread(extract_text_from_pdf, pdf_content)
     if not extracted_text: raise HTTPException(status_code=400, detail="Could not extract text from PDF.")
     
     text_chunks = chunk_text(extracted_text, chunk_size=1000, overlap=100)
     if not text_chunks: raise HTTPException(status_code=400, detail="Failed to chunk extracted text.")
     
-    protocols_meta = load_json(PROTOCOLS_FILE)
-    protocol_chunks_data = load_json(PROTOCOL_CHUNKS_FILE)
-    new_protocol_id = get_next_id(protocols_meta)
+    new_protocol_id = get_next_id(PROTOCOLS_FILE, load_json(PROTOCOLS_FILE))
     now_iso = datetime.now().isoformat()
     new_protocol_meta = {'id': new_protocol_id, 'title': title, 'category': category or 'General', 'tags': tags or '', 'content_preview': text_chunks[0][:100] + '...', 'filename': file.filename, 'created_at': now_iso, 'last_updated': now_iso, 'chunk_count': len(text_chunks)}
-    new_protocol_chunk_entry = {'protocol_id': new_protocol_id, 'chunks': text_chunks}
-    protocols_meta.append(new_protocol_meta)
-    protocol_chunks_data.append(new_protocol_chunk_entry)
-    save_json(PROTOCOLS_FILE, protocols_meta)
-    save_json(PROTOCOL_CHUNKS_FILE, protocol_chunks_data)
+    await asyncio.to_thread(save_protocol_chunks, new_protocol_id, text_chunks) # Chunks first: listed protocols always have their text
+    protocols_meta = load_json(PROTOCOLS_FILE) # (Re)loaded after the await so concurrent writes aren't lost
+    save_json(PROTOCOLS_FILE, protocols_meta + [new_protocol_meta])
     return new_protocol_meta
 
 @app.post("/protocols/", status_code=201)
 def add_protocol(protocol: Protocol):
     """Add protocol manually (text input) - NOW WITH CHUNKING"""
     protocols_meta = load_json(PROTOCOLS_FILE)
-    protocol_chunks_data = load_json(PROTOCOL_CHUNKS_FILE)
-    new_protocol_dict = protocol.dict()
-    new_protocol_id = get_next_id(protocols_meta)
+    new_protocol_dict = protocol.model_dump(mode='json')
+    new_protocol_id = get_next_id(PROTOCOLS_FILE, protocols_meta)
     now_iso = datetime.now().isoformat()
     full_content = new_protocol_dict['content']
     text_chunks = chunk_text(full_content, chunk_size=1000, overlap=100)
     if not text_chunks: text_chunks = [full_content] if full_content else []
     content_preview = text_chunks[0][:100] + ('...' if len(text_chunks[0]) > 100 else '') if text_chunks else ''
     new_protocol_meta = {'id': new_protocol_id, 'title': new_protocol_dict['title'], 'category': new_protocol_dict.get('category') or 'General', 'tags': new_protocol_dict.get('tags') or '', 'content_preview': content_preview, 'filename': None, 'created_at': now_iso, 'last_updated': now_iso, 'chunk_count': len(text_chunks)}
-    new_protocol_chunk_entry = {'protocol_id': new_protocol_id, 'chunks': text_chunks}
-    protocols_meta.append(new_protocol_meta)
-    protocol_chunks_data.append(new_protocol_chunk_entry)
-    save_json(PROTOCOLS_FILE, protocols_meta)
-    save_json(PROTOCOL_CHUNKS_FILE, protocol_chunks_data)
+    save_protocol_chunks(new_protocol_id, text_chunks) # Chunks first: listed protocols always have their text
+    save_json(PROTOCOLS_FILE, protocols_meta + [new_protocol_meta])
     return new_protocol_meta
 
 @app.delete("/protocols/{protocol_id}", status_code=200)
 def delete_protocol(protocol_id: int):
     """Delete protocol metadata AND its chunks"""
     protocols = load_json(PROTOCOLS_FILE)
-    protocol_chunks = load_json(PROTOCOL_CHUNKS_FILE)
-    initial_proto_count = len(protocols)
-    protocols = [p for p in protocols if not (isinstance(p, dict) and p.get('id') == protocol_id)]
-    protocol_chunks = [pc for pc in protocol_chunks if not (isinstance(pc, dict) and pc.get('protocol_id') == protocol_id)]
-    if len(protocols) == initial_proto_count: raise HTTPException(status_code=404, detail=f"Protocol with ID {protocol_id} not found")
-    save_json(PROTOCOLS_FILE, protocols)
-    save_json(PROTOCOL_CHUNKS_FILE, protocol_chunks)
+    i = protocol_id_index(protocols).get(protocol_id)
+    if i is None: raise HTTPException(status_code=404, detail=f"Protocol with ID {protocol_id} not found")
+    save_json(PROTOCOLS_FILE, protocols[:i] + protocols[i + 1:]) # New list: the cached one stays intact
+    delete_protocol_chunks(protocol_id)
     return {"message": "Protocol and associated text chunks deleted successfully"}
 
-# ===== ASK PROTOCOL QUESTION (MODIFIED FOR CHUNKING & BETTER SEARCH) =====
-@app.post("/protocols/ask/")
-def ask_protocol_question(query: ProtocolQuery):
-    """Ask a question about protocols using Groq AI, searching chunks"""
-    if not groq_client:
-         raise HTTPException(status_code=503, detail="Groq client not initialized.")
-
-    protocols_meta = load_json(PROTOCOLS_FILE)
-    protocol_chunks_data = load_json(PROTOCOL_CHUNKS_FILE)
-    print(f"DEBUG: Ask - Loaded {len(protocols_meta)} meta, {len(protocol_chunks_data)} chunk entries.")
-
-    if not protocols_meta:
-        return {"answer": "No protocols available.", "protocols_found": 0}
-
-    query_lower = query.question.lower()
-    query_keywords = set(re.findall(r'\b\w+\b', query_lower)) # Get individual keywords
-    relevant_chunks = []
+def keyword_protocol_chunks(question, protocols_meta):
+    """(top ASK_MAX_CHUNKS chunks best first, number of chunks that matched) scored by keyword / metadata / direct-phrase matches via the inverted index"""
+    query_lower = question.lower()
+    keywords = query_keywords(query_lower) # Get individual keywords
+    if not keywords: return [], 0 # Only stopwords: nothing worth scoring
+    top_heap = [] # Min-heap of (score, -seq, chunk_info); -seq keeps the earliest chunk on score ties
+    found = 0
     protocol_ids_searched = set()
-    chunk_map: Dict[int, List[str]] = {pt['protocol_id']: pt['chunks'] for pt in protocol_chunks_data if isinstance(pt, dict) and 'protocol_id' in pt and 'chunks' in pt}
-    print(f"DEBUG: Ask - Created chunk map with {len(chunk_map)} entries.")
+
+    # Keyword hits per chunk from the inverted index: {protocol_id: {chunk_index: matched keywords}}
+    index = cached_view('protocol_index', PROTOCOLS_FILE, protocols_meta, build_protocol_index)
+    keyword_hits: Dict[int, Dict[int, int]] = {}
+    for keyword in keywords:
+        for protocol_id, i in index.get(keyword, ()):
+            chunk_hits = keyword_hits.setdefault(protocol_id, {})
+            chunk_hits[i] = chunk_hits.get(i, 0) + 1
 
     for meta in protocols_meta:
          if not isinstance(meta, dict): continue
@@ -683,17 +1147,21 @@ def ask_protocol_question(query: ProtocolQuery):
          protocol_ids_searched.add(protocol_id)
          
          meta_text_lower = f"{meta.get('title', '')} {meta.get('category', '')} {meta.get('tags', '')}".lower()
-         meta_match = query_lower in meta_text_lower or any(kw in meta_text_lower for kw in query_keywords)
+         meta_match = query_lower in meta_text_lower or any(kw in meta_text_lower for kw in keywords)
+         chunk_hits = keyword_hits.get(protocol_id, {})
+         if not meta_match and not chunk_hits: continue # Nothing in this protocol can score
          
-         chunks = chunk_map.get(protocol_id, [])
+         chunks = load_protocol_chunks(protocol_id)
          if not chunks:
-             print(f"DEBUG: Ask - Protocol {protocol_id} metadata found but no chunks found in map.")
+             print(f"DEBUG: Ask - Protocol {protocol_id} metadata found but no chunks file.")
              continue
 
-         for i, chunk in enumerate(chunks):
-            chunk_lower = chunk.lower()
-            score = sum(1 for keyword in query_keywords if keyword in chunk_lower)
-            content_direct_match = query_lower in chunk_lower
+         # A metadata match makes every chunk relevant; otherwise only chunks with keyword hits
+         candidate_indices = range(len(chunks)) if meta_match else sorted(i for i in chunk_hits if i < len(chunks))
+         for i in candidate_indices:
+            chunk = chunks[i]
+            score = chunk_hits.get(i, 0)
+            content_direct_match = query_lower in chunk.lower()
             
             # Boost score significantly for title/tag match
             if meta_match:
@@ -702,15 +1170,42 @@ def ask_protocol_question(query: ProtocolQuery):
                 score += 5
                 
             if score > 1: # Require at least 2 keyword matches or a direct/meta match
-                relevant_chunks.append({'protocol_id': protocol_id, 'title': meta.get('title', 'N/A'), 'category': meta.get('category', 'N/A'), 'chunk_index': i, 'content': chunk, 'score': score})
+                found += 1
+                if len(top_heap) == ASK_MAX_CHUNKS and score <= top_heap[0][0]: continue # Can't displace anything
+                entry = (score, -found, {'protocol_id': protocol_id, 'title': meta.get('title', 'N/A'), 'category': meta.get('category', 'N/A'), 'chunk_index': i, 'content': chunk, 'score': score})
+                if len(top_heap) < ASK_MAX_CHUNKS: heapq.heappush(top_heap, entry)
+                else: heapq.heapreplace(top_heap, entry)
+
+
+    print(f"DEBUG: Ask - Found {found} potentially relevant chunks across {len(protocol_ids_searched)} protocols.")
 
+    return [info for _, _, info in sorted(top_heap, reverse=True)], found
+
+# ===== ASK PROTOCOL QUESTION (MODIFIED FOR CHUNKING & BETTER SEARCH) =====
+@app.post("/protocols/ask/")
+def ask_protocol_question(query: ProtocolQuery):
+    """Ask a question about protocols using Groq AI, searching chunks"""
+    if not groq_client:
+         raise HTTPException(status_code=503, detail="Groq client not initialized.")
+    if not query_keywords(query.question):
+        return {"answer": "Please provide a more specific question.", "protocols_found": 0}
 
-    print(f"DEBUG: Ask - Found {len(relevant_chunks)} potentially relevant chunks across {len(protocol_ids_searched)} protocols.")
+    protocols_meta = load_json(PROTOCOLS_FILE)
+    print(f"DEBUG: Ask - Loaded {len(protocols_meta)} meta entries.")
+
+    if not protocols_meta:
+        return {"answer": "No protocols available.", "protocols_found": 0}
+
+    relevant_chunks = semantic_protocol_chunks(query.question, protocols_meta)
+    chunks_found = len(relevant_chunks)
+    print(f"DEBUG: Ask - Vector search returned {chunks_found} chunks.")
+    if not relevant_chunks: # No vector store (or nothing found): keyword index
+        relevant_chunks, chunks_found = keyword_protocol_chunks(query.question, protocols_meta)
 
     if not relevant_chunks:
         return {"answer": "No relevant text segments found matching your question within the available protocols.", "protocols_found": 0}
 
-    relevant_chunks.sort(key=lambda x: x['score'], reverse=True)
+    # Both searches return their chunks best first
     MAX_CONTEXT_CHARS = 10000
     current_chars = 0
     context_parts = []
@@ -728,8 +1223,8 @@ def ask_protocol_question(query: ProtocolQuery):
             if protocol_id not in protocol_ids_in_context:
                  protocols_used_in_context.append({"id": protocol_id, "title": chunk_info['title'], "category": chunk_info['category']})
                  protocol_ids_in_context.add(protocol_id)
-            if len(context_parts) >= 5: # Limit to top 5 chunks
-                print(f"DEBUG: Ask - Reached chunk limit (5).")
+            if len(context_parts) >= ASK_MAX_CHUNKS: # Limit to top chunks
+                print(f"DEBUG: Ask - Reached chunk limit ({ASK_MAX_CHUNKS}).")
                 break
         else:
              print(f"DEBUG: Ask - Reached context char limit ({current_chars}). Using {len(context_parts)} chunks.")
@@ -739,7 +1234,7 @@ def ask_protocol_question(query: ProtocolQuery):
     print(f"DEBUG: Ask - Final context length: {len(context)} characters, using {len(protocols_used_in_context)} unique protocols.")
 
     if not context:
-         return {"answer": "Could not build sufficient context from relevant chunks.", "protocols_found": len(relevant_chunks)}
+         return {"answer": "Could not build sufficient context from relevant chunks.", "protocols_found": chunks_found}
 
     prompt = f"""You are a precise medical protocol assistant. Answer the user's question based *ONLY* on the following text excerpts from medical protocols. If the answer isn't in these excerpts, state that clearly.
 
@@ -758,51 +1253,67 @@ Answer based ONLY on the excerpts provided above:"""
             ],
             model="llama-3.3-70b-versatile",
             temperature=0.1,
-            max_tokens=500
+            max_tokens=500,
+            stream=query.stream
         )
+        if query.stream:
+            # Headers go out before the first token, so the JSON envelope fields ride along there
+            # Content-Encoding makes GZipMiddleware pass the stream through: gzip would buffer the tokens until the end
+            headers = {"X-Protocols-Found": str(chunks_found), "X-Protocols-Used": json.dumps(protocols_used_in_context), "Content-Encoding": "identity"}
+            return StreamingResponse(stream_groq_answer(chat_completion), media_type="text/plain", headers=headers)
         answer = chat_completion.choices[0].message.content
         return {
             "answer": answer,
-            "protocols_found": len(relevant_chunks),
+            "protocols_found": chunks_found,
             "protocols_used_in_context": protocols_used_in_context
         }
     except Exception as e:
         print(f"ERROR: Groq API call failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error querying Groq AI: {str(e)}")
 
+def stream_groq_answer(chat_stream):
+    """Yields answer tokens from a streaming Groq completion (iterated in Starlette's threadpool)"""
+    try:
+        for chunk in chat_stream:
+            content = chunk.choices[0].delta.content if chunk.choices else None
+            if content: yield content
+    except Exception as e:
+        print(f"ERROR: Groq stream failed: {str(e)}")
+        yield "\n\n[Error: the AI response was interrupted.]"
+
 # ===== ANALYTICS ENDPOINTS =====
 @app.get("/analytics/dashboard/")
 def get_dashboard_stats():
-    inventory = load_json(INVENTORY_FILE)
-    bills = load_json(BILLING_FILE)
+    inventory = load_inventory()
+    bills = load_billing()
     inventory = inventory if isinstance(inventory, list) else []
     bills = bills if isinstance(bills, list) else []
     total_items = len(inventory)
-    low_stock_items_list = get_low_stock()
-    expiring_items_list = get_expiring_inventory(30)
-    low_stock_count = len(low_stock_items_list)
-    expiring_count = len(expiring_items_list)
-    out_of_stock_count = len([i for i in inventory if isinstance(i, dict) and i.get('quantity', 0) <= 0])
-    today_date = date.today()
-    thirty_days_ago = today_date - timedelta(days=30)
-    recent_bills = []
+    today_ord = date.today().toordinal()
+    # One pass over inventory for all three counts (same rules as low_stock_items / expiring_items(30))
+    low_stock_count = expiring_count = out_of_stock_count = 0
+    for i, expiry_ord in zip(inventory, inventory_expiry_ords(inventory)):
+        if not isinstance(i, dict): continue
+        quantity = i.get('quantity', 0)
+        if quantity <= i.get('reorder_level', 10): low_stock_count += 1
+        if quantity <= 0: out_of_stock_count += 1
+        if expiry_ord is not None and today_ord < expiry_ord <= today_ord + 30: expiring_count += 1
+    thirty_days_ago_ord = today_ord - 30
+    total_bills_30d = 0
     total_revenue_30d = 0.0
     pending_bills_count = 0
-    for b in bills:
-        if not isinstance(b, dict) or 'date' not in b: continue
-        try:
-             bill_date = date.fromisoformat(b['date'].split('T')[0])
-             if bill_date >= thirty_days_ago:
-                 recent_bills.append(b)
-                 if b.get('payment_status') != 'cancelled': total_revenue_30d += b.get('total_amount', 0.0)
-                 if b.get('payment_status') == 'pending': pending_bills_count += 1
-        except (ValueError, TypeError): pass
-    return {"inventory": {"total_items": total_items, "low_stock": low_stock_count, "expiring_soon": expiring_count, "out_of_stock": out_of_stock_count}, "billing": {"total_bills_30d": len(recent_bills), "total_revenue_30d": round(total_revenue_30d, 2), "pending_bills": pending_bills_count}}
+    for b, date_ord in zip(bills, billing_date_ords(bills)):
+        # Bills with a missing/invalid date have a None ordinal and are skipped
+        if not isinstance(b, dict) or date_ord is None or date_ord < thirty_days_ago_ord: continue
+        total_bills_30d += 1
+        if b.get('payment_status') != 'cancelled': total_revenue_30d += b.get('total_amount', 0.0)
+        if b.get('payment_status') == 'pending': pending_bills_count += 1
+    return {"inventory": {"total_items": total_items, "low_stock": low_stock_count, "expiring_soon": expiring_count, "out_of_stock": out_of_stock_count}, "billing": {"total_bills_30d": total_bills_30d, "total_revenue_30d": round(total_revenue_30d, 2), "pending_bills": pending_bills_count}}
 
 @app.get("/analytics/inventory-alerts/")
 def get_inventory_alerts():
-    expiring_list = get_expiring_inventory(30)
-    low_stock_list = get_low_stock()
+    expiring_list = expiring_items(30)
+    low_stock_list = low_stock_items()
     formatted_expiring = []
     for i in expiring_list:
          if isinstance(i, dict): formatted_expiring.append({"id": i.get('id', 'N/A'), "name": i.get('item_name', 'Unknown'), "expiry_date": i.get('expiry_date', 'N/A'), "days_until_expiry": i.get('days_until_expiry', 'N/A'), "quantity": i.get('quantity', 'N/A')})
@@ -811,15 +1322,39 @@ def get_inventory_alerts():
          if isinstance(i, dict): formatted_low_stock.append({"id": i.get('id', 'N/A'), "name": i.get('item_name', 'Unknown'), "quantity": i.get('quantity', 'N/A'), "reorder_level": i.get('reorder_level', 'N/A')})
     return {"expiring_soon": formatted_expiring, "low_stock": formatted_low_stock}
 
+# ===== PAGE BUNDLE ENDPOINTS =====
+# One round-trip per admin page instead of several small GETs
+def dashboard_page():
+    return {"stats": get_dashboard_stats(), "alerts": get_inventory_alerts(), "recent_bills": billing_records()}
+
+@app.get("/page/dashboard")
+async def get_dashboard_page():
+    return FastJSONResponse(await run_cached(dashboard_page, INVENTORY_FILE, BILLING_FILE))
+
+def inventory_page(days):
+    items = inventory_items()
+    categories = sorted({i['category'] for i in items if isinstance(i, dict) and i.get('category')})
+    return {"items": items, "categories": categories, "low_stock": low_stock_items(), "expiring": expiring_items(days)}
+
+@app.get("/page/inventory")
+async def get_inventory_page(days: int = Query(30, ge=1, le=365)):
+    return FastJSONResponse(await run_cached(lambda: inventory_page(days), INVENTORY_FILE))
+
 
 # --- Main Execution ---
 if __name__ == "__main__":
     import uvicorn
     # Create necessary JSON files if they don't exist
-    for filename in [INVENTORY_FILE, BILLING_FILE, ROSTER_FILE, PROTOCOLS_FILE, PROTOCOL_CHUNKS_FILE]: # Use new chunks filename
+    for filename in [INVENTORY_FILE, PROTOCOLS_FILE]:
         if not os.path.exists(filename):
             save_json(filename, [])
             print(f"Created empty file: {filename}")
+    ensure_protocol_chunks_dir()
+    for filename in [BILLING_FILE, ROSTER_FILE]:
+        load_jsonl(filename) # Migrates the legacy .json file if there is one
+        if not os.path.exists(filename):
+            save_jsonl(filename, [])
+            print(f"Created empty file: {filename}")
     port_to_run = 8002
     print(f"Starting server on http://0.0.0.0:{port_to_run}")
     uvicorn.run("main:app", host="0.0.0.0", port=port_to_run, reload=True) # Use string for app object
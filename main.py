@@ -1,5 +1,7 @@
 import uvicorn
 import asyncio
+import functools
+import os
 import re
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -11,11 +13,16 @@ from operator import itemgetter
 from langchain_ollama import ChatOllama
 from langchain_chroma import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 
+try:
+    import ahocorasick # Optional: one-pass trigger phrase matching
+except ImportError:
+    ahocorasick = None
+
 # --- 1. Define Data Structures (Unchanged) ---
 class ChatMessage(BaseModel):
     role: str
@@ -30,11 +37,34 @@ reasoning_llm = ChatOllama(
     temperature=0
 )
 
-# --- 3. Setup RAG (Knowledge Lookup) (Unchanged) ---
-embeddings = HuggingFaceEmbeddings(
-    model_name="all-MiniLM-L6-v2",
-    model_kwargs={'device': 'cpu'}
-)
+# --- 3. Setup RAG (Knowledge Lookup) ---
+# Query embeddings must come from the same model build_vectordb.py indexed with
+# (INT8 ONNX by default; EMBEDDINGS_BACKEND=torch for the FP32 PyTorch model).
+# The build records the backend it ended up using in BACKEND_FILE.
+EMBEDDINGS_BACKEND = os.environ.get("EMBEDDINGS_BACKEND", "onnx")
+ONNX_MODEL_FILE = os.environ.get("ONNX_MODEL_FILE", "onnx/model_qint8_avx2.onnx")
+BACKEND_FILE = os.path.join("chroma_db", "embeddings_backend.txt")
+
+def load_embeddings():
+    """MiniLM embeddings matching the index backend (ONNX Runtime INT8 when available, else PyTorch)"""
+    backend_key = f"onnx/{ONNX_MODEL_FILE}" if EMBEDDINGS_BACKEND == "onnx" else "torch"
+    if os.path.exists(BACKEND_FILE):
+        with open(BACKEND_FILE) as f:
+            backend_key = f.read().strip() or backend_key
+    if backend_key.startswith("onnx/"):
+        try:
+            return HuggingFaceEmbeddings(
+                model_name="all-MiniLM-L6-v2",
+                model_kwargs={'device': 'cpu', "backend": "onnx", "model_kwargs": {"file_name": backend_key[len("onnx/"):]}}
+            )
+        except Exception as e:
+            print(f"WARNING: Could not load ONNX embeddings ({e}). Falling back to PyTorch; rebuild the vector DB to match.")
+    return HuggingFaceEmbeddings(
+        model_name="all-MiniLM-L6-v2",
+        model_kwargs={'device': 'cpu'}
+    )
+
+embeddings = load_embeddings()
 vect_db = Chroma(
     persist_directory="./chroma_db", 
     embedding_function=embeddings
@@ -49,6 +79,45 @@ print("NOTE: Using BioMistral for all tasks. Report generation may take 5-10 min
 # --- AGENT 2: THE SUMMARIZER ---
 
 # --- STEP 1: Python function to extract facts (THIS IS UPDATED) ---
+# Typo fixes for the age/gender answer ("femal" -> "female", "mal" -> "male")
+FEMAL_RE = re.compile(r'\bfemal\b', re.IGNORECASE)
+MAL_RE = re.compile(r'\bmal\b', re.IGNORECASE)
+
+# Question substring -> fact field, checked in order (first match wins)
+FACT_TRIGGERS = (
+    ("please tell me your name", "name"),
+    ("age and gender", "age_gender"),
+    ("main symptoms", "chief_complaint"),
+    ("past medical history", "history"),
+    ("taking any medications", "medications"),
+    ("any allergies", "allergies"),
+    # Symptom detail questions
+    ("describe the pain", "symptom_details"),
+    ("radiate", "symptom_details"),
+    ("severe is the pain", "symptom_details"),
+    ("shortness of breath", "symptom_details"),
+    ("when the pain started", "symptom_details"),
+    ("located", "symptom_details"),
+    ("throbbing", "symptom_details"),
+    ("sensitive to light", "symptom_details"),
+)
+
+# All trigger phrases in one automaton; each phrase maps to its FACT_TRIGGERS position
+FACT_TRIGGER_AUTOMATON = None
+if ahocorasick is not None:
+    FACT_TRIGGER_AUTOMATON = ahocorasick.Automaton()
+    for priority, (phrase, _) in enumerate(FACT_TRIGGERS):
+        FACT_TRIGGER_AUTOMATON.add_word(phrase, priority)
+    FACT_TRIGGER_AUTOMATON.make_automaton()
+
+def match_fact_field(question: str):
+    """Fact field of the first FACT_TRIGGERS phrase found in the (lowercased) question, or None."""
+    if FACT_TRIGGER_AUTOMATON is None:
+        return next((f for phrase, f in FACT_TRIGGERS if phrase in question), None)
+    # Single scan for every phrase; the lowest position keeps the first-match-wins order
+    priority = min((p for _, p in FACT_TRIGGER_AUTOMATON.iter(question)), default=None)
+    return None if priority is None else FACT_TRIGGERS[priority][1]
+
 def extract_facts_from_transcript(messages: List[ChatMessage]) -> dict:
     facts = {
         "name": "N/A",
@@ -60,31 +129,23 @@ def extract_facts_from_transcript(messages: List[ChatMessage]) -> dict:
         "allergies": "N/A"
     }
     
-    for i, msg in enumerate(messages):
-        if msg.role == 'assistant' and (i + 1 < len(messages)) and messages[i+1].role == 'user':
+    for msg, reply in zip(messages, messages[1:]):
+        if msg.role == 'assistant' and reply.role == 'user':
             question = msg.content.lower()
-            answer = messages[i+1].content
+            answer = reply.content
+            field = match_fact_field(question)
             
-            if "please tell me your name" in question:
-                facts["name"] = answer
-            elif "age and gender" in question:
+            if field == "age_gender":
                 # --- THIS IS THE FIX for "femal" ---
                 answer_clean = answer.lower()
-                answer_clean = re.sub(r'\bfemal\b', 'female', answer_clean, flags=re.IGNORECASE)
-                answer_clean = re.sub(r'\bmal\b', 'male', answer_clean, flags=re.IGNORECASE)
+                answer_clean = FEMAL_RE.sub('female', answer_clean)
+                answer_clean = MAL_RE.sub('male', answer_clean)
                 facts["age_gender"] = answer_clean.title()
                 # --- END FIX ---
-            elif "main symptoms" in question:
-                facts["chief_complaint"] = answer
-            elif "past medical history" in question:
-                facts["history"] = answer
-            elif "taking any medications" in question:
-                facts["medications"] = answer
-            elif "any allergies" in question:
-                facts["allergies"] = answer
-            # Capture symptom details
-            elif "describe the pain" in question or "radiate" in question or "severe is the pain" in question or "shortness of breath" in question or "when the pain started" in question or "located" in question or "throbbing" in question or "sensitive to light" in question:
+            elif field == "symptom_details":
                 facts["symptom_details"].append(f"Q: {msg.content}\nA: {answer}")
+            elif field is not None:
+                facts[field] = answer
 
     return facts
 
@@ -105,11 +166,9 @@ Write the summary now.
 """
 )
 
-# The new summarizer chain (Unchanged)
+# The summarizer chain takes the facts dict (extracted once in generate_report)
 summarizer_chain = (
-    RunnablePassthrough()
-    | (lambda msgs: extract_facts_from_transcript(msgs))
-    | summarizer_prompt 
+    summarizer_prompt 
     | reasoning_llm 
     | StrOutputParser()
 )
@@ -119,6 +178,21 @@ summarizer_chain = (
 def format_docs(docs):
     return "\n\n".join(doc.page_content for doc in docs)
 
+def normalize_query(text: str) -> str:
+    # MiniLM lowercases and ignores runs of whitespace, so this keeps the embedding the same
+    return " ".join(text.lower().split())
+
+@functools.lru_cache(maxsize=256)
+def retrieve_context(normalized_transcript: str) -> str:
+    """Embedding + Chroma search for a transcript; repeated transcripts are served from the cache."""
+    return format_docs(retriever.invoke(normalized_transcript))
+
+async def aretrieve_context(transcript: str) -> str:
+    # The embedding and vector search are CPU-bound: run them off the event loop
+    return await asyncio.to_thread(retrieve_context, normalize_query(transcript))
+
+context_retriever = RunnableLambda(lambda t: retrieve_context(normalize_query(t)), afunc=aretrieve_context)
+
 class DifferentialDiagnosis(BaseModel):
     condition: str = Field(description="The suspected medical condition")
     justification_present: List[str] = Field(description="List of patient's symptoms that support this diagnosis")
@@ -155,15 +229,14 @@ system_template = """
 report_prompt = ChatPromptTemplate.from_messages([
     ("system", system_template),
     ("human", "Full interview transcript:\n\n{transcript}")
-])
+]).partial(format_instructions=format_instructions) # Static, so bound once here
 
 reasoning_llm_json = reasoning_llm.bind(format="json")
 
 report_generation_chain = (
     {
-        "context": itemgetter("transcript") | retriever | format_docs,
-        "transcript": itemgetter("transcript"),
-        "format_instructions": lambda x: format_instructions
+        "context": itemgetter("transcript") | context_retriever,
+        "transcript": itemgetter("transcript")
     }
     | report_prompt
     | reasoning_llm_json
@@ -194,21 +267,124 @@ def get_symptom_category(complaint: str) -> str:
     
     return "other" # Default category
 
+# (role, content) tuple of a history -> (name, chief_complaint_category)
+# The frontend re-sends the whole history each turn, so the previous turn's
+# entry (history minus the newest Q/A pair) lets us parse only the new pairs.
+INTERVIEW_DATA_CACHE: Dict[tuple, tuple] = {}
+INTERVIEW_DATA_CACHE_SIZE = 1024
+
 def get_user_data_for_interview(history: List[ChatMessage]) -> dict:
     """Parses the history to extract key patient data FOR THE INTERVIEW."""
-    data = {"name": None, "chief_complaint_category": "other"}
-    
-    for i, msg in enumerate(history):
-        if msg.role == 'assistant' and (i + 1 < len(history)) and history[i+1].role == 'user':
-            question = msg.content.lower()
-            answer = history[i+1].content
-            
-            if "please tell me your name" in question and data["name"] is None:
-                data["name"] = answer.strip()
-            elif "main symptoms" in question and data["chief_complaint_category"] == "other":
-                data["chief_complaint_category"] = get_symptom_category(answer)
+    key = tuple((msg.role, msg.content) for msg in history)
+    cached = INTERVIEW_DATA_CACHE.get(key)
+    if cached is None:
+        prev = INTERVIEW_DATA_CACHE.get(key[:-2]) if len(key) >= 4 else None
+        name, category = prev or (None, "other")
+        start = len(key) - 3 if prev else 0 # First pair not covered by the previous turn
+        
+        for (role, content), (reply_role, answer) in zip(key[start:], key[start + 1:]):
+            if role == 'assistant' and reply_role == 'user':
+                question = content.lower()
+                
+                if "please tell me your name" in question and name is None:
+                    name = answer.strip()
+                elif "main symptoms" in question and category == "other":
+                    category = get_symptom_category(answer)
+        
+        cached = (name, category)
+        if len(INTERVIEW_DATA_CACHE) >= INTERVIEW_DATA_CACHE_SIZE:
+            del INTERVIEW_DATA_CACHE[next(iter(INTERVIEW_DATA_CACHE))] # Drop the oldest entry
+        INTERVIEW_DATA_CACHE[key] = cached
                 
-    return data
+    return {"name": cached[0], "chief_complaint_category": cached[1]}
+
+# --- Interview state table ---
+# Every assistant reply is name_str + one of these questions, so the previous
+# question (minus that prefix) maps straight to its state with one dict lookup.
+INTERVIEW_QUESTIONS = {
+    "ask_name": "Great! Please tell me your name.",
+    "ask_age_gender": "Now, please tell me your age and gender.",
+    "ask_symptoms": "Now, please tell me about your main symptoms.",
+    # Chest pain
+    "chest_describe": "Can you describe the pain? (e.g., Is it sharp, dull, crushing, or a pressure?)",
+    "chest_radiate": "Does the pain radiate to your arm, jaw, or back?",
+    "pain_severity": "On a scale of 1-10, how severe is the pain?", # Shared by chest and ankle pain
+    "chest_associated": "Do you have any shortness of breath, nausea, or sweating with it?",
+    "chest_onset": "What were you doing when the pain started?",
+    # First questions without a follow-up block yet
+    "headache_location": "Where exactly is the headache located? (e.g., one side, all over, behind the eyes)",
+    "cough_type": "Is the cough dry, or are you coughing up phlegm?",
+    "abdominal_location": "Where exactly is the pain? (e.g., upper, lower, left, right)",
+    "sob_activity": "Does this happen when you are resting, or only with activity?",
+    # Ankle pain
+    "ankle_injury": "Did this pain start with an injury, like twisting it?",
+    "ankle_weight": "Are you able to put weight on it?",
+    "ankle_swelling": "Is there any swelling or bruising?",
+    # Back pain
+    "back_location": "Where exactly is the back pain? (e.g., upper, lower, one side)",
+    "back_describe": "Can you describe the pain? (e.g., sharp, dull ache, burning)",
+    "back_radiate": "Does the pain shoot down your leg?",
+    "back_numbness": "Is there any numbness or tingling?",
+    "back_modifiers": "What makes it better or worse (e.g., sitting, standing, lying down)?",
+    # Default/other
+    "other_onset": "When did this symptom start?",
+    "other_severity": "On a scale of 1-10, how severe is it?",
+    "other_describe": "Can you describe the symptom in more detail?",
+    # Medical history
+    "history_general": "To get a complete picture, do you have any past medical history, like diabetes or high blood pressure?",
+    "history_ankle": "To get a complete picture, do you have any past medical history, like arthritis or gout?",
+    "history_back": "To get a complete picture, do you have any past medical history, like a previous back injury or arthritis?",
+    "medications": "Are you currently taking any medications for that or anything else?",
+    "allergies": "And do you have any allergies to medications?",
+    "family_history": "Finally, have any of your family members (like parents or siblings) had similar issues?",
+}
+INTERVIEW_DONE = "Thank you. I have all the information I need."
+INTERVIEW_FALLBACK = "Thank you. Please press I'm done to generate a report."
+
+# First deep-dive question per symptom category
+FIRST_SYMPTOM_STATE = {
+    "chest_pain": "chest_describe", "headache": "headache_location", "cough": "cough_type",
+    "abdominal_pain": "abdominal_location", "sob": "sob_activity", "ankle_pain": "ankle_injury",
+    "back_pain": "back_location", "other": "other_onset",
+}
+
+# state -> next state, or {symptom category: next state} for questions shared between categories
+INTERVIEW_TRANSITIONS = {
+    "chest_describe": "chest_radiate",
+    "chest_radiate": "pain_severity",
+    "pain_severity": {"chest_pain": "chest_associated", "ankle_pain": "history_ankle"},
+    "chest_associated": "chest_onset",
+    "chest_onset": "history_general",
+    "ankle_injury": "ankle_weight",
+    "ankle_weight": "ankle_swelling",
+    "ankle_swelling": "pain_severity",
+    "back_location": "back_describe",
+    "back_describe": "back_radiate",
+    "back_radiate": "back_numbness",
+    "back_numbness": "back_modifiers",
+    "back_modifiers": "history_back",
+    "other_onset": "other_severity",
+    "other_severity": "other_describe",
+    "other_describe": "history_general",
+    "history_general": "medications",
+    "history_ankle": "medications",
+    "history_back": "medications",
+    "medications": "allergies",
+    "allergies": "family_history",
+}
+
+STATE_BY_QUESTION = {question.lower(): state for state, question in INTERVIEW_QUESTIONS.items()}
+THANK_YOU_PREFIX = re.compile(r"thank you(?:, .*?)?\. ")
+
+def get_interview_state(last_ai_question: str, name_str: str):
+    """Maps the previous assistant message (lowercased) back to its state, or None."""
+    question, name_prefix = last_ai_question.strip(), name_str.lower()
+    if question.startswith(name_prefix):
+        question = question[len(name_prefix):]
+    else:
+        prefix = THANK_YOU_PREFIX.match(question)
+        if prefix: question = question[prefix.end():]
+    return STATE_BY_QUESTION.get(question)
 
 def determine_next_question(history: List[ChatMessage]) -> str:
     """
@@ -222,108 +398,37 @@ def determine_next_question(history: List[ChatMessage]) -> str:
             last_ai_question = msg.content.lower()
             break
             
+    # State 1: Start (greeting comes from the frontend)
+    if "to start, please type" in last_ai_question:
+        return INTERVIEW_QUESTIONS["ask_name"]
+
     user_data = get_user_data_for_interview(history)
     name = user_data.get("name")
     name_str = f"Thank you, {name}. " if name else "Thank you. "
+    state = get_interview_state(last_ai_question, name_str)
 
-    # --- State Machine ---
-    
-    # State 1: Start
-    if "to start, please type" in last_ai_question:
-        return "Great! Please tell me your name."
-        
     # State 2: Got name, ask for age/gender
-    if "please tell me your name" in last_ai_question:
+    if state == "ask_name":
         name_from_last_message = history[-1].content.strip()
-        return f"Thank you, {name_from_last_message}. Now, please tell me your age and gender."
-        
+        return f"Thank you, {name_from_last_message}. {INTERVIEW_QUESTIONS['ask_age_gender']}"
+
     # State 3: Got age/gender, ask for symptoms
-    if "age and gender" in last_ai_question:
-        return f"{name_str}Now, please tell me about your main symptoms."
-        
+    if state == "ask_age_gender":
+        next_state = "ask_symptoms"
     # State 4: Got symptoms, start deep dive
-    if "main symptoms" in last_ai_question:
-        symptom_category = get_symptom_category(history[-1].content)
-        
-        if symptom_category == "chest_pain":
-            return f"{name_str}Can you describe the pain? (e.g., Is it sharp, dull, crushing, or a pressure?)"
-        if symptom_category == "headache":
-            return f"{name_str}Where exactly is the headache located? (e.g., one side, all over, behind the eyes)"
-        if symptom_category == "cough":
-            return f"{name_str}Is the cough dry, or are you coughing up phlegm?"
-        if symptom_category == "abdominal_pain":
-             return f"{name_str}Where exactly is the pain? (e.g., upper, lower, left, right)"
-        if symptom_category == "sob":
-             return f"{name_str}Does this happen when you are resting, or only with activity?"
-        if symptom_category == "ankle_pain":
-            return f"{name_str}Did this pain start with an injury, like twisting it?"
-        if symptom_category == "back_pain":
-            return f"{name_str}Where exactly is the back pain? (e.g., upper, lower, one side)"
-        
-        # Default for "other"
-        return f"{name_str}When did this symptom start?"
-
-    # --- State 5: Symptom Deep Dive ---
-    
-    symptom_category = user_data.get("chief_complaint_category", "other")
-
-    # --- CHEST PAIN questions ---
-    if "describe the pain" in last_ai_question and symptom_category == "chest_pain":
-        return f"{name_str}Does the pain radiate to your arm, jaw, or back?"
-    if "radiate to your arm, jaw" in last_ai_question:
-        return f"{name_str}On a scale of 1-10, how severe is the pain?"
-    if "severe is the pain" in last_ai_question and symptom_category == "chest_pain":
-        return f"{name_str}Do you have any shortness of breath, nausea, or sweating with it?"
-    if "shortness of breath, nausea" in last_ai_question:
-        return f"{name_str}What were you doing when the pain started?"
-    if "when the pain started" in last_ai_question:
-        return f"{name_str}To get a complete picture, do you have any past medical history, like diabetes or high blood pressure?"
-        
-    # ... (Other symptom blocks remain the same) ...
-    
-    # --- ANKLE PAIN questions ---
-    if "start with an injury" in last_ai_question:
-        return f"{name_str}Are you able to put weight on it?"
-    if "put weight on it" in last_ai_question:
-        return f"{name_str}Is there any swelling or bruising?"
-    if "swelling or bruising" in last_ai_question:
-        return f"{name_str}On a scale of 1-10, how severe is the pain?"
-    if "severe is the pain" in last_ai_question and symptom_category == "ankle_pain":
-         return f"{name_str}To get a complete picture, do you have any past medical history, like arthritis or gout?"
-
-    # --- BACK PAIN questions ---
-    if "where exactly is the back pain" in last_ai_question:
-        return f"{name_str}Can you describe the pain? (e.g., sharp, dull ache, burning)"
-    if "describe the pain" in last_ai_question and symptom_category == "back_pain":
-        return f"{name_str}Does the pain shoot down your leg?"
-    if "shoot down your leg" in last_ai_question:
-        return f"{name_str}Is there any numbness or tingling?"
-    if "numbness or tingling" in last_ai_question:
-        return f"{name_str}What makes it better or worse (e.g., sitting, standing, lying down)?"
-    if "better or worse" in last_ai_question:
-        return f"{name_str}To get a complete picture, do you have any past medical history, like a previous back injury or arthritis?"
-
-    # --- NEW: DEFAULT/OTHER PATH ---
-    if symptom_category == "other":
-        if "when did this symptom start" in last_ai_question:
-            return f"{name_str}On a scale of 1-10, how severe is it?"
-        if "severe is the pain" in last_ai_question and symptom_category == "other":
-            return f"{name_str}Can you describe the symptom in more detail?"
-        if "describe the symptom" in last_ai_question:
-            return f"{name_str}To get a complete picture, do you have any past medical history, like diabetes or high blood pressure?"
-
-    # --- State 6: Medical History ---
-    if "past medical history" in last_ai_question:
-        return f"{name_str}Are you currently taking any medications for that or anything else?"
-    if "taking any medications" in last_ai_question:
-        return f"{name_str}And do you have any allergies to medications?"
-    if "any allergies" in last_ai_question:
-        return f"{name_str}Finally, have any of your family members (like parents or siblings) had similar issues?"
-    if "family members" in last_ai_question:
-        return "Thank you. I have all the information I need."
-        
-    # Fallback
-    return "Thank you. Please press I'm done to generate a report."
+    elif state == "ask_symptoms":
+        next_state = FIRST_SYMPTOM_STATE[get_symptom_category(history[-1].content)]
+    # States 5-6: Symptom deep dive and medical history
+    elif state == "family_history":
+        return INTERVIEW_DONE
+    else:
+        next_state = INTERVIEW_TRANSITIONS.get(state)
+        if isinstance(next_state, dict):
+            next_state = next_state.get(user_data.get("chief_complaint_category", "other"))
+
+    if next_state is None:
+        return INTERVIEW_FALLBACK
+    return f"{name_str}{INTERVIEW_QUESTIONS[next_state]}"
 
 # --- 6. Create the FastAPI Server ---
 
@@ -348,20 +453,21 @@ async def chat(request: ChatRequest):
 async def generate_report(request: ChatRequest):
     
     try:
-        # --- NEW: Get user data for the report header ---
+        # --- Extract the facts ONCE: report header + summarizer input ---
         facts = extract_facts_from_transcript(request.messages)
         patient_name = facts.get("name", "N/A")
         patient_age_gender = facts.get("age_gender", "N/A")
         
-        # --- Run tasks ONE AT A TIME ---
-        print("Starting report generation (Task 1: Summary)...")
-        # --- FIX: Pass the messages list, not the transcript string ---
-        summary_text = await summarizer_chain.ainvoke(request.messages)
-        
-        print("...Summary complete. (Task 2: Reasoning)...")
+        # --- Run both tasks CONCURRENTLY (they share no data) ---
+        # Ollama only overlaps them if it serves parallel requests (OLLAMA_NUM_PARALLEL > 1)
+        print("Starting report generation (Summary + Reasoning in parallel)...")
         # The reasoning chain still needs the simple string transcript
+        # (str.join materializes a generator into a list anyway, so the list comprehension is the faster input)
         transcript_string = "\n".join([f"{msg.role}: {msg.content}" for msg in request.messages])
-        report_body_data = await report_generation_chain.ainvoke({"transcript": transcript_string})
+        summary_text, report_body_data = await asyncio.gather(
+            summarizer_chain.ainvoke(facts),
+            report_generation_chain.ainvoke({"transcript": transcript_string})
+        )
         
         print("...Report tasks complete.")
         